@@ -1,192 +1,679 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Header, status, Form, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header, status, Form, Depends, Request, Body
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import uuid
 import os
+import json
 import base64
+import binascii
+import zlib
+import hashlib
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 import uuid
 from typing import List, Optional
 
-app = FastAPI()
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from auth import DUMMY_HASH, KeyResolver, LoginCache, hash_password, verify_password
+from cache import TTLCache
+from changes import ChangesExpired
+from compression import CompressionMiddleware, negotiate
+from idempotency import IdempotencyMiddleware
+from metrics import InstrumentedJSONResponse, MetricsMiddleware, registry, span
+from profiling import ProfilingMiddleware
+from ratelimit import AdmissionControl, AdmissionMiddleware, RateLimit, TokenBuckets
+from responses import FastJSONResponse, dumps
+from search import MIN_TEXT_LENGTH
+from photos import PhotoCollector, UploadLimiter, UploadSizeLimit, UploadsSaturated, UploadTooLarge, save_upload
+from storage import MemoryStorage, Storage
+from thumbnails import VARIANT_SIZES, ThumbnailPipeline, find_variant, remove_variants
+from validation import PetValidator
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    collector_task = asyncio.create_task(photo_collector.run())
+    try:
+        yield
+    finally:
+        collector_task.cancel()
+        thumbnails.shutdown()
+        upload_limiter.shutdown()
 
-users = {
-    "4c1b3391576925b36c1ce627f38ea92d112f1a6ba440352ef703b205": {
-        "username": "admin",
-        "password": "admin"
-    }
-}
 
-pets = []
+app = FastAPI(default_response_class=InstrumentedJSONResponse, lifespan=lifespan)
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
 
+def create_storage() -> Storage:
+    database = os.environ.get("PETS_DB")
+    if database:
+        from sqlite_storage import SQLiteStorage
 
-def check_key(key: str) -> bool:
-    return key in users
+        return SQLiteStorage(database, pool_size=int(os.environ.get("PETS_DB_POOL_SIZE", "8")))
+    data_dir = os.environ.get("PETS_DATA_DIR")
+    if data_dir:
+        from wal_storage import WALStorage
 
+        return WALStorage(data_dir, snapshot_every=int(os.environ.get("PETS_SNAPSHOT_EVERY", "100000")))
+    return MemoryStorage()
 
-def get_auth_key(auth_key: Optional[str] = Header(None, alias="auth-key")) -> str:
-    if not auth_key or not check_key(auth_key):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid auth_key"
+
+storage = create_storage()
+users = storage.users
+pets = storage.pets
+
+if users.key_for("admin") is None:
+    try:
+        users.add(
+            "4c1b3391576925b36c1ce627f38ea92d112f1a6ba440352ef703b205",
+            username="admin",
+            password_hash=hash_password("admin")
         )
-    return auth_key
+    except ValueError:
+        pass  # another worker process seeded it first
 
+login_cache = LoginCache()
+key_resolver = KeyResolver(users)
+storage.invalidations.subscribe("auth_key", key_resolver.invalidate)
 
-@app.get("/api/key", status_code=status.HTTP_200_OK)
-def login_user(username: str, password: str):
-    for key, value in users.items():
-        if value["username"] == username and value["password"] == password:
-            return {
-                "key": key
-            }
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid username or password"
+registry.collector(lambda: {
+    f"auth_key_cache_{name}": value for name, value in key_resolver.stats().items()
+})
+
+
+MAX_PHOTO_SIZE = 5 * 1024 * 1024
+MAX_SET_PHOTO_SIZE = 10 * 1024 * 1024
+
+
+def upload_size_limit(scope) -> Optional[int]:
+    path = scope["path"]
+    if scope["method"] != "POST":
+        return None
+    if path == "/api/pets":
+        return MAX_PHOTO_SIZE
+    if path.startswith("/api/pets/set_photo/"):
+        return MAX_SET_PHOTO_SIZE
+    return None
+
+
+app.add_middleware(UploadSizeLimit, limit=upload_size_limit)
+
+
+WORKERS = int(os.environ.get("PETS_WORKERS", "1"))
+
+
+def token_buckets(variable: str, default: str) -> TokenBuckets:
+    rate, burst = (float(part) for part in os.environ.get(variable, default).split("/"))
+    # Every worker keeps its own buckets, so each gets an equal share of the
+    # budget and a key spread over all of them still stays within it.
+    return TokenBuckets(rate=rate / WORKERS, burst=max(burst / WORKERS, 1.0))
+
+
+def request_budget(scope) -> Optional[str]:
+    path = scope["path"]
+    if path == "/metrics":
+        return None
+    if scope["method"] == "POST" and (path == "/api/pets" or path.startswith("/api/pets/set_photo/")):
+        return "upload"
+    if path.startswith("/api/pets/changes"):
+        return "feed"
+    return "request"
+
+
+rate_limits = {}
+if os.environ.get("PETS_RATE_LIMITS") != "0":
+    rate_limits["request"] = RateLimit(
+        per_key=token_buckets("PETS_KEY_RATE_LIMIT", "50/100"),
+        per_client=token_buckets("PETS_CLIENT_RATE_LIMIT", "200/400")
+    )
+    rate_limits["feed"] = rate_limits["request"]
+    rate_limits["upload"] = RateLimit(
+        per_key=token_buckets("PETS_KEY_UPLOAD_LIMIT", "1/20"),
+        per_client=token_buckets("PETS_CLIENT_UPLOAD_LIMIT", "5/50")
     )
+admission = AdmissionControl(
+    max_active=int(os.environ.get("PETS_MAX_ACTIVE_REQUESTS", "64")),
+    max_queued=int(os.environ.get("PETS_MAX_QUEUED_REQUESTS", "256")),
+    queue_timeout=float(os.environ.get("PETS_QUEUE_TIMEOUT", "5"))
+)
+registry.collector(lambda: {
+    "admission_active_requests": admission.active,
+    "admission_queued_requests": admission.queued,
+    **{
+        f"rate_limit_{name}_buckets": len(limit.per_key) + len(limit.per_client)
+        for name, limit in rate_limits.items() if name != "feed"
+    }
+})
+app.add_middleware(
+    AdmissionMiddleware, limits=rate_limits, admission=admission, budget=request_budget, unadmitted={"feed"}
+)
 
 
-@app.get("/api/pets", status_code=status.HTTP_200_OK)
-def get_pets(
-        auth_key: str = Depends(get_auth_key),
-        filter_type: Optional[str] = "my_pets"
-):
-    if filter_type == "my_pets":
-        return [pet for pet in pets if pet["user_id"] == auth_key]
-    return pets
+def idempotent_request(scope) -> bool:
+    path = scope["path"]
+    return scope["method"] == "POST" and (
+        path in ("/api/pets", "/api/create_pet_simple", "/api/pets/batch") or path.startswith("/api/pets/set_photo/")
+    )
 
 
-@app.post("/api/create_pet_simple", status_code=status.HTTP_201_CREATED)
-def create_simple_pet(
-        animal_type: str,
-        name: str,
-        age: int,
-        auth_key: str = Depends(get_auth_key)
-):
-    if not animal_type or not name:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Missing required fields: animal_type and name are required"
-        )
+idempotency_cache = TTLCache(
+    maxsize=int(os.environ.get("PETS_IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("PETS_IDEMPOTENCY_TTL", "86400"))
+)
+registry.collector(lambda: {"idempotency_cache_entries": len(idempotency_cache)})
+app.add_middleware(IdempotencyMiddleware, cache=idempotency_cache, applies=idempotent_request)
+compression_cache = TTLCache(maxsize=int(os.environ.get("PETS_COMPRESSION_CACHE_SIZE", "256")), ttl=300)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("PETS_COMPRESSION_MIN_SIZE", "1024")),
+    cache=compression_cache
+)
+
+PROFILE_DIR = Path(os.environ.get("PETS_PROFILE_DIR", "profiles"))
+app.add_middleware(
+    ProfilingMiddleware,
+    directory=PROFILE_DIR,
+    enabled=os.environ.get("PETS_PROFILING") == "1",
+    slow_threshold=float(os.environ.get("PETS_PROFILE_SLOW_MS", "200")) / 1000
+)
+app.add_middleware(MetricsMiddleware)
 
-    if age < 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Age cannot be negative"
+UPLOAD_DIR = Path("uploads")
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+photo_collector = PhotoCollector(UPLOAD_DIR, pets.photo_refcount, on_remove=remove_variants)
+thumbnails = ThumbnailPipeline(
+    max_workers=int(os.environ.get("PETS_THUMBNAIL_WORKERS", "2")),
+    webp=os.environ.get("PETS_PHOTO_WEBP") == "1"
+)
+PHOTO_SIZES = ("original", *VARIANT_SIZES)
+
+upload_limiter = UploadLimiter(
+    max_uploads=int(os.environ.get("PETS_MAX_UPLOADS", "16")),
+    max_per_user=int(os.environ.get("PETS_MAX_UPLOADS_PER_USER", "4")),
+    max_workers=int(os.environ.get("PETS_UPLOAD_WORKERS", "4"))
+)
+UPLOAD_RETRY_AFTER = "1"
+
+registry.collector(lambda: {"uploads_in_flight": upload_limiter.active})
+
+pet_validator = PetValidator()
+pet_versions = storage.versions
+pet_changes = storage.changes
+list_cache = TTLCache(maxsize=int(os.environ.get("PETS_LIST_CACHE_SIZE", "256")), ttl=300)
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+PET_FIELDS = ("pet_id", "user_id", "animal_type", "name", "age", "pet_photo", "created_at", "updated_at")
+MAX_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+DEFAULT_CHANGES_TIMEOUT = 30
+MAX_CHANGES_TIMEOUT = 60
+SSE_KEEPALIVE_INTERVAL = 15
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+class PetCreate(BaseModel):
+    animal_type: str
+    name: str
+    age: int
+
+
+class PetUpdate(BaseModel):
+    pet_id: str
+    name: Optional[str] = None
+    age: Optional[int] = None
+    animal_type: Optional[str] = None
+
+
+def photo_url(pet_id: str) -> str:
+    return f"/api/pets/{pet_id}/photo"
+
+
+def uploads_saturated(error: UploadsSaturated) -> HTTPException:
+    if error.per_user:
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many uploads in progress",
+            headers={"Retry-After": UPLOAD_RETRY_AFTER}
         )
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy processing uploads",
+        headers={"Retry-After": UPLOAD_RETRY_AFTER}
+    )
 
-    if age > 100:
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def check_photo_size(size: str):
+    if size not in PHOTO_SIZES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Age is unrealistic for a pet"
+            detail=f"Invalid photo size. Allowed: {', '.join(PHOTO_SIZES)}"
         )
 
-    allowed_animal_types = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
-    if animal_type.lower() not in allowed_animal_types:
+
+def check_page_limit(limit: int):
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid animal type. Allowed types: {', '.join(allowed_animal_types)}"
+            detail=f"Limit must be between 1 and {MAX_PAGE_LIMIT}"
         )
 
-    if len(name.strip()) < 2:
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, pet_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if datetime.fromisoformat(created_at).tzinfo is not None:
+            raise ValueError("created_at must be naive")
+        uuid.UUID(pet_id)
+    except (binascii.Error, ValueError, TypeError, AttributeError):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Name must be at least 2 characters long"
+            detail="Invalid cursor"
         )
+    return created_at, pet_id
+
 
-    if len(name.strip()) > 50:
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in PET_FIELDS]
+    if unknown or not selected:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Name cannot exceed 50 characters"
+            detail=f"Invalid fields. Allowed: {', '.join(PET_FIELDS)}"
         )
+    return selected
 
-    new_pet = {
+
+def new_pet_record(auth_key: str, animal_type: str, name: str, age: int) -> dict:
+    current_time = datetime.now().isoformat()
+    return {
         "pet_id": str(uuid.uuid4()),
         "user_id": auth_key,
-        "animal_type": animal_type.lower(),
-        "name": name.strip(),
+        "animal_type": animal_type,
+        "name": name,
         "age": age,
         "pet_photo": None,
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
+        "created_at": current_time,
+        "updated_at": current_time
     }
 
-    pets.append(new_pet)
-
-    return new_pet
-
 
-@app.post("/api/pets", status_code=status.HTTP_201_CREATED)
-async def create_pet_with_photo(
-        animal_type: str = Form(...),
-        name: str = Form(...),
-        age: int = Form(...),
-        pet_photo: UploadFile = File(None),
-        auth_key: str = Depends(get_auth_key)
-):
-    if not animal_type.strip():
+def check_batch_size(items: list):
+    if not items:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Animal type is required"
+            detail="Batch cannot be empty"
         )
 
-    if not name.strip():
+    if len(items) > MAX_BATCH_SIZE:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Name is required"
+            detail=f"Batch cannot exceed {MAX_BATCH_SIZE} items"
         )
 
-    if age < 0:
+
+def batch_error(index: int, error: HTTPException) -> dict:
+    return {"index": index, "status_code": error.status_code, "detail": error.detail}
+
+
+def check_key(key: str) -> bool:
+    return key_resolver.resolve(key) is not None
+
+
+def revoke_key(key: str) -> dict:
+    user = users.remove(key)
+    storage.invalidations.publish("auth_key", key)
+    return user
+
+
+def get_auth_key(auth_key: Optional[str] = Header(None, alias="auth-key")) -> str:
+    with span("auth"):
+        valid = bool(auth_key) and check_key(auth_key)
+    if not valid:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Age cannot be negative"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid auth_key"
         )
+    return auth_key
+
 
-    if age > 100:
+@app.get("/api/key", status_code=status.HTTP_200_OK)
+async def login_user(username: str, password: str):
+    key = login_cache.get(username, password)
+    if key is not None and check_key(key):
+        return {
+            "key": key
+        }
+
+    key = users.key_for(username)
+    user = users.get(key) if key is not None else None
+    password_hash = user["password_hash"] if user is not None else DUMMY_HASH
+    with span("password_verify"):
+        verified = await run_in_threadpool(verify_password, password, password_hash)
+    if not verified or user is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Age is unrealistic for a pet"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid username or password"
         )
 
-    allowed_animal_types = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
-    animal_type_clean = animal_type.strip().lower()
+    login_cache.set(username, password, key)
+    return {
+        "key": key
+    }
+
+
+@app.get("/api/pets", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+def get_pets(
+        request: Request,
+        auth_key: str = Depends(get_auth_key),
+        filter_type: Optional[str] = "my_pets",
+        limit: int = DEFAULT_PAGE_LIMIT,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        animal_type: Optional[str] = None,
+        min_age: Optional[int] = None,
+        max_age: Optional[int] = None,
+        name_prefix: Optional[str] = None,
+        photo_size: Optional[str] = None
+):
+    check_page_limit(limit)
+    after = decode_cursor(cursor) if cursor is not None else None
+    selected_fields = parse_fields(fields)
+    if photo_size is not None:
+        check_photo_size(photo_size)
+    if animal_type is not None:
+        animal_type = animal_type.strip().lower()
+
+    owner = auth_key if filter_type == "my_pets" else None
+    cache_key = (
+        owner, limit, cursor, tuple(selected_fields) if selected_fields is not None else None,
+        animal_type, min_age, max_age, name_prefix, photo_size,
+        pet_versions.epoch, pet_versions.get(owner)
+    )
+    etag = 'W/"' + hashlib.blake2b(repr(cache_key).encode(), digest_size=12).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL, "Vary": "auth-key"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = list_cache.get(cache_key)
+    if cached is None:
+        with span("store"):
+            items, next_key = pets.page(
+                user_id=owner,
+                after=after,
+                limit=limit,
+                animal_type=animal_type,
+                min_age=min_age,
+                max_age=max_age,
+                name_prefix=name_prefix
+            )
 
-    if animal_type_clean not in allowed_animal_types:
+        if photo_size is not None:
+            items = [
+                {**pet, "pet_photo": f"{pet['pet_photo']}?size={photo_size}"} if pet["pet_photo"] else pet
+                for pet in items
+            ]
+        if selected_fields is not None:
+            items = [{field: pet[field] for field in selected_fields} for pet in items]
+        body = FastJSONResponse(items).body
+        cached = (body, encode_cursor(next_key) if next_key is not None else None)
+        list_cache.set(cache_key, cached)
+
+    body, next_cursor = cached
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def iter_pets(**filters):
+    after = None
+    while True:
+        items, after = pets.page(after=after, limit=EXPORT_CHUNK_SIZE, **filters)
+        yield from items
+        if after is None:
+            return
+
+
+def ndjson_lines(items, selected_fields: Optional[List[str]] = None):
+    for pet in items:
+        if selected_fields is not None:
+            pet = {field: pet[field] for field in selected_fields}
+        yield dumps(pet) + b"\n"
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= 64 * 1024:
+            data = compressor.compress(b"".join(buffer))
+            buffer.clear()
+            buffered = 0
+            if data:
+                yield data
+    yield compressor.compress(b"".join(buffer)) + compressor.flush()
+
+
+@app.get("/api/pets/export", status_code=status.HTTP_200_OK)
+def export_pets(
+        request: Request,
+        auth_key: str = Depends(get_auth_key),
+        filter_type: Optional[str] = "my_pets",
+        fields: Optional[str] = None,
+        animal_type: Optional[str] = None,
+        min_age: Optional[int] = None,
+        max_age: Optional[int] = None,
+        name_prefix: Optional[str] = None
+):
+    selected_fields = parse_fields(fields)
+    items = iter_pets(
+        user_id=auth_key if filter_type == "my_pets" else None,
+        animal_type=animal_type.strip().lower() if animal_type is not None else None,
+        min_age=min_age,
+        max_age=max_age,
+        name_prefix=name_prefix
+    )
+    body = ndjson_lines(items, selected_fields)
+
+    headers = {"Vary": "Accept-Encoding"}
+    if negotiate(request.headers.get("accept-encoding", ""), ("gzip",)) == "gzip":
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+
+@app.get("/api/pets/search", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+def search_pets(
+        request: Request,
+        auth_key: str = Depends(get_auth_key),
+        q: Optional[str] = None,
+        filter_type: Optional[str] = "my_pets",
+        limit: int = DEFAULT_PAGE_LIMIT,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        animal_type: Optional[str] = None,
+        min_age: Optional[int] = None,
+        max_age: Optional[int] = None,
+        name_prefix: Optional[str] = None
+):
+    check_page_limit(limit)
+    after = decode_cursor(cursor) if cursor is not None else None
+    selected_fields = parse_fields(fields)
+    if q is not None:
+        q = q.strip()
+        if len(q) < MIN_TEXT_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Search text must be at least {MIN_TEXT_LENGTH} characters long"
+            )
+
+    with span("store"):
+        items, next_key = pets.search(
+            user_id=auth_key if filter_type == "my_pets" else None,
+            after=after,
+            limit=limit,
+            animal_type=animal_type.strip().lower() if animal_type is not None else None,
+            min_age=min_age,
+            max_age=max_age,
+            name_prefix=name_prefix,
+            text=q
+        )
+    if selected_fields is not None:
+        items = [{field: pet[field] for field in selected_fields} for pet in items]
+
+    headers = {"Cache-Control": PRIVATE_CACHE_CONTROL, "Vary": "auth-key"}
+    if next_key is not None:
+        next_cursor = encode_cursor(next_key)
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return FastJSONResponse(items, headers=headers)
+
+
+def read_changes(since: int, owner: Optional[str]):
+    try:
+        return pet_changes.since(since, owner)
+    except ChangesExpired:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid animal type. Allowed types: {', '.join(allowed_animal_types)}"
+            status_code=status.HTTP_410_GONE,
+            detail="Changes are no longer available, reload the pets"
         )
 
-    name_clean = name.strip()
-    if len(name_clean) < 2:
+
+@app.get("/api/pets/changes", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+async def get_pet_changes(
+        since: Optional[int] = None,
+        timeout: float = DEFAULT_CHANGES_TIMEOUT,
+        filter_type: Optional[str] = "my_pets",
+        auth_key: str = Depends(get_auth_key)
+):
+    if not 0 <= timeout <= MAX_CHANGES_TIMEOUT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Name must be at least 2 characters long"
+            detail=f"Timeout must be between 0 and {MAX_CHANGES_TIMEOUT} seconds"
         )
 
-    if len(name_clean) > 50:
+    if since is None:
+        return FastJSONResponse({"changes": [], "last_seq": pet_changes.last_seq})
+
+    owner = auth_key if filter_type == "my_pets" else None
+    deadline = time.monotonic() + timeout
+    while True:
+        items, last_seq = await run_in_threadpool(read_changes, since, owner)
+        remaining = deadline - time.monotonic()
+        if items or remaining <= 0:
+            return FastJSONResponse({"changes": items, "last_seq": last_seq})
+        since = last_seq
+        await pet_changes.wait(since, remaining)
+
+
+def sse_event(event: str, seq: int, data) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (seq, event.encode(), dumps(data))
+
+
+async def change_events(since: int, auth_key: str):
+    while check_key(auth_key):
+        try:
+            items, last_seq = await run_in_threadpool(pet_changes.since, since, auth_key)
+        except ChangesExpired:
+            since = pet_changes.last_seq
+            yield sse_event("reset", since, {"last_seq": since})
+            continue
+
+        if items:
+            yield b"".join(sse_event(item["type"], item["seq"], item) for item in items)
+        else:
+            yield b": keepalive\n\n"
+        since = last_seq
+        await pet_changes.wait(since, SSE_KEEPALIVE_INTERVAL)
+
+
+@app.get("/api/pets/changes/stream", status_code=status.HTTP_200_OK)
+async def stream_pet_changes(
+        since: Optional[int] = None,
+        last_event_id: Optional[int] = Header(None, alias="last-event-id"),
+        auth_key: str = Depends(get_auth_key)
+):
+    if last_event_id is not None:
+        since = last_event_id
+    if since is None:
+        since = pet_changes.last_seq
+    return StreamingResponse(
+        change_events(since, auth_key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/create_pet_simple", status_code=status.HTTP_201_CREATED)
+def create_simple_pet(
+        animal_type: str,
+        name: str,
+        age: int,
+        auth_key: str = Depends(get_auth_key)
+):
+    with span("validation"):
+        new_pet = new_pet_record(auth_key, **pet_validator.simple(animal_type, name, age))
+
+    with span("store"):
+        pets.add(new_pet)
+    pet_versions.bump(auth_key)
+    pet_changes.record("created", [new_pet])
+
+    return new_pet
+
+
+@app.post("/api/pets", status_code=status.HTTP_201_CREATED)
+async def create_pet_with_photo(
+        animal_type: str = Form(...),
+        name: str = Form(...),
+        age: int = Form(...),
+        pet_photo: UploadFile = File(None),
+        auth_key: str = Depends(get_auth_key)
+):
+    with span("validation"):
+        fields = pet_validator.form(animal_type, name, age)
+    name_clean = fields["name"]
+    animal_type_clean = fields["animal_type"]
+
+    if pets.has_name(auth_key, name_clean):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Name cannot exceed 50 characters"
+            detail="You already have a pet with this name"
         )
 
-    for pet in pets:
-        if pet["user_id"] == auth_key and pet["name"].lower() == name_clean.lower():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="You already have a pet with this name"
-            )
-
-    user_pet_count = sum(1 for pet in pets if pet["user_id"] == auth_key)
-    if user_pet_count >= 10:
+    if pets.count_for_user(auth_key) >= 10:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Maximum number of pets (10) reached"
         )
 
-    pet_photo = None
+    pet_id = str(uuid.uuid4())
+    photo_path = None
     if pet_photo and pet_photo.filename:
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
         allowed_content_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/bmp']
@@ -205,34 +692,25 @@ async def create_pet_with_photo(
                 detail="Invalid file type. Only images are allowed"
             )
 
-        file_size = 0
         try:
-            content = await pet_photo.read()
-            file_size = len(content)
-
-            if file_size > 5 * 1024 * 1024:  # 5MB
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="File too large. Maximum size is 5MB"
+            with upload_limiter.slot(auth_key), span("file_write"):
+                photo_path = await save_upload(
+                    pet_photo, UPLOAD_DIR, file_extension, MAX_PHOTO_SIZE, upload_limiter.executor, photo_collector
                 )
 
-            unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-            file_path = UPLOAD_DIR / unique_filename
-
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
-
-            pet_photo = str(file_path)
-
-            pet_photo.file.seek(0)
-
+        except UploadsSaturated as e:
+            raise uploads_saturated(e)
+        except UploadTooLarge:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File too large. Maximum size is 5MB"
+            )
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Error processing file: {str(e)}"
             )
 
-    pet_id = str(uuid.uuid4())
     current_time = datetime.now().isoformat()
 
     new_pet = {
@@ -241,12 +719,21 @@ async def create_pet_with_photo(
         "animal_type": animal_type_clean,
         "name": name_clean,
         "age": age,
-        "pet_photo": pet_photo,
+        "pet_photo": photo_url(pet_id) if photo_path else None,
         "created_at": current_time,
         "updated_at": current_time
     }
 
-    pets.append(new_pet)
+    try:
+        pets.add(new_pet)
+        if photo_path:
+            pets.set_photo_path(pet_id, photo_path)
+    finally:
+        photo_collector.unpin(photo_path)
+    if photo_path:
+        thumbnails.submit(photo_path)
+    pet_versions.bump(auth_key)
+    pet_changes.record("created", [new_pet])
 
     response_data = {
         "pet_id": pet_id,
@@ -254,35 +741,172 @@ async def create_pet_with_photo(
         "animal_type": animal_type_clean,
         "name": name_clean,
         "age": age,
-        "pet_photo": pet_photo,
+        "pet_photo": new_pet["pet_photo"],
         "created_at": current_time,
     }
 
     return response_data
 
 
-@app.delete("/api/pets/{pet_id}", status_code=status.HTTP_200_OK)
-def delete_pet(
-        pet_id: str,
+@app.post("/api/pets/batch", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+def create_pets_batch(
+        items: List[PetCreate] = Body(...),
+        atomic: bool = True,
+        auth_key: str = Depends(get_auth_key)
+):
+    check_batch_size(items)
+
+    results = []
+    new_pets = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            new_pet = new_pet_record(auth_key, **pet_validator.simple(item.animal_type, item.name, item.age))
+        except HTTPException as e:
+            errors.append(batch_error(index, e))
+            results.append(errors[-1])
+            continue
+        new_pets.append(new_pet)
+        results.append({"index": index, "status_code": status.HTTP_201_CREATED, "pet": new_pet})
+
+    if atomic and errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=errors
+        )
+
+    with span("store"):
+        pets.add_many(new_pets)
+    pet_versions.bump(auth_key)
+    pet_changes.record("created", new_pets)
+
+    return FastJSONResponse({"results": results})
+
+
+@app.patch("/api/pets/batch", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+def update_pets_batch(
+        items: List[PetUpdate] = Body(...),
+        atomic: bool = True,
         auth_key: str = Depends(get_auth_key)
 ):
-    for i, pet in enumerate(pets):
-        if pet["pet_id"] == pet_id:
+    check_batch_size(items)
+
+    results = []
+    updates = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            pet = pets.get(item.pet_id)
+            if pet is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Pet not found"
+                )
+
+            if pet["user_id"] != auth_key:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Permission denied"
+                )
+
+            changes = pet_validator.changes(item.name, item.age, item.animal_type)
+        except HTTPException as e:
+            errors.append(batch_error(index, e))
+            results.append(errors[-1])
+            continue
+        updates.append((pet, changes))
+        results.append({"index": index, "status_code": status.HTTP_200_OK, "pet": pet})
+
+    if atomic and errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=errors
+        )
+
+    updated = pets.update_many(updates)
+    pet_versions.bump(auth_key)
+    pet_changes.record("updated", updated)
+
+    return FastJSONResponse({"results": results})
+
+
+@app.delete("/api/pets/batch", status_code=status.HTTP_200_OK, response_class=FastJSONResponse)
+def delete_pets_batch(
+        pet_ids: List[str] = Body(...),
+        atomic: bool = True,
+        auth_key: str = Depends(get_auth_key)
+):
+    check_batch_size(pet_ids)
+
+    results = []
+    to_delete = []
+    seen = set()
+    errors = []
+    for index, pet_id in enumerate(pet_ids):
+        try:
+            pet = pets.get(pet_id)
+            if pet is None or pet_id in seen:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Pet not found"
+                )
+
             if pet["user_id"] != auth_key:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="You don't have permission to delete this pet"
                 )
+        except HTTPException as e:
+            errors.append(batch_error(index, e))
+            results.append(errors[-1])
+            continue
+        to_delete.append(pet_id)
+        seen.add(pet_id)
+        results.append({"index": index, "status_code": status.HTTP_200_OK, "pet_id": pet_id})
+
+    if atomic and errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=errors
+        )
 
-            deleted_pet = pets.pop(i)
-            return {
-                "message": "Pet deleted successfully",
-                "deleted_pet": deleted_pet
-            }
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Pet not found"
-    )
+    photo_paths = [pets.photo_path(pet_id) for pet_id in to_delete]
+    removed = pets.remove_many(to_delete)
+    pet_versions.bump(auth_key)
+    pet_changes.record("deleted", removed)
+    for photo_path in photo_paths:
+        photo_collector.track(photo_path)
+
+    return FastJSONResponse({"results": results})
+
+
+@app.delete("/api/pets/{pet_id}", status_code=status.HTTP_200_OK)
+def delete_pet(
+        pet_id: str,
+        auth_key: str = Depends(get_auth_key)
+):
+    pet = pets.get(pet_id)
+    if pet is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Pet not found"
+        )
+
+    if pet["user_id"] != auth_key:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have permission to delete this pet"
+        )
+
+    photo_path = pets.photo_path(pet_id)
+    deleted_pet = pets.remove(pet_id)
+    pet_versions.bump(auth_key)
+    pet_changes.record("deleted", [deleted_pet])
+    photo_collector.track(photo_path)
+    return {
+        "message": "Pet deleted successfully",
+        "deleted_pet": deleted_pet
+    }
 
 
 @app.put("/api/pets/{pet_id}", status_code=status.HTTP_200_OK)
@@ -293,27 +917,24 @@ def update_pet(
         animal_type: Optional[str] = None,
         auth_key: str = Depends(get_auth_key)
 ):
-    for pet in pets:
-        if pet["pet_id"] == pet_id:
-            if pet["user_id"] != auth_key:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Permission denied"
-                )
-
-            if name is not None:
-                pet["name"] = name
-            if age is not None:
-                pet["age"] = age
-            if animal_type is not None:
-                pet["animal_type"] = animal_type
+    pet = pets.get(pet_id)
+    if pet is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Pet not found"
+        )
 
-            return pet
+    if pet["user_id"] != auth_key:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
 
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Pet not found"
-    )
+    changes = pet_validator.changes(name, age, animal_type)
+    updated_pet = pets.update(pet, **changes)
+    pet_versions.bump(auth_key)
+    pet_changes.record("updated", [updated_pet])
+    return updated_pet
 
 
 @app.post("/api/pets/set_photo/{pet_id}", status_code=status.HTTP_200_OK)
@@ -322,11 +943,7 @@ async def set_photo(
         pet_photo: UploadFile = File(...),
         auth_key: str = Depends(get_auth_key)
 ):
-    pet_found = None
-    for pet in pets:
-        if pet["pet_id"] == pet_id:
-            pet_found = pet
-            break
+    pet_found = pets.get(pet_id)
 
     if not pet_found:
         raise HTTPException(
@@ -352,29 +969,33 @@ async def set_photo(
             detail="Invalid file type. Only JPG, JPEG or PNG formats are allowed"
         )
 
-    max_size = 10 * 1024 * 1024
-
-    content = await pet_photo.read()
-
-    if len(content) > max_size:
+    try:
+        with upload_limiter.slot(auth_key), span("file_write"):
+            file_path = await save_upload(
+                pet_photo, UPLOAD_DIR, file_extension, MAX_SET_PHOTO_SIZE, upload_limiter.executor, photo_collector
+            )
+    except UploadsSaturated as e:
+        raise uploads_saturated(e)
+    except UploadTooLarge:
         raise HTTPException(
             status_code=400,
             detail="File too large. Maximum size is 10MB"
         )
+    except OSError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing file: {str(e)}"
+        )
 
     try:
-
-        unique_filename = f"{pet_id}_{uuid.uuid4().hex}{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-
-        mime_type = "image/jpeg" if file_extension in ['.jpg', '.jpeg'] else "image/png"
-        base64_encoded = base64.b64encode(content).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{base64_encoded}"
-
-        pet_found["pet_photo"] = data_url
+        previous_path = pets.photo_path(pet_id)
+        pets.set_photo_path(pet_id, file_path)
+        thumbnails.submit(file_path)
+        if previous_path != file_path:
+            photo_collector.track(previous_path)
+        pets.update(pet_found, pet_photo=photo_url(pet_id))
+        pet_versions.bump(auth_key)
+        pet_changes.record("updated", [pet_found])
 
         if "updated_at" not in pet_found:
             pet_found["created_at"] = datetime.now().timestamp()
@@ -384,7 +1005,7 @@ async def set_photo(
             "name": pet_found.get("name", ""),
             "animal_type": pet_found.get("animal_type", ""),
             "age": pet_found.get("age", 0),
-            "pet_photo": data_url,
+            "pet_photo": pet_found["pet_photo"],
             "user_id": pet_found.get("user_id", auth_key),
             "created_at": pet_found.get("created_at", datetime.now().timestamp())
         }
@@ -394,10 +1015,102 @@ async def set_photo(
             status_code=500,
             detail=f"Error processing file: {str(e)}"
         )
+    finally:
+        photo_collector.unpin(file_path)
 
 
-if __name__ == "__main__":
+@app.get("/api/pets/{pet_id}/photo", status_code=status.HTTP_200_OK)
+def get_pet_photo(
+        pet_id: str,
+        request: Request,
+        size: str = "medium",
+        auth_key: str = Depends(get_auth_key)
+):
+    check_photo_size(size)
+
+    if pets.get(pet_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Pet not found"
+        )
+
+    file_path = pets.photo_path(pet_id)
+    if file_path is None or not file_path.is_file():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Photo not found"
+        )
+
+    variant = "original"
+    if size != "original":
+        variant_path = find_variant(file_path, size)
+        if variant_path is not None:
+            file_path, variant = variant_path, size
+
+    stat_result = file_path.stat()
+    headers = {
+        "ETag": f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "X-Photo-Variant": variant,
+        "Cache-Control": PRIVATE_CACHE_CONTROL,
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()
+        except (TypeError, ValueError):
+            since = None
+        if since is not None and int(stat_result.st_mtime) <= since:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(file_path, headers=headers, stat_result=stat_result)
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def main(argv=None):
+    import argparse
+    import socket
     import uvicorn
+    from uvicorn.supervisors import Multiprocess
+
+    parser = argparse.ArgumentParser(description="Run the pets API with uvicorn.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int,
+        help="run this many worker processes without auto-reload, sharing state through PETS_DB"
+    )
+    args = parser.parse_args(argv)
+
+    if args.workers is None:
+        uvicorn.run("api:app", host=args.host, port=args.port, reload=True)
+        return
+    if args.workers > 1:
+        if os.environ.get("PETS_DATA_DIR"):
+            parser.error("PETS_DATA_DIR can only be used by a single process, use PETS_DB with several workers")
+        os.environ.setdefault("PETS_DB", "pets.db")
+    os.environ["PETS_WORKERS"] = str(args.workers)
+    config = uvicorn.Config("api:app", host=args.host, port=args.port, workers=args.workers)
+    if config.workers == 1:
+        uvicorn.Server(config).run()
+        return
+    # uvicorn binds the shared socket with protocol 0, and asyncio only sets
+    # TCP_NODELAY on connections accepted from an IPPROTO_TCP socket; without
+    # it every small response waits for a delayed ACK.
+    bound = config.bind_socket()
+    sock = socket.socket(bound.family, bound.type, socket.IPPROTO_TCP, fileno=bound.detach())
+    sock.set_inheritable(True)
+    Multiprocess(config, sockets=[sock]).run()
 
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,12 @@
+from typing import Iterable, Optional, Tuple
+
+
+def header(headers: Iterable[Tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    """The first value of header ``name`` in a list of ASGI headers, or None if it is missing or empty.
+
+    ``name`` must be lowercase, as ASGI servers send header names.
+    """
+    for key, value in headers:
+        if key == name:
+            return value.decode("latin-1") or None
+    return None
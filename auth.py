@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import secrets
+from typing import Optional
+
+from cache import TTLCache
+from storage import BaseUserStore
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+
+
+def hash_password(password: str, salt: Optional[bytes] = None) -> str:
+    salt = salt or secrets.token_bytes(SALT_SIZE)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    try:
+        algorithm, n, r, p, salt, expected = encoded.split("$")
+    except ValueError:
+        return False
+    if algorithm != "scrypt":
+        return False
+    digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+# Verified against when the username is unknown, so both failure paths cost the same.
+DUMMY_HASH = hash_password(secrets.token_hex(8))
+
+
+class LoginCache:
+    """Recently verified credentials, keyed by an HMAC so plaintext is never stored."""
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0):
+        self._entries = TTLCache(maxsize, ttl)
+        self._secret = secrets.token_bytes(32)
+
+    def _digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self._secret, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def get(self, username: str, password: str) -> Optional[str]:
+        return self._entries.get(self._digest(username, password))
+
+    def set(self, username: str, password: str, key: str):
+        self._entries.set(self._digest(username, password), key)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class KeyResolver:
+    """Resolves auth keys to principals through positive and negative TTL caches.
+
+    Unknown keys are remembered for ``negative_ttl`` seconds so floods of
+    invalid keys don't each reach the user store.
+    """
+
+    def __init__(
+            self,
+            users: BaseUserStore,
+            maxsize: int = 10_000,
+            ttl: float = 60.0,
+            negative_maxsize: int = 10_000,
+            negative_ttl: float = 5.0
+    ):
+        self._users = users
+        self._positive = TTLCache(maxsize, ttl)
+        self._negative = TTLCache(negative_maxsize, negative_ttl)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def resolve(self, key: str) -> Optional[dict]:
+        principal = self._positive.get(key)
+        if principal is not None:
+            self.hits += 1
+            return principal
+        if key in self._negative:
+            self.negative_hits += 1
+            return None
+
+        self.misses += 1
+        user = self._users.get(key)
+        if user is None:
+            self._negative.set(key, True)
+            return None
+        principal = {"auth_key": key, "username": user["username"]}
+        self._positive.set(key, principal)
+        return principal
+
+    def invalidate(self, key: str):
+        self._positive.pop(key)
+        self._negative.pop(key)
+
+    def clear(self):
+        self._positive.clear()
+        self._negative.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "size": len(self._positive),
+            "negative_size": len(self._negative)
+        }
@@ -0,0 +1,92 @@
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0
+    }
+
+
+def measure(call: Callable[[int], bool], iterations: int) -> dict:
+    """Run ``call(i)`` ``iterations`` times; ``call`` returns False on a failed request."""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        begin = time.perf_counter()
+        ok = call(i)
+        latencies.append(time.perf_counter() - begin)
+        if not ok:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def current_rss_kb() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(name: str, results, output: Optional[str] = None, **extra) -> dict:
+    report = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        **extra,
+        "peak_rss_kb": peak_rss_kb(),
+        "results": results
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(",") if size]
@@ -0,0 +1,136 @@
+"""Bytes on the wire and CPU cost of compressed pet lists.
+
+Run from the repository root::
+
+    python -m benchmarks.compression --sizes 10,100,1000 --output compression.json
+
+For every list size the body ``GET /api/pets`` would send is compressed
+with each available encoding, reporting its size and the CPU time per
+compression. The same lists are then requested through ``TestClient``
+with ``Accept-Encoding`` set to each encoding, reporting the bytes
+received and the CPU time per request including the client, once with
+the list and compression caches cleared before every request and once
+served from them. brotli is only measured when the ``brotli`` package
+is installed.
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import api
+from benchmarks.common import parse_sizes, write_report
+from benchmarks.endpoints import ANIMAL_TYPES, ensure_bench_user
+from compression import available_encodings, gzip_compress
+from responses import dumps
+
+
+def seed(size: int, bench_key: str):
+    """Replace the store contents with ``size`` pets of the bench user, half of them with a photo."""
+    api.pets.clear()
+    base = datetime(2024, 1, 1)
+    pets = []
+    for i in range(size):
+        created_at = (base + timedelta(seconds=i)).isoformat(timespec="microseconds")
+        pet_id = str(uuid.uuid4())
+        pets.append({
+            "pet_id": pet_id,
+            "user_id": bench_key,
+            "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+            "name": f"Pet{i}",
+            "age": i % 30,
+            "pet_photo": api.photo_url(pet_id) if i % 2 else None,
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+    api.pets.add_many(pets)
+    api.pet_versions.bump(bench_key)
+
+
+def encoders():
+    encodings = {"identity": lambda body: body, "gzip level 1": lambda body: gzip_compress(body, level=1)}
+    for name, compress in available_encodings().items():
+        encodings[f"{name} (served)"] = compress
+    return encodings
+
+
+def cpu_ms(call, iterations: int) -> float:
+    started = time.process_time()
+    for i in range(iterations):
+        call(i)
+    return round((time.process_time() - started) / iterations * 1000, 4)
+
+
+def measure_encoders(size: int, bench_key: str, iterations: int) -> list:
+    body = dumps(api.pets.page(user_id=bench_key, limit=size)[0])
+    results = []
+    for name, compress in encoders().items():
+        compressed = compress(body)
+        results.append({
+            "scenario": "encoder",
+            "pets": size,
+            "encoding": name,
+            "bytes": len(compressed),
+            "ratio": round(len(body) / len(compressed), 2),
+            "cpu_ms": cpu_ms(lambda i: compress(body), iterations)
+        })
+    return results
+
+
+def measure_requests(client, size: int, bench_key: str, iterations: int) -> list:
+    results = []
+    for accept_encoding in ("identity", *available_encodings()):
+        headers = {"auth-key": bench_key, "Accept-Encoding": accept_encoding}
+        for cached in (False, True):
+            received = []
+
+            def request(i):
+                if not cached:
+                    api.list_cache.clear()
+                    api.compression_cache.clear()
+                response = client.get("/api/pets", headers=headers, params={"limit": size})
+                received.append(response.num_bytes_downloaded)
+
+            cost = cpu_ms(request, iterations)
+            results.append({
+                "scenario": "request",
+                "pets": size,
+                "accept_encoding": accept_encoding,
+                "cached": cached,
+                "bytes": received[0],
+                "cpu_ms": cost
+            })
+    return results
+
+
+def run(sizes, iterations: int):
+    bench_key = ensure_bench_user()
+    rate_limits = dict(api.rate_limits)
+    api.rate_limits.clear()
+    try:
+        seed(max(sizes), bench_key)
+        results = []
+        with TestClient(api.app) as client:
+            for size in sizes:
+                results.extend(measure_encoders(size, bench_key, iterations))
+                results.extend(measure_requests(client, size, bench_key, iterations))
+        return results
+    finally:
+        api.rate_limits.update(rate_limits)
+        api.pets.clear()
+        api.pet_versions.bump()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[10, 100, 1000], help="pets per list")
+    parser.add_argument("--iterations", type=int, default=200, help="compressions and requests per measurement")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    return write_report("compression", run(args.sizes, args.iterations), args.output, sizes=args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Throughput and latency of every endpoint at several store sizes.
+
+Run from the repository root::
+
+    python -m benchmarks.endpoints --sizes 1000,100000,1000000 --output bench.json
+
+Every size is measured in-process through ``TestClient`` and, when uvicorn
+is installed, over loopback HTTP against a uvicorn server started in a
+background thread of this process. Nothing leaves the machine.
+
+The configured store is cleared before every run; set ``PETS_DB`` to a
+scratch file to benchmark the SQLite backend. Rate limits are lifted while
+the benchmark runs.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+from fastapi.testclient import TestClient
+
+import api
+from auth import hash_password
+from benchmarks.common import current_rss_kb, measure, parse_sizes, write_report
+
+BENCH_KEY = "bench_" + uuid.uuid4().hex
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+OWNED_PETS = 100
+PETS_PER_OWNER = 100
+SEED_BATCH = 10_000
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+PHOTO = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+
+def ensure_bench_user():
+    if api.users.key_for(BENCH_USER) is None:
+        api.users.add(BENCH_KEY, username=BENCH_USER, password_hash=hash_password(BENCH_PASSWORD))
+    return api.users.key_for(BENCH_USER)
+
+
+def seed(size: int, bench_key: str):
+    """Replace the store contents with ``size`` pets, the first ``OWNED_PETS`` owned by the bench user."""
+    api.pets.clear()
+    owners = [f"owner_{i}" for i in range(max(1, size // PETS_PER_OWNER))]
+    base = datetime(2024, 1, 1)
+    batch = []
+    for i in range(size):
+        created_at = (base + timedelta(microseconds=i)).isoformat(timespec="microseconds")
+        batch.append({
+            "pet_id": str(uuid.uuid4()),
+            "user_id": bench_key if i < OWNED_PETS else owners[i % len(owners)],
+            "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+            "name": f"Pet{i}",
+            "age": i % 30,
+            "pet_photo": None,
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+        if len(batch) == SEED_BATCH:
+            api.pets.add_many(batch)
+            batch = []
+    if batch:
+        api.pets.add_many(batch)
+    api.pet_versions.bump()
+    return [pet["pet_id"] for pet in api.pets.for_user(bench_key)]
+
+
+def scenarios(client, bench_key: str, owned: list, iterations: int):
+    headers = {"auth-key": bench_key}
+    created = []
+    etags = {}
+
+    def ok(response) -> bool:
+        return response.status_code < 400
+
+    def login(i):
+        return ok(client.get("/api/key", params={"username": BENCH_USER, "password": BENCH_PASSWORD}))
+
+    def list_my_pets(i):
+        return ok(client.get("/api/pets", headers=headers))
+
+    def list_all_pets(i):
+        return ok(client.get("/api/pets", headers=headers, params={"filter_type": "all", "limit": 100}))
+
+    def list_my_pets_not_modified(i):
+        if "etag" not in etags:
+            etags["etag"] = client.get("/api/pets", headers=headers).headers["etag"]
+        response = client.get("/api/pets", headers={**headers, "If-None-Match": etags["etag"]})
+        return response.status_code == 304
+
+    def list_all_filtered(i):
+        params = {"filter_type": "all", "animal_type": "cat", "min_age": 5, "name_prefix": "pet1"}
+        return ok(client.get("/api/pets", headers=headers, params=params))
+
+    def export_all(i):
+        return ok(client.get("/api/pets/export", headers=headers, params={"filter_type": "all"}))
+
+    def create_simple(i):
+        response = client.post(
+            "/api/create_pet_simple",
+            headers=headers,
+            params={"animal_type": "dog", "name": f"Bench{i}", "age": 3}
+        )
+        if ok(response):
+            created.append(response.json()["pet_id"])
+        return ok(response)
+
+    def batch_create(i):
+        items = [{"animal_type": "cat", "name": f"Batch{i}_{j}", "age": 2} for j in range(100)]
+        response = client.post("/api/pets/batch", headers=headers, json=items)
+        if ok(response):
+            created.extend(result["pet"]["pet_id"] for result in response.json()["results"])
+        return ok(response)
+
+    def update(i):
+        pet_id = owned[i % len(owned)]
+        return ok(client.put(f"/api/pets/{pet_id}", headers=headers, params={"age": i % 30}))
+
+    def set_photo(i):
+        pet_id = owned[i % len(owned)]
+        files = {"pet_photo": ("photo.png", BytesIO(PHOTO), "image/png")}
+        return ok(client.post(f"/api/pets/set_photo/{pet_id}", headers=headers, files=files))
+
+    def get_photo(i):
+        pet_id = owned[i % len(owned)]
+        return ok(client.get(f"/api/pets/{pet_id}/photo", headers=headers))
+
+    def delete(i):
+        if not created:
+            return False
+        return ok(client.delete(f"/api/pets/{created.pop()}", headers=headers))
+
+    return [
+        ("GET /api/key", login, iterations),
+        ("GET /api/pets my_pets", list_my_pets, iterations),
+        ("GET /api/pets my_pets 304", list_my_pets_not_modified, iterations),
+        ("GET /api/pets all", list_all_pets, iterations),
+        ("GET /api/pets all filtered", list_all_filtered, iterations),
+        ("GET /api/pets/export all", export_all, max(1, iterations // 100)),
+        ("POST /api/create_pet_simple", create_simple, iterations),
+        ("POST /api/pets/batch x100", batch_create, max(1, iterations // 10)),
+        ("PUT /api/pets/{pet_id}", update, iterations),
+        ("POST /api/pets/set_photo/{pet_id}", set_photo, iterations),
+        ("GET /api/pets/{pet_id}/photo", get_photo, iterations),
+        ("DELETE /api/pets/{pet_id}", delete, iterations),
+    ]
+
+
+@contextmanager
+def uvicorn_server():
+    import uvicorn
+
+    config = uvicorn.Config(api.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+@contextmanager
+def client_for(mode: str):
+    if mode == "inprocess":
+        with TestClient(api.app) as client:
+            yield client
+    else:
+        with uvicorn_server() as base_url, httpx.Client(base_url=base_url, timeout=60) as client:
+            yield client
+
+
+def available_modes(requested):
+    modes = []
+    for mode in requested:
+        if mode == "uvicorn":
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                print("uvicorn is not installed, skipping the uvicorn mode", file=sys.stderr)
+                continue
+        modes.append(mode)
+    return modes
+
+
+def run(sizes, modes, iterations: int, only=None):
+    bench_key = ensure_bench_user()
+    upload_dir, api.UPLOAD_DIR = api.UPLOAD_DIR, Path(tempfile.mkdtemp(prefix="bench-uploads-"))
+    rate_limits = dict(api.rate_limits)
+    api.rate_limits.clear()
+    try:
+        return run_sizes(sizes, modes, iterations, bench_key, only)
+    finally:
+        api.rate_limits.update(rate_limits)
+        shutil.rmtree(api.UPLOAD_DIR, ignore_errors=True)
+        api.UPLOAD_DIR = upload_dir
+        api.pets.clear()
+        api.pet_versions.bump()
+
+
+def run_sizes(sizes, modes, iterations: int, bench_key: str, only=None):
+    results = []
+    for size in sizes:
+        for mode in modes:
+            owned = seed(size, bench_key)
+            with client_for(mode) as client:
+                for name, call, count in scenarios(client, bench_key, owned, iterations):
+                    if only and not any(part in name for part in only):
+                        continue
+                    summary = measure(call, count)
+                    results.append({
+                        "mode": mode,
+                        "pets": size,
+                        "endpoint": name,
+                        **summary,
+                        "rss_kb": current_rss_kb()
+                    })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--modes", default="inprocess,uvicorn")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--only", help="comma-separated substrings of endpoint names to run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    modes = available_modes(args.modes.split(","))
+    only = args.only.split(",") if args.only else None
+    results = run(args.sizes, modes, args.requests, only)
+    return write_report("endpoints", results, args.output, sizes=args.sizes, modes=modes,
+                        storage=type(api.storage).__name__)
+
+
+if __name__ == "__main__":
+    main()
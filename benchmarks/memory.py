@@ -0,0 +1,95 @@
+"""Bytes per pet held by the in-memory store.
+
+Run from the repository root::
+
+    python -m benchmarks.memory --sizes 100000,1000000 --output memory.json
+
+Pets are built the way the API builds them (``pet_validator.simple`` and
+``new_pet_record`` with an auth key decoded from a header per request) and
+added one by one. ``PetStore`` is compared with ``dict records``, the layout
+the store used before pets were kept as compact ``Pet`` objects: the API
+dicts themselves, indexed by pet_id and per user, plus the per-user name
+counts and the two ordering lists of ``(created_at, pet_id)`` tuples. Allocations are counted with
+tracemalloc.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from bisect import insort
+
+import api
+from benchmarks.common import parse_sizes, write_report
+from storage import PetStore, sort_key
+
+OWNERS = 1_000
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+
+
+def api_records(size: int):
+    owners = [f"{i:056x}".encode("latin-1") for i in range(OWNERS)]
+    for i in range(size):
+        auth_key = owners[i % OWNERS].decode("latin-1")
+        fields = api.pet_validator.simple(ANIMAL_TYPES[i % len(ANIMAL_TYPES)], f"Pet{i}", i % 30)
+        yield api.new_pet_record(auth_key, **fields)
+
+
+class DictRecords:
+    """The dict-per-pet layout the in-memory store used to keep."""
+
+    def __init__(self):
+        self.pets = {}
+        self.by_user = {}
+        self.names = {}
+        self.order = []
+        self.user_order = {}
+
+    def add(self, pet: dict):
+        self.pets[pet["pet_id"]] = pet
+        self.by_user.setdefault(pet["user_id"], {})[pet["pet_id"]] = pet
+        names = self.names.setdefault(pet["user_id"], {})
+        names[pet["name"].casefold()] = names.get(pet["name"].casefold(), 0) + 1
+        key = sort_key(pet)
+        insort(self.order, key)
+        insort(self.user_order.setdefault(pet["user_id"], []), key)
+
+
+def measure_layout(factory, size: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = factory()
+    for record in api_records(size):
+        store.add(record)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return {
+        "bytes": current,
+        "bytes_per_pet": round(current / size, 1),
+        "peak_bytes": peak,
+        "build_seconds": round(elapsed, 3)
+    }
+
+
+def run(sizes):
+    layouts = [("dict records", DictRecords), ("PetStore", PetStore)]
+    results = []
+    for size in sizes:
+        for name, factory in layouts:
+            results.append({"layout": name, "pets": size, **measure_layout(factory, size)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[100_000, 1_000_000])
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    return write_report("memory", run(args.sizes), args.output, sizes=args.sizes)
+
+
+if __name__ == "__main__":
+    main()
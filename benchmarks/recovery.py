@@ -0,0 +1,133 @@
+"""Startup time and write throughput of the write-ahead-log store.
+
+Run from the repository root::
+
+    python -m benchmarks.recovery --sizes 100000,1000000 --output recovery.json
+
+For every size a scratch directory is filled with that many pets in
+batches, then the store is reopened twice: once replaying the whole log,
+and once after a snapshot, loading it and replaying a tail of single-pet
+writes. Group commit is measured separately by timing single-pet writes
+from several threads at once and counting the fsyncs they needed.
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import current_rss_kb, parse_sizes, write_report
+from wal_storage import WALStorage
+
+BATCH = 10_000
+TAIL = 10_000
+OWNERS = 1_000
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+BASE_TIME = datetime(2024, 1, 1)
+
+
+def make_pet(i: int) -> dict:
+    created_at = (BASE_TIME + timedelta(microseconds=i)).isoformat()
+    return {
+        "pet_id": str(uuid.uuid4()),
+        "user_id": f"{i % OWNERS:056x}",
+        "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+        "name": f"Pet{i}",
+        "age": i % 30,
+        "pet_photo": None,
+        "created_at": created_at,
+        "updated_at": created_at
+    }
+
+
+def open_store(directory: Path):
+    started = time.perf_counter()
+    storage = WALStorage(directory, snapshot_every=10 ** 12)
+    return storage, round(time.perf_counter() - started, 3)
+
+
+def directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.iterdir())
+
+
+def measure_recovery(size: int, directory: Path) -> dict:
+    storage, _ = open_store(directory)
+    started = time.perf_counter()
+    for start in range(0, size, BATCH):
+        storage.pets.add_many([make_pet(i) for i in range(start, min(size, start + BATCH))])
+    load_seconds = time.perf_counter() - started
+    storage.close()
+    log_bytes = directory_size(directory)
+
+    storage, log_replay_seconds = open_store(directory)
+    assert len(storage.pets) == size
+    started = time.perf_counter()
+    storage.snapshot()
+    snapshot_seconds = time.perf_counter() - started
+    for i in range(size, size + TAIL):
+        storage.pets.add(make_pet(i))
+    storage.close()
+
+    storage, snapshot_startup_seconds = open_store(directory)
+    assert len(storage.pets) == size + TAIL
+    rss_kb = current_rss_kb()
+    storage.close()
+    return {
+        "pets": size,
+        "bulk_load_seconds": round(load_seconds, 3),
+        "log_bytes": log_bytes,
+        "startup_from_log_seconds": log_replay_seconds,
+        "snapshot_seconds": round(snapshot_seconds, 3),
+        "snapshot_bytes": directory_size(directory),
+        "tail_records": TAIL,
+        "startup_from_snapshot_seconds": snapshot_startup_seconds,
+        "rss_kb": rss_kb
+    }
+
+
+def measure_group_commit(directory: Path, threads: int, writes: int) -> dict:
+    storage, _ = open_store(directory)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda i: storage.pets.add(make_pet(i)), range(writes)))
+    elapsed = time.perf_counter() - started
+    commits = storage.log.commits
+    storage.close()
+    return {
+        "threads": threads,
+        "writes": writes,
+        "writes_per_second": round(writes / elapsed, 1),
+        "fsyncs": commits,
+        "writes_per_fsync": round(writes / commits, 2) if commits else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[100_000, 1_000_000])
+    parser.add_argument("--threads", type=parse_sizes, default=[1, 8, 32], help="writer threads for group commit")
+    parser.add_argument("--writes", type=int, default=2_000, help="writes per group commit run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        directory = Path(tempfile.mkdtemp(prefix="bench-wal-"))
+        try:
+            results.append({"scenario": "recovery", **measure_recovery(size, directory)})
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    for threads in args.threads:
+        directory = Path(tempfile.mkdtemp(prefix="bench-wal-"))
+        try:
+            results.append({"scenario": "group commit", **measure_group_commit(directory, threads, args.writes)})
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return write_report("recovery", results, args.output, sizes=args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Throughput of the multi-worker launch mode as workers are added.
+
+Run from the repository root::
+
+    python -m benchmarks.scaling --workers 1,2,4,8 --clients 16 --output scaling.json
+
+For every worker count ``python api.py --workers N`` is started on a free
+loopback port against a scratch SQLite database seeded with ``--pets``
+pets. Then ``--clients`` client processes send requests to one endpoint
+for ``--duration`` seconds. Throughput can only scale while there are
+idle cores left for both the workers and the clients.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+from auth import hash_password
+from benchmarks.common import ROOT, parse_sizes, write_report
+from sqlite_storage import SQLiteStorage
+
+BENCH_USER = "bench"
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+SCENARIOS = ("GET /api/pets", "POST /api/create_pet_simple")
+
+
+def seed(database: Path, size: int) -> str:
+    storage = SQLiteStorage(str(database), pool_size=1)
+    key = "bench_" + uuid.uuid4().hex
+    storage.users.add(key, username=BENCH_USER, password_hash=hash_password(BENCH_USER))
+    base = datetime(2024, 1, 1)
+    pets = []
+    for i in range(size):
+        created_at = (base + timedelta(microseconds=i)).isoformat()
+        pets.append({
+            "pet_id": str(uuid.uuid4()),
+            "user_id": key if i % 10 == 0 else f"owner_{i % 100}",
+            "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+            "name": f"Pet{i}",
+            "age": i % 30,
+            "pet_photo": None,
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+    storage.pets.add_many(pets)
+    storage.close()
+    return key
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(workers: int, database: Path, workdir: Path):
+    port = free_port()
+    env = {**os.environ, "PETS_DB": str(database), "PYTHONPATH": str(ROOT), "PETS_RATE_LIMITS": "0"}
+    env.pop("PETS_DATA_DIR", None)
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / "api.py"), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"api.py --workers {workers} exited with {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("server did not start in time")
+
+
+def client(args) -> int:
+    base_url, key, scenario, duration, client_id = args
+    headers = {"auth-key": key}
+    done = 0
+    with httpx.Client(base_url=base_url, timeout=30) as http:
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            if scenario == "GET /api/pets":
+                response = http.get("/api/pets", headers=headers, params={"filter_type": "all", "limit": 20})
+            else:
+                params = {"animal_type": "dog", "name": f"C{client_id}_{done}", "age": 1}
+                response = http.post("/api/create_pet_simple", headers=headers, params=params)
+            if response.status_code < 400:
+                done += 1
+    return done
+
+
+def run(worker_counts, clients: int, duration: float, size: int):
+    workdir = Path(tempfile.mkdtemp(prefix="bench-scaling-"))
+    results = []
+    try:
+        database = workdir / "pets.db"
+        key = seed(database, size)
+        baseline = {}
+        with multiprocessing.Pool(clients) as pool:
+            for workers in worker_counts:
+                process, base_url = start_server(workers, database, workdir)
+                try:
+                    for scenario in SCENARIOS:
+                        jobs = [(base_url, key, scenario, duration, i) for i in range(clients)]
+                        requests = sum(pool.map(client, jobs))
+                        throughput = requests / duration
+                        baseline.setdefault(scenario, throughput)
+                        results.append({
+                            "workers": workers,
+                            "endpoint": scenario,
+                            "clients": clients,
+                            "requests": requests,
+                            "throughput_rps": round(throughput, 1),
+                            "speedup": round(throughput / baseline[scenario], 2) if baseline[scenario] else None
+                        })
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=parse_sizes, default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint and worker count")
+    parser.add_argument("--pets", type=int, default=10_000, help="pets seeded into the database")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    results = run(args.workers, args.clients, args.duration, args.pets)
+    return write_report("scaling", results, args.output, cpus=os.cpu_count(), pets=args.pets)
+
+
+if __name__ == "__main__":
+    main()
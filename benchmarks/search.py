@@ -0,0 +1,116 @@
+"""Latency of pet searches answered from the secondary indexes.
+
+Run from the repository root::
+
+    python -m benchmarks.search --sizes 100000,1000000 --output search.json
+
+For every size an in-memory store is loaded with that many pets named
+after a handful of words, then each query runs ``--iterations`` times
+through ``PetStore.search``. Queries ``page`` can answer as well are also
+timed through its linear scan for comparison. The cost of keeping the
+indexes up to date is reported as the latency of single-pet adds, renames
+and removes on the loaded store, and their memory as the RSS growth of
+building a second copy of them.
+"""
+import argparse
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.common import current_rss_kb, measure, parse_sizes, write_report
+from search import PetIndex
+from storage import Pet, PetStore
+
+OWNERS = 1_000
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+WORDS = ["Snowball", "Max", "Bella", "Charlie", "Luna", "Rocky", "Daisy", "Oscar", "Whiskers", "Bubbles"]
+BASE_TIME = datetime(2024, 1, 1)
+
+QUERIES = [
+    ("rare substring", {"text": "kers12345"}),
+    ("common substring", {"text": "ball"}),
+    ("substring of one owner", {"user_id": f"{7:056x}", "text": "luna"}),
+    ("name prefix", {"name_prefix": "rocky9999"}),
+    ("animal type", {"animal_type": "parrot"}),
+    ("animal type and age", {"animal_type": "fish", "min_age": 27}),
+    ("age and prefix", {"min_age": 1, "max_age": 1, "name_prefix": "max"}),
+    ("substring and age", {"text": "harlie", "min_age": 13, "max_age": 15}),
+    ("no match on two conditions", {"min_age": 3, "max_age": 3, "name_prefix": "bub"}),
+]
+
+
+def make_pet(i: int) -> dict:
+    created_at = (BASE_TIME + timedelta(microseconds=i)).isoformat()
+    return {
+        "pet_id": str(uuid.uuid4()),
+        "user_id": f"{i % OWNERS:056x}",
+        "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+        "name": f"{WORDS[i % len(WORDS)]}{i}",
+        "age": i % 30,
+        "pet_photo": None,
+        "created_at": created_at,
+        "updated_at": created_at
+    }
+
+
+def load(size: int) -> PetStore:
+    store = PetStore()
+    store.load_rows([Pet(make_pet(i)).row() for i in range(size)])
+    return store
+
+
+def index_rss_kb(store: PetStore):
+    """RSS growth of building a second copy of the store's indexes."""
+    index = PetIndex(store._pets)
+    before = current_rss_kb()
+    index.build(store._pets.values())
+    after = current_rss_kb()
+    return after - before if before is not None and after is not None else None
+
+
+def measure_writes(store: PetStore, size: int, iterations: int) -> list:
+    pets = [make_pet(size + i) for i in range(iterations)]
+    results = []
+    for name, call in (
+            ("add", lambda i: store.add(pets[i]) is not None),
+            ("rename", lambda i: store.update(pets[i], name=f"Renamed{i}", age=i % 30) is not None),
+            ("remove", lambda i: store.remove(pets[i]["pet_id"]) is not None),
+    ):
+        results.append({"write": name, "pets": size, **measure(call, iterations)})
+    return results
+
+
+def run(sizes, iterations: int, limit: int):
+    results = []
+    for size in sizes:
+        store = load(size)
+        rss_kb = index_rss_kb(store)
+        for name, filters in QUERIES:
+            found = len(store.search(limit=limit, **filters)[0])
+            entry = {
+                "query": name,
+                "pets": size,
+                "found": found,
+                "index_rss_kb": rss_kb,
+                **measure(lambda i: store.search(limit=limit, **filters) is not None, iterations)
+            }
+            if "text" not in filters:
+                scan = measure(lambda i: store.page(limit=limit, **filters) is not None, max(1, iterations // 100))
+                entry["page_p50_ms"] = scan["p50_ms"]
+            results.append(entry)
+        results.extend(measure_writes(store, size, iterations))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[100_000, 1_000_000])
+    parser.add_argument("--iterations", type=int, default=1_000, help="runs per query and write kind")
+    parser.add_argument("--limit", type=int, default=100, help="page size of every search")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    return write_report("search", run(args.sizes, args.iterations, args.limit), args.output,
+                        sizes=args.sizes, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Time to serialize lists of pets for a response.
+
+Run from the repository root::
+
+    python -m benchmarks.serialization --sizes 10000,100000 --output serialization.json
+
+Compares FastAPI's default path (``jsonable_encoder`` followed by the
+stdlib-based ``JSONResponse``) with ``FastJSONResponse`` as used by the
+list, batch and export endpoints, both with orjson and with its stdlib
+fallback.
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import responses
+from benchmarks.common import parse_sizes, summarize, write_report
+from responses import FastJSONResponse
+
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+
+
+def make_pets(size: int):
+    base = datetime(2024, 1, 1)
+    pets = []
+    for i in range(size):
+        created_at = (base + timedelta(seconds=i)).isoformat()
+        pets.append({
+            "pet_id": str(uuid.uuid4()),
+            "user_id": f"{i % 1000:056x}",
+            "animal_type": ANIMAL_TYPES[i % len(ANIMAL_TYPES)],
+            "name": f"Pet{i}",
+            "age": i % 30,
+            "pet_photo": None,
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+    return pets
+
+
+def default_path(pets):
+    return JSONResponse(jsonable_encoder(pets)).body
+
+
+def fast_path(pets):
+    return FastJSONResponse(pets).body
+
+
+def fallback_path(pets):
+    orjson, responses.orjson = responses.orjson, None
+    try:
+        return FastJSONResponse(pets).body
+    finally:
+        responses.orjson = orjson
+
+
+def time_path(render, pets, repeats: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        render(pets)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run(sizes, repeats: int):
+    paths = [("jsonable_encoder + JSONResponse", default_path), ("FastJSONResponse", fast_path)]
+    if responses.orjson is not None:
+        paths.append(("FastJSONResponse without orjson", fallback_path))
+    results = []
+    for size in sizes:
+        pets = make_pets(size)
+        baseline = None
+        for name, render in paths:
+            summary = time_path(render, pets, repeats)
+            baseline = baseline or summary["p50_ms"]
+            results.append({
+                "path": name,
+                "pets": size,
+                "bytes": len(render(pets)),
+                **summary,
+                "speedup": round(baseline / summary["p50_ms"], 2) if summary["p50_ms"] else None
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=10, help="renders per path and size")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    return write_report("serialization", run(args.sizes, args.repeats), args.output, sizes=args.sizes,
+                        orjson=responses.orjson is not None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Validations per second of the pet write payload checks.
+
+Run from the repository root::
+
+    python -m benchmarks.validation --iterations 200000 --output validation.json
+
+``PetValidator`` is compared with the checks the endpoints used to run
+inline: ``simple`` with the old ``validate_simple_pet`` helpers and ``form``
+with the code of ``create_pet_with_photo``, which rebuilt the list of
+animal types on every call. Each path runs once over valid payloads and
+once over payloads that fail the last check, so every check runs; the
+fastest of ``--rounds`` runs is reported.
+"""
+import argparse
+import time
+
+from fastapi import HTTPException, status
+
+from benchmarks.common import write_report
+from validation import PetValidator
+
+ANIMAL_TYPES = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+
+
+def legacy_validate_age(age: int):
+    if age < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Age cannot be negative")
+    if age > 100:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Age is unrealistic for a pet")
+
+
+def legacy_validate_animal_type(animal_type: str) -> str:
+    if animal_type.lower() not in ANIMAL_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid animal type. Allowed types: {', '.join(ANIMAL_TYPES)}"
+        )
+    return animal_type.lower()
+
+
+def legacy_validate_name(name: str) -> str:
+    if len(name.strip()) < 2:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name must be at least 2 characters long")
+    if len(name.strip()) > 50:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name cannot exceed 50 characters")
+    return name.strip()
+
+
+def legacy_validate_simple_pet(animal_type: str, name: str, age: int) -> dict:
+    if not animal_type or not name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing required fields: animal_type and name are required"
+        )
+    legacy_validate_age(age)
+    return {
+        "animal_type": legacy_validate_animal_type(animal_type),
+        "name": legacy_validate_name(name),
+        "age": age
+    }
+
+
+def legacy_form(animal_type: str, name: str, age: int) -> dict:
+    if not animal_type.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Animal type is required")
+    if not name.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name is required")
+    if age < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Age cannot be negative")
+    if age > 100:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Age is unrealistic for a pet")
+    allowed_animal_types = ["dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other"]
+    animal_type_clean = animal_type.strip().lower()
+    if animal_type_clean not in allowed_animal_types:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid animal type. Allowed types: {', '.join(allowed_animal_types)}"
+        )
+    name_clean = name.strip()
+    if len(name_clean) < 2:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name must be at least 2 characters long")
+    if len(name_clean) > 50:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name cannot exceed 50 characters")
+    return {"animal_type": animal_type_clean, "name": name_clean, "age": age}
+
+
+def payloads(kind: str):
+    if kind == "valid":
+        return [(ANIMAL_TYPES[i % len(ANIMAL_TYPES)].title(), f" Pet{i} ", i % 30) for i in range(1000)]
+    return [(ANIMAL_TYPES[i % len(ANIMAL_TYPES)], "N" * 51, i % 30) for i in range(1000)]
+
+
+def time_path(validate, inputs, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        try:
+            validate(*inputs[i % len(inputs)])
+        except HTTPException:
+            pass
+    return time.perf_counter() - started
+
+
+def run(iterations: int, rounds: int):
+    validator = PetValidator()
+    paths = [
+        ("simple", "validate_simple_pet", legacy_validate_simple_pet),
+        ("simple", "PetValidator.simple", validator.simple),
+        ("form", "create_pet_with_photo inline", legacy_form),
+        ("form", "PetValidator.form", validator.form),
+    ]
+    results = []
+    for kind in ("valid", "invalid"):
+        inputs = payloads(kind)
+        baselines = {}
+        for endpoint, name, validate in paths:
+            elapsed = min(time_path(validate, inputs, iterations) for _ in range(rounds))
+            per_second = iterations / elapsed
+            baseline = baselines.setdefault(endpoint, per_second)
+            results.append({
+                "endpoint": endpoint,
+                "path": name,
+                "input": kind,
+                "validations": iterations,
+                "validations_per_second": round(per_second),
+                "ns_per_validation": round(elapsed / iterations * 1e9),
+                "speedup": round(per_second / baseline, 2)
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200_000, help="validations per path and input kind")
+    parser.add_argument("--rounds", type=int, default=5, help="runs per path, the fastest counts")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    return write_report("validation", run(args.iterations, args.rounds), args.output, iterations=args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class VersionCounter:
+    """Version numbers for all data and for the data of each owner.
+
+    Every ``bump`` advances the global version and stamps it on the given
+    owners. Call it after the write has been stored, so that a reader never
+    pairs a new version with old data. ``epoch`` differs between processes
+    and keeps versions from before a restart from matching new ones.
+    """
+
+    def __init__(self):
+        self.epoch = os.urandom(4).hex()
+        self._current = 0
+        self._by_owner: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *owners: Hashable):
+        with self._lock:
+            self._current += 1
+            for owner in owners:
+                self._by_owner[owner] = self._current
+
+    def get(self, owner: Optional[Hashable] = None) -> int:
+        if owner is None:
+            return self._current
+        return self._by_owner.get(owner, 0)
+
+
+class InvalidationBus:
+    """Delivers cache invalidations to the subscribers in this process.
+
+    Backends shared by several worker processes subclass it to forward
+    published messages to the other workers as well.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+
+    def subscribe(self, topic: str, callback: Callable[[str], None]):
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic: str, key: str):
+        self.deliver(topic, key)
+
+    def deliver(self, topic: str, key: str):
+        for callback in self._subscribers.get(topic, ()):
+            callback(key)
+
+    def close(self):
+        pass
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+
+class ChangesExpired(Exception):
+    pass
+
+
+def change(seq: int, kind: str, pet: dict, changed_at: str) -> dict:
+    return {
+        "seq": seq,
+        "type": kind,
+        "pet_id": pet["pet_id"],
+        "user_id": pet["user_id"],
+        "pet": None if kind == "deleted" else dict(pet),
+        "changed_at": changed_at
+    }
+
+
+class ChangeFeed:
+    """Numbered log of pet changes kept in a ring buffer of ``capacity`` entries.
+
+    Every change gets the next sequence number. ``since`` returns the
+    changes after a number and ``wait`` lets coroutines sleep until there
+    are any. The numbers of an in-memory feed start at the current time in
+    microseconds, so they keep growing across restarts. A reader that is
+    more than ``capacity`` changes behind, or holds a number from another
+    run, gets ``ChangesExpired`` and has to reload the pets.
+    """
+
+    def __init__(self, capacity: int = 10_000):
+        self.capacity = capacity
+        self._ring: List[Optional[dict]] = [None] * capacity
+        self._first = self._last = time.time_ns() // 1000
+        self._lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last
+
+    def record(self, kind: str, pets: List[dict]) -> int:
+        """Append one change of type ``kind`` per pet: ``created``, ``updated`` or ``deleted``."""
+        changed_at = datetime.now().isoformat()
+        with self._lock:
+            for pet in pets:
+                self._last += 1
+                self._ring[self._last % self.capacity] = change(self._last, kind, pet, changed_at)
+            last = self._last
+        self.notify()
+        return last
+
+    def since(self, seq: int, user_id: Optional[str] = None) -> Tuple[List[dict], int]:
+        """Return the changes after ``seq``, optionally of one owner's pets, and the last number."""
+        with self._lock:
+            last = self._last
+            if seq > last or seq < max(self._first, last - self.capacity):
+                raise ChangesExpired(seq)
+            changes = [self._ring[number % self.capacity] for number in range(seq + 1, last + 1)]
+        if user_id is not None:
+            changes = [item for item in changes if item["user_id"] == user_id]
+        return changes, last
+
+    async def wait(self, seq: int, timeout: float):
+        """Return once there are changes after ``seq`` or ``timeout`` seconds have passed."""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            if self._last > seq:
+                return
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def notify(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # the loop of an abandoned waiter is closed
+
+    def close(self):
+        pass
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,148 @@
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from asgi import header
+from cache import TTLCache
+from metrics import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/javascript", "application/xml", "image/svg+xml"
+}
+
+
+def gzip_compress(body: bytes, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def brotli_compress(body: bytes, quality: int = 4) -> bytes:
+    return brotli.compress(body, quality=quality)
+
+
+def available_encodings() -> Dict[str, Callable[[bytes], bytes]]:
+    """Encodings this process can produce, in order of preference."""
+    encodings = {}
+    if brotli is not None:
+        encodings["br"] = brotli_compress
+    encodings["gzip"] = gzip_compress
+    return encodings
+
+
+def negotiate(accept_encoding: str, encodings) -> Optional[str]:
+    """Pick the encoding the client ranks highest, preferring ``encodings`` order on ties."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """Compresses complete response bodies with the best encoding the client accepts.
+
+    Only text and JSON-like bodies of at least ``minimum_size`` bytes are
+    compressed; images and other binary types, bodies that already have a
+    ``Content-Encoding`` and streamed responses pass through untouched.
+    Bodies of ``thread_size`` bytes or more are compressed in the thread
+    pool instead of on the event loop. Compressed responses get a weak
+    version of their ``ETag``, and results are kept in ``cache`` under it,
+    so a list served from the list cache is not compressed again.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, thread_size: int = 64 * 1024,
+                 encodings: Optional[Dict[str, Callable[[bytes], bytes]]] = None, cache: Optional[TTLCache] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+        self.encodings = encodings if encodings is not None else available_encodings()
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(header(scope["headers"], b"accept-encoding") or "", self.encodings)
+        pending = None
+
+        async def compress(message):
+            nonlocal pending
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if compressible(header(headers, b"content-type") or "") and \
+                        header(headers, b"content-encoding") is None:
+                    pending = message
+                else:
+                    await send(message)
+                return
+            if pending is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            response_start, pending = pending, None
+            headers = _vary(response_start.get("headers", []))
+            if message.get("more_body", False) or encoding is None or len(body) < self.minimum_size:
+                await send({**response_start, "headers": headers})
+                await send(message)
+                return
+            etag = header(headers, b"etag")
+            with span("compression"):
+                body = await self._compress(body, encoding, etag)
+            headers = [
+                (name, value) for name, value in headers if name not in (b"content-length", b"etag")
+            ]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            if etag is not None:
+                headers.append((b"etag", (etag if etag.startswith("W/") else "W/" + etag).encode("latin-1")))
+            await send({**response_start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compress)
+
+    async def _compress(self, body: bytes, encoding: str, etag: Optional[str]) -> bytes:
+        key = (etag, encoding)
+        if etag is not None and self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if len(body) >= self.thread_size:
+            compressed = await run_in_threadpool(self.encodings[encoding], body)
+        else:
+            compressed = self.encodings[encoding](body)
+        if etag is not None and self.cache is not None:
+            self.cache.set(key, compressed)
+        return compressed
+
+
+def _vary(headers: List[tuple]) -> List[tuple]:
+    """``headers`` with ``Accept-Encoding`` added to ``Vary``."""
+    vary = [value.decode("latin-1") for name, value in headers if name == b"vary"]
+    tokens = [token.strip().lower() for value in vary for token in value.split(",")]
+    if "accept-encoding" in tokens or "*" in tokens:
+        return list(headers)
+    value = ", ".join([*vary, "Accept-Encoding"])
+    return [*(header for header in headers if header[0] != b"vary"), (b"vary", value.encode("latin-1"))]
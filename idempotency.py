@@ -0,0 +1,111 @@
+import asyncio
+from typing import Callable, Dict, Hashable, List, NamedTuple
+
+from starlette.responses import JSONResponse
+
+from asgi import header
+from cache import TTLCache
+from metrics import Registry, registry
+
+
+class StoredResponse(NamedTuple):
+    path: str
+    status: int
+    headers: List[tuple]
+    body: bytes
+
+
+class IdempotencyMiddleware:
+    """Answers retries of a request carrying the same ``Idempotency-Key`` with the first response.
+
+    Applies to the requests ``applies(scope)`` accepts. Successful
+    responses of up to ``max_body_size`` bytes are kept in ``cache`` under
+    the auth key and idempotency key and replayed with an
+    ``Idempotent-Replayed`` header. A duplicate that arrives while the
+    first request is still running waits for it instead of running too; if
+    the first one fails, the next duplicate runs in its place. Errors are
+    never stored, so a client can retry after one. Must be used from one
+    event loop.
+    """
+
+    def __init__(self, app, cache: TTLCache, applies: Callable[[dict], bool], max_key_length: int = 255,
+                 max_body_size: int = 1024 * 1024, registry: Registry = registry):
+        self.app = app
+        self.cache = cache
+        self.applies = applies
+        self.max_key_length = max_key_length
+        self.max_body_size = max_body_size
+        self.registry = registry
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.applies(scope):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = header(scope["headers"], b"idempotency-key")
+        auth_key = header(scope["headers"], b"auth-key")
+        if idempotency_key is None or auth_key is None:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > self.max_key_length:
+            response = JSONResponse(
+                {"detail": f"Idempotency-Key cannot exceed {self.max_key_length} characters"},
+                status_code=400
+            )
+            await response(scope, receive, send)
+            return
+
+        key = (auth_key, idempotency_key)
+        waited = False
+        while True:
+            stored = self.cache.get(key)
+            if stored is not None:
+                await self._replay(stored, waited, scope, receive, send)
+                return
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            waited = True
+            await asyncio.shield(pending)
+
+        self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._run(key, scope, receive, send)
+        finally:
+            self._pending.pop(key).set_result(None)
+
+    async def _run(self, key: Hashable, scope, receive, send):
+        start = None
+        chunks = []
+        size = 0
+
+        async def capture(message):
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body" and size <= self.max_body_size:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+            await send(message)
+
+        await self.app(scope, receive, capture)
+        if start is not None and 200 <= start["status"] < 300 and size <= self.max_body_size:
+            self.cache.set(key, StoredResponse(scope["path"], start["status"], list(start.get("headers", [])),
+                                               b"".join(chunks)))
+
+    async def _replay(self, stored: StoredResponse, waited: bool, scope, receive, send):
+        if stored.path != scope["path"]:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used for another request"},
+                status_code=422
+            )
+            await response(scope, receive, send)
+            return
+        self.registry.inc("http_idempotent_replays_total", waited=str(waited).lower())
+        await send({
+            "type": "http.response.start",
+            "status": stored.status,
+            "headers": [*stored.headers, (b"idempotent-replayed", b"true")]
+        })
+        await send({"type": "http.response.body", "body": stored.body})
+
@@ -0,0 +1,184 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ("counter", help_text)
+        self._counters.setdefault(name, {})
+
+    def gauge(self, name: str, help_text: str):
+        self._help[name] = ("gauge", help_text)
+        self._gauges.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._help[name] = ("histogram", help_text)
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+
+    def collector(self, collect: Callable[[], Dict[str, float]]):
+        """Register a callable returning ``{metric_name: value}`` gauges read at scrape time."""
+        self._collectors.append(collect)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def add(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._gauges[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets[name])
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._help.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    lines.extend(f"{name}{_format(key)} {value}" for key, value in self._counters[name].items())
+                elif kind == "gauge":
+                    lines.extend(f"{name}{_format(key)} {value}" for key, value in self._gauges[name].items())
+                else:
+                    for key, histogram in self._histograms[name].items():
+                        cumulative = 0
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{_format(key + (('le', repr(bound)),))} {cumulative}")
+                        lines.append(f"{name}_bucket{_format(key + (('le', '+Inf'),))} {histogram.count}")
+                        lines.append(f"{name}_sum{_format(key)} {histogram.sum}")
+                        lines.append(f"{name}_count{_format(key)} {histogram.count}")
+        for collect in self._collectors:
+            for name, value in collect().items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+registry.counter("http_requests_total", "HTTP requests by route, method and status code.")
+registry.counter("http_request_errors_total", "HTTP requests that ended with a 4xx/5xx status or an exception.")
+registry.histogram("http_request_duration_seconds", "Time spent serving HTTP requests.")
+registry.histogram("http_response_size_bytes", "Size of HTTP response bodies.", SIZE_BUCKETS)
+registry.gauge("http_requests_in_flight", "HTTP requests currently being served.")
+registry.counter("http_requests_rejected_total", "HTTP requests refused by rate limits or admission control.")
+registry.counter("http_idempotent_replays_total", "Retried requests answered with the stored first response.")
+registry.histogram("stage_duration_seconds", "Time spent in internal stages of request handling.")
+
+span = registry.span
+
+
+class InstrumentedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with span("serialization"):
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """Records latency, status, response size and in-flight count for every HTTP request."""
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        self.registry.add("http_requests_in_flight", 1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            status_code = 500
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.registry.add("http_requests_in_flight", -1)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route is not None else "unmatched"}
+            self.registry.inc("http_requests_total", status=status_code, **labels)
+            if status_code >= 400:
+                self.registry.inc("http_request_errors_total", status=status_code, **labels)
+            self.registry.observe("http_request_duration_seconds", elapsed, **labels)
+            self.registry.observe("http_response_size_bytes", size, **labels)
@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from asgi import header
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = ".part"
+SUFFIX_ALIASES = {".jpeg": ".jpg"}
+# Room for the boundaries, part headers and other fields of a multipart form.
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadsSaturated(Exception):
+    def __init__(self, per_user: bool):
+        super().__init__(per_user)
+        self.per_user = per_user
+
+
+class UploadLimiter:
+    """Caps concurrent uploads and owns the thread pool that writes them.
+
+    Uploads get their own pool so that large files never take the threads
+    the rest of the API runs its sync handlers on. ``slot`` refuses new
+    uploads instead of queueing them once ``max_per_user`` uploads of the
+    same user or ``max_uploads`` uploads overall are in progress.
+    """
+
+    def __init__(self, max_uploads: int = 16, max_per_user: int = 4, max_workers: int = 4):
+        self.max_uploads = max_uploads
+        self.max_per_user = max_per_user
+        self.max_workers = max_workers
+        self.active = 0
+        self._by_user: Counter = Counter()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="upload")
+            return self._executor
+
+    @contextmanager
+    def slot(self, user: str) -> Iterator[None]:
+        with self._lock:
+            if self._by_user[user] >= self.max_per_user:
+                raise UploadsSaturated(per_user=True)
+            if self.active >= self.max_uploads:
+                raise UploadsSaturated(per_user=False)
+            self.active += 1
+            self._by_user[user] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self._by_user[user] -= 1
+                if not self._by_user[user]:
+                    del self._by_user[user]
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+async def _run_in(executor: Optional[Executor], func, *args):
+    if executor is None:
+        return await run_in_threadpool(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _finish_upload(tmp_name: str, target: Path):
+    if target.exists():
+        os.unlink(tmp_name)
+        os.utime(target)
+    else:
+        os.replace(tmp_name, target)
+
+
+async def save_upload(upload: UploadFile, directory: Path, suffix: str, max_size: int,
+                      executor: Optional[Executor] = None, collector: Optional["PhotoCollector"] = None) -> Path:
+    """Stream an upload into ``directory`` under the SHA-256 of its content.
+
+    The data goes to a temporary file in the same directory first and is
+    renamed into place only once the whole upload fits into ``max_size``.
+    When a file with the same content already exists the temporary copy is
+    dropped and the existing path is returned. Disk writes and hashing run
+    in ``executor``, or in the default thread pool when none is given.
+    With ``collector`` the path is pinned before it is put in place, so an
+    existing file that no pet uses yet is not collected under the upload;
+    the caller unpins it once a pet references it.
+    """
+    fd, tmp_name = await _run_in(executor, tempfile.mkstemp, PARTIAL_SUFFIX, None, directory)
+    try:
+        size = 0
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(max_size)
+                await _run_in(executor, _write_chunk, buffer, digest, chunk)
+        suffix = suffix.lower()
+        target = directory / f"{digest.hexdigest()}{SUFFIX_ALIASES.get(suffix, suffix)}"
+        if collector is not None:
+            collector.pin(target)
+        try:
+            await _run_in(executor, _finish_upload, tmp_name, target)
+        except BaseException:
+            if collector is not None:
+                collector.unpin(target)
+            raise
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return target
+
+
+class UploadSizeLimit:
+    """Rejects an upload whose body cannot fit the photo size limit before the form is parsed.
+
+    ``limit(scope)`` gives the largest photo a request may carry, or None
+    for requests that are not uploads. A ``Content-Length`` above it plus
+    ``FORM_OVERHEAD`` is answered with 400 without reading the body; a body
+    without one is counted as it arrives and aborted with the same 400 once
+    it goes over, so the multipart parser never spools more than that.
+    """
+
+    def __init__(self, app, limit: Callable[[dict], Optional[int]]):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        max_size = self.limit(scope) if scope["type"] == "http" else None
+        if max_size is None:
+            await self.app(scope, receive, send)
+            return
+        max_body = max_size + FORM_OVERHEAD
+        detail = f"File too large. Maximum size is {max_size // (1024 * 1024)}MB"
+        length = header(scope["headers"], b"content-length")
+        if length is not None and length.isdigit() and int(length) > max_body:
+            response = JSONResponse({"detail": detail}, status_code=400, headers={"connection": "close"})
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    raise HTTPException(status_code=400, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class PhotoCollector:
+    """Deletes photo files that no pet references any more.
+
+    ``refcount`` reports how many pets use a file; the pet store keeps that
+    count. Files become candidates when they are saved or released and are
+    only removed once they have had no references for ``grace_period``
+    seconds. Uploads pin their file from before it is put in place until
+    their pet references it, and pinned files are never removed; checking
+    and removing a file happen under the same lock as pinning, so an upload
+    that finds its content already on disk cannot lose it to a removal.
+    ``sweep`` also finds orphans left behind by crashes or other workers.
+    ``on_remove`` is called with every deleted file, e.g. to drop derived
+    files such as thumbnails.
+    """
+
+    def __init__(self, directory: Path, refcount: Callable[[Path], int], grace_period: float = 60.0,
+                 clock: Callable[[], float] = time.time, on_remove: Optional[Callable[[Path], None]] = None):
+        self.directory = directory
+        self.refcount = refcount
+        self.on_remove = on_remove
+        self.grace_period = grace_period
+        self._clock = clock
+        self._candidates: Dict[Path, float] = {}
+        self._pins: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def track(self, path: Optional[Path]):
+        if path is None:
+            return
+        with self._lock:
+            self._candidates[path] = self._clock()
+
+    def pin(self, path: Path):
+        with self._lock:
+            self._pins[path] += 1
+
+    def unpin(self, path: Optional[Path]):
+        """Release a pin and track ``path``, in case its pet was never saved."""
+        if path is None:
+            return
+        with self._lock:
+            self._pins[path] -= 1
+            if self._pins[path] <= 0:
+                del self._pins[path]
+            self._candidates[path] = self._clock()
+
+    def collect(self) -> List[Path]:
+        now = self._clock()
+        with self._lock:
+            due = [(path, since) for path, since in self._candidates.items() if now - since >= self.grace_period]
+        removed = []
+        for path, since in due:
+            with self._lock:
+                if self._candidates.get(path) != since:
+                    continue  # tracked again meanwhile, not due yet
+                del self._candidates[path]
+                if path not in self._pins and self.refcount(path) == 0 and self._remove(path):
+                    removed.append(path)
+        return removed
+
+    def sweep(self) -> List[Path]:
+        cutoff = self._clock() - self.grace_period
+        removed = []
+        for path in self.directory.iterdir():
+            try:
+                modified = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if not path.is_file() or modified > cutoff:
+                continue
+            with self._lock:
+                if path in self._pins:
+                    continue
+                if (path.suffix == PARTIAL_SUFFIX or self.refcount(path) == 0) and self._remove(path):
+                    removed.append(path)
+        return removed
+
+    def _remove(self, path: Path) -> bool:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        if self.on_remove is not None:
+            self.on_remove(path)
+        return True
+
+    async def run(self, interval: float = 30.0, sweep_every: int = 20):
+        rounds = 0
+        while True:
+            await asyncio.sleep(interval)
+            await run_in_threadpool(self.collect)
+            rounds += 1
+            if rounds % sweep_every == 0:
+                await run_in_threadpool(self.sweep)
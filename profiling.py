@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+PROFILE_HEADER = b"x-profile"
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread but its own until stopped.
+
+    The result is written in the collapsed-stack format (``frame;frame;frame
+    count`` per line) read by flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfilingMiddleware:
+    """Profiles requests that carry an ``X-Profile`` header.
+
+    Profiling only happens when the middleware is enabled, and a profile is
+    only kept when the request took at least ``slow_threshold`` seconds. The
+    ``X-Profile-File`` response header names the file it is written to.
+    """
+
+    def __init__(self, app, directory: Path, enabled: bool = False, slow_threshold: float = 0.0,
+                 interval: float = 0.001):
+        self.app = app
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not _has_header(scope, PROFILE_HEADER):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(self.interval)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}.folded"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-file", filename.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            if time.perf_counter() - started >= self.slow_threshold:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                (self.directory / filename).write_text(profiler.collapsed())
+
+
+def _has_header(scope, name: bytes) -> bool:
+    return any(key.lower() == name for key, _ in scope.get("headers", ()))
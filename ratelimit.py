@@ -0,0 +1,200 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Collection, Deque, Dict, Hashable, Optional
+
+from starlette.responses import JSONResponse
+
+from asgi import header
+from metrics import Registry, registry
+
+
+class Overloaded(Exception):
+    pass
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled at ``rate`` tokens per second up to ``burst``.
+
+    Buckets are kept in least-recently-used order. A bucket left alone for
+    ``burst / rate`` seconds is full again and no different from a new one,
+    so it is dropped; ``maxsize`` bounds the table no matter how many keys
+    show up within that time.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.idle = burst / rate
+        self._clock = clock
+        self._buckets: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens and return 0, or return the seconds until they would be available."""
+        now = self._clock()
+        with self._lock:
+            entry = self._buckets.pop(key, None)
+            tokens = self.burst if entry is None else min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            while True:
+                oldest = next(iter(self._buckets))
+                if now - self._buckets[oldest][1] < self.idle:
+                    break
+                del self._buckets[oldest]
+        return wait
+
+
+class RateLimit:
+    """A budget enforced both per auth key and per client address."""
+
+    def __init__(self, per_key: TokenBuckets, per_client: TokenBuckets):
+        self.per_key = per_key
+        self.per_client = per_client
+
+    def check(self, key: Optional[str], client: str) -> float:
+        wait = self.per_client.take(client)
+        if wait or key is None:
+            return wait
+        return self.per_key.take(key)
+
+
+class AdmissionControl:
+    """Limits how many requests are served at once.
+
+    Up to ``max_active`` requests run concurrently and up to ``max_queued``
+    more wait for a slot in arrival order, each for at most
+    ``queue_timeout`` seconds. Requests beyond that are refused right away,
+    so a burst is shed instead of growing a queue whose tail would time out
+    anyway. Must be used from one event loop.
+    """
+
+    def __init__(self, max_active: int = 64, max_queued: int = 256, queue_timeout: float = 5.0):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+        else:
+            await self._wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _wait(self):
+        if len(self._waiters) >= self.max_queued:
+            raise Overloaded()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(future)
+            raise Overloaded()
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                self._discard(future)
+            raise
+
+    def _release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, future: asyncio.Future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+
+class AdmissionMiddleware:
+    """Rate limits requests and admits them through ``admission``.
+
+    ``budget(scope)`` names the entry of ``limits`` a request is charged to,
+    or returns None for requests that bypass both checks. Budgets missing
+    from ``limits`` are not rate limited, and budgets in ``unadmitted``
+    skip admission control, which is meant for requests that spend most of
+    their time waiting, such as long polls. Refused requests get 429 or 503
+    with ``Retry-After``. Buckets and admission state live in this process:
+    with several workers each one enforces its own ``limits``, so they have
+    to be given the share of the budget meant for one worker.
+    """
+
+    def __init__(self, app, limits: Dict[str, RateLimit], admission: AdmissionControl,
+                 budget: Callable[[dict], Optional[str]], unadmitted: Collection[str] = (), retry_after: int = 1,
+                 registry: Registry = registry):
+        self.app = app
+        self.limits = limits
+        self.admission = admission
+        self.budget = budget
+        self.unadmitted = unadmitted
+        self.retry_after = retry_after
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = self.budget(scope)
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(budget)
+        if limit is not None:
+            wait = limit.check(header(scope["headers"], b"auth-key"), (scope.get("client") or ("unknown",))[0])
+            if wait:
+                self.registry.inc("http_requests_rejected_total", reason="rate_limit", budget=budget)
+                response = JSONResponse(
+                    {"detail": "Rate limit exceeded"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))}
+                )
+                await response(scope, receive, send)
+                return
+
+        if budget in self.unadmitted:
+            await self.app(scope, receive, send)
+            return
+        try:
+            async with self.admission.admit():
+                await self.app(scope, receive, send)
+        except Overloaded:
+            self.registry.inc("http_requests_rejected_total", reason="overloaded", budget=budget)
+            response = JSONResponse(
+                {"detail": "Server is overloaded"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
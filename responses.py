@@ -0,0 +1,28 @@
+import json
+from typing import Any
+
+from metrics import InstrumentedJSONResponse, span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(InstrumentedJSONResponse):
+    """JSON response rendered with orjson when it is installed.
+
+    Endpoints return it directly so FastAPI skips ``jsonable_encoder``, which
+    means the content must already consist of plain dicts, lists, strings,
+    numbers, booleans and None, as pet records do.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with span("serialization"):
+            return dumps(content)
@@ -0,0 +1,272 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+from heapq import nsmallest
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+MIN_TEXT_LENGTH = 3
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def prefix_end(prefix: str) -> Optional[str]:
+    """The smallest string above every string starting with ``prefix``, or None if there is none."""
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # Surrogates cannot be encoded as UTF-8, which SQLite compares on.
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+class SortedIndex:
+    """Pet sort keys ordered by ``(value, key)``, in chunks of parallel lists.
+
+    Keeping values and keys apart stores one pointer per pet in each list
+    instead of a tuple per pet, and lets ``bisect`` run on the values alone.
+    Chunks hold up to twice ``chunk_size`` entries, so an insert or delete
+    shifts one chunk rather than the whole index.
+    """
+
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = chunk_size
+        self._values: List[list] = []
+        self._keys: List[List[tuple]] = []
+        self._last: List[tuple] = []
+
+    def add(self, value, key: tuple):
+        if not self._keys:
+            self._values.append([value])
+            self._keys.append([key])
+            self._last.append((value, key))
+            return
+        chunk = min(bisect_left(self._last, (value, key)), len(self._last) - 1)
+        values, keys = self._values[chunk], self._keys[chunk]
+        index = _position(values, keys, value, key)
+        values.insert(index, value)
+        keys.insert(index, key)
+        self._last[chunk] = (values[-1], keys[-1])
+        if len(keys) > 2 * self.chunk_size:
+            half = len(keys) // 2
+            self._values.insert(chunk + 1, values[half:])
+            self._keys.insert(chunk + 1, keys[half:])
+            self._last.insert(chunk, (values[half - 1], keys[half - 1]))
+            del values[half:], keys[half:]
+
+    def remove(self, value, key: tuple):
+        chunk = bisect_left(self._last, (value, key))
+        if chunk == len(self._last):
+            return
+        values, keys = self._values[chunk], self._keys[chunk]
+        index = _position(values, keys, value, key)
+        if index == len(keys) or keys[index] != key:
+            return
+        del values[index], keys[index]
+        if keys:
+            self._last[chunk] = (values[-1], keys[-1])
+        else:
+            del self._values[chunk], self._keys[chunk], self._last[chunk]
+
+    def build(self, pairs: List[tuple]):
+        pairs.sort()
+        self.clear()
+        for start in range(0, len(pairs), self.chunk_size):
+            chunk = pairs[start:start + self.chunk_size]
+            self._values.append([value for value, _ in chunk])
+            self._keys.append([key for _, key in chunk])
+            self._last.append(chunk[-1])
+
+    def clear(self):
+        self._values.clear()
+        self._keys.clear()
+        self._last.clear()
+
+    def range(self, low=None, high=None):
+        """Count and candidate factory of the keys whose value is within ``[low, high]``."""
+        start = self._find(bisect_left, low) if low is not None else (0, 0)
+        stop = self._find(bisect_right, high) if high is not None else (len(self._keys), 0)
+        return self._between(start, stop)
+
+    def prefix(self, prefix: str):
+        """Count and candidate factory of the keys whose value starts with ``prefix``."""
+        upper = prefix_end(prefix)
+        stop = self._find(bisect_left, upper) if upper is not None else (len(self._keys), 0)
+        return self._between(self._find(bisect_left, prefix), stop)
+
+    def _find(self, bisect, value) -> Tuple[int, int]:
+        chunk = bisect(self._last, value, key=itemgetter(0))
+        if chunk == len(self._last):
+            return chunk, 0
+        return chunk, bisect(self._values[chunk], value)
+
+    def _between(self, start: Tuple[int, int], stop: Tuple[int, int]):
+        (first, offset), (last, end) = start, stop
+        if (first, offset) >= (last, end):
+            return 0, list
+        count = sum(map(len, self._keys[first:last])) - offset + end
+
+        def candidates() -> Iterator[tuple]:
+            if first == last:
+                return iter(self._keys[first][offset:end])
+            chunks = [self._keys[first][offset:], *self._keys[first + 1:last]]
+            if end:
+                chunks.append(self._keys[last][:end])
+            return chain.from_iterable(chunks)
+
+        return count, candidates
+
+
+class PetIndex:
+    """Secondary indexes over the names, animal types and ages of pets.
+
+    Every index holds pet sort keys: casefolded names and ages are sorted
+    for prefix and range lookups, each trigram of a casefolded name maps to
+    the pets whose name contains it, and each animal type has its own
+    sorted key list. ``search`` reads candidates from the index that should
+    touch the fewest pets and checks the other conditions on each of them.
+    Indexes ordered by sort key stop as soon as the page is full; the
+    others are read whole and their matches sorted.
+    """
+
+    def __init__(self, pets: dict):
+        self._pets = pets
+        self._names = SortedIndex()
+        self._ages = SortedIndex()
+        self._trigrams: Dict[str, Set[tuple]] = {}
+        self._animal_types: Dict[str, List[tuple]] = {}
+
+    def add(self, pet):
+        name = pet.name.casefold()
+        self._names.add(name, pet.key)
+        self._ages.add(pet.age, pet.key)
+        for trigram in trigrams(name):
+            self._trigrams.setdefault(trigram, set()).add(pet.key)
+        insort(self._animal_types.setdefault(pet.animal_type, []), pet.key)
+
+    def remove(self, pet):
+        name = pet.name.casefold()
+        self._names.remove(name, pet.key)
+        self._ages.remove(pet.age, pet.key)
+        for trigram in trigrams(name):
+            keys = self._trigrams[trigram]
+            keys.discard(pet.key)
+            if not keys:
+                del self._trigrams[trigram]
+        keys = self._animal_types[pet.animal_type]
+        index = bisect_left(keys, pet.key)
+        if index < len(keys) and keys[index] == pet.key:
+            del keys[index]
+        if not keys:
+            del self._animal_types[pet.animal_type]
+
+    def build(self, pets: Iterable):
+        """Replace the contents with ``pets``, sorting each index once."""
+        self.clear()
+        names, ages = [], []
+        for pet in pets:
+            name = pet.name.casefold()
+            names.append((name, pet.key))
+            ages.append((pet.age, pet.key))
+            for trigram in trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(pet.key)
+            self._animal_types.setdefault(pet.animal_type, []).append(pet.key)
+        self._names.build(names)
+        self._ages.build(ages)
+        for keys in self._animal_types.values():
+            keys.sort()
+
+    def clear(self):
+        self._names.clear()
+        self._ages.clear()
+        self._trigrams.clear()
+        self._animal_types.clear()
+
+    def search(
+            self,
+            order: List[tuple],
+            user_id: Optional[str] = None,
+            after: Optional[tuple] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None,
+            text: Optional[str] = None
+    ) -> List[tuple]:
+        """Return the keys of up to ``limit`` matching pets after ``after``, in sort key order.
+
+        ``order`` lists the keys of every pet that may match in sort key
+        order: those of all pets, or of the pets of ``user_id``.
+        ``name_prefix`` and ``text`` must be casefolded, and ``text`` must be
+        at least ``MIN_TEXT_LENGTH`` characters long.
+        """
+        ordered = [order]
+        if animal_type is not None:
+            ordered.append(self._animal_types.get(animal_type, []))
+        unordered = []
+        if min_age is not None or max_age is not None:
+            unordered.append(self._ages.range(min_age, max_age))
+        if name_prefix:
+            unordered.append(self._names.prefix(name_prefix))
+        if text is not None:
+            postings = sorted((self._trigrams.get(trigram, set()) for trigram in trigrams(text)), key=len)
+            unordered.append((len(postings[0]), lambda: postings[0].intersection(*postings[1:])))
+
+        starts = [bisect_right(keys, after) if after is not None else 0 for keys in ordered]
+        sizes = [len(keys) - start for keys, start in zip(ordered, starts)]
+        budget, candidates = min(unordered, key=lambda source: source[0], default=(None, None))
+        matches = min(sizes) if budget is None else min(*sizes, budget)
+        # An ordered source is expected to yield a match every size / matches keys.
+        scans = [min(size, limit * size // max(matches, 1)) for size in sizes]
+        best = scans.index(min(scans))
+
+        match = self._matcher(user_id, animal_type, min_age, max_age, name_prefix, text)
+        if budget is None or scans[best] <= budget:
+            # The estimate assumes independent conditions; give up on the
+            # ordered scan once it has cost as much as reading the smallest
+            # unordered source would.
+            keys, found = ordered[best], []
+            stop = len(keys) if budget is None else min(len(keys), starts[best] + budget)
+            for index in range(starts[best], stop):
+                if match(keys[index]):
+                    found.append(keys[index])
+                    if len(found) == limit:
+                        return found
+            if stop == len(keys):
+                return found
+        if after is not None:
+            return nsmallest(limit, (key for key in candidates() if key > after and match(key)))
+        return nsmallest(limit, filter(match, candidates()))
+
+    def _matcher(self, user_id, animal_type, min_age, max_age, name_prefix, text):
+        pets = self._pets
+
+        def match(key: tuple) -> bool:
+            pet = pets[key[1]]
+            if user_id is not None and pet.user_id != user_id:
+                return False
+            if animal_type is not None and pet.animal_type != animal_type:
+                return False
+            if min_age is not None and pet.age < min_age:
+                return False
+            if max_age is not None and pet.age > max_age:
+                return False
+            if name_prefix or text is not None:
+                name = pet.name.casefold()
+                if name_prefix and not name.startswith(name_prefix):
+                    return False
+                if text is not None and text not in name:
+                    return False
+            return True
+
+        return match
+
+
+def _position(values: list, keys: List[tuple], value, key: tuple) -> int:
+    low = bisect_left(values, value)
+    return bisect_left(keys, key, low, bisect_right(values, value, low))
@@ -0,0 +1,528 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from cache import InvalidationBus, VersionCounter
+from changes import ChangeFeed, ChangesExpired, change
+from search import prefix_end
+from storage import BasePetStore, BaseUserStore, SortKey, Storage, check_updatable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    auth_key TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pets (
+    pet_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    animal_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    pet_photo TEXT,
+    photo_path TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pets_by_order ON pets (created_at, pet_id);
+CREATE INDEX IF NOT EXISTS pets_by_user ON pets (user_id, created_at, pet_id);
+CREATE INDEX IF NOT EXISTS pets_by_user_name ON pets (user_id, name_key);
+CREATE INDEX IF NOT EXISTS pets_by_photo_path ON pets (photo_path);
+CREATE INDEX IF NOT EXISTS pets_by_name ON pets (name_key);
+CREATE INDEX IF NOT EXISTS pets_by_animal_type ON pets (animal_type, created_at, pet_id);
+CREATE INDEX IF NOT EXISTS pets_by_age ON pets (age);
+CREATE VIRTUAL TABLE IF NOT EXISTS pet_names USING fts5(name_key, content='pets', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS pet_names_insert AFTER INSERT ON pets BEGIN
+    INSERT INTO pet_names (rowid, name_key) VALUES (new.rowid, new.name_key);
+END;
+CREATE TRIGGER IF NOT EXISTS pet_names_delete AFTER DELETE ON pets BEGIN
+    INSERT INTO pet_names (pet_names, rowid, name_key) VALUES ('delete', old.rowid, old.name_key);
+END;
+CREATE TRIGGER IF NOT EXISTS pet_names_update AFTER UPDATE OF name_key ON pets BEGIN
+    INSERT INTO pet_names (pet_names, rowid, name_key) VALUES ('delete', old.rowid, old.name_key);
+    INSERT INTO pet_names (rowid, name_key) VALUES (new.rowid, new.name_key);
+END;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    owner TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    key TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    pet_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    pet TEXT,
+    changed_at TEXT NOT NULL
+);
+"""
+
+PET_COLUMNS = "pet_id, user_id, animal_type, name, age, pet_photo, created_at, updated_at"
+SELECT_USER = "SELECT username, password_hash FROM users WHERE auth_key = ?"
+SELECT_USER_KEY = "SELECT auth_key FROM users WHERE username = ?"
+INSERT_USER = "INSERT INTO users (auth_key, username, password_hash) VALUES (?, ?, ?)"
+DELETE_USER = "DELETE FROM users WHERE auth_key = ?"
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+
+SELECT_PET = f"SELECT {PET_COLUMNS} FROM pets WHERE pet_id = ?"
+SELECT_ALL_PETS = f"SELECT {PET_COLUMNS} FROM pets ORDER BY created_at, pet_id"
+SELECT_USER_PETS = f"SELECT {PET_COLUMNS} FROM pets WHERE user_id = ? ORDER BY created_at, pet_id"
+INSERT_PET = (
+    "INSERT INTO pets (pet_id, user_id, animal_type, name, name_key, age, pet_photo, created_at, updated_at) "
+    "VALUES (:pet_id, :user_id, :animal_type, :name, :name_key, :age, :pet_photo, :created_at, :updated_at)"
+)
+DELETE_PET = "DELETE FROM pets WHERE pet_id = ?"
+COUNT_PETS = "SELECT COUNT(*) FROM pets"
+COUNT_USER_PETS = "SELECT COUNT(*) FROM pets WHERE user_id = ?"
+SELECT_NAME = "SELECT 1 FROM pets WHERE user_id = ? AND name_key = ? LIMIT 1"
+SELECT_PHOTO_PATH = "SELECT photo_path FROM pets WHERE pet_id = ?"
+UPDATE_PHOTO_PATH = "UPDATE pets SET photo_path = ? WHERE pet_id = ?"
+COUNT_PHOTO_REFS = "SELECT COUNT(*) FROM pets WHERE photo_path = ?"
+HAS_NAME_INDEX = "SELECT 1 FROM sqlite_master WHERE name = 'pet_names'"
+REBUILD_NAME_INDEX = "INSERT INTO pet_names (pet_names) VALUES ('rebuild')"
+
+INSERT_EPOCH = "INSERT OR IGNORE INTO meta (name, value) VALUES ('epoch', ?)"
+SELECT_EPOCH = "SELECT value FROM meta WHERE name = 'epoch'"
+GLOBAL_OWNER = ""
+BUMP_GLOBAL_VERSION = (
+    "INSERT INTO versions (owner, version) VALUES ('', 1) "
+    "ON CONFLICT (owner) DO UPDATE SET version = version + 1"
+)
+SET_VERSION = (
+    "INSERT INTO versions (owner, version) VALUES (?, ?) "
+    "ON CONFLICT (owner) DO UPDATE SET version = excluded.version"
+)
+SELECT_VERSION = "SELECT version FROM versions WHERE owner = ?"
+INSERT_INVALIDATION = "INSERT INTO invalidations (origin, topic, key, created_at) VALUES (?, ?, ?, ?)"
+DELETE_OLD_INVALIDATIONS = "DELETE FROM invalidations WHERE created_at < ?"
+SELECT_LAST_INVALIDATION = "SELECT COALESCE(MAX(id), 0) FROM invalidations"
+SELECT_INVALIDATIONS = "SELECT id, origin, topic, key FROM invalidations WHERE id > ? ORDER BY id"
+INSERT_CHANGE = "INSERT INTO changes (type, pet_id, user_id, pet, changed_at) VALUES (?, ?, ?, ?, ?)"
+DELETE_OLD_CHANGES = "DELETE FROM changes WHERE seq <= ?"
+SELECT_LAST_CHANGE = "SELECT COALESCE(MAX(seq), 0) FROM changes"
+SELECT_CHANGES = "SELECT seq, type, pet_id, user_id, pet, changed_at FROM changes WHERE seq > ? ORDER BY seq"
+
+
+def _pet_from_row(row: sqlite3.Row) -> dict:
+    return dict(zip(row.keys(), row))
+
+
+class ConnectionPool:
+    """A fixed set of WAL-mode connections shared by the worker threads of one process."""
+
+    def __init__(self, path: str, size: int = 8):
+        self.path = path
+        self._connections: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(size):
+            self._connections.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30, cached_statements=256)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.connection() as connection:
+            with connection:
+                yield connection
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class SQLiteUserStore(BaseUserStore):
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+
+    def __len__(self) -> int:
+        with self._pool.connection() as connection:
+            return connection.execute(COUNT_USERS).fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._pool.connection() as connection:
+            row = connection.execute(SELECT_USER, (key,)).fetchone()
+        return dict(zip(row.keys(), row)) if row is not None else None
+
+    def key_for(self, username: str) -> Optional[str]:
+        with self._pool.connection() as connection:
+            row = connection.execute(SELECT_USER_KEY, (username,)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, key: str, username: str, password_hash: str) -> dict:
+        try:
+            with self._pool.transaction() as connection:
+                connection.execute(INSERT_USER, (key, username, password_hash))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"User {username!r} already exists")
+        return {"username": username, "password_hash": password_hash}
+
+    def remove(self, key: str) -> dict:
+        user = self.get(key)
+        if user is None:
+            raise KeyError(key)
+        with self._pool.transaction() as connection:
+            connection.execute(DELETE_USER, (key,))
+        return user
+
+
+class SQLitePetStore(BasePetStore):
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+
+    def __len__(self) -> int:
+        with self._pool.connection() as connection:
+            return connection.execute(COUNT_PETS).fetchone()[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        with self._pool.connection() as connection:
+            rows = connection.execute(SELECT_ALL_PETS).fetchall()
+        return iter([_pet_from_row(row) for row in rows])
+
+    def __contains__(self, pet_id: str) -> bool:
+        return self.get(pet_id) is not None
+
+    def get(self, pet_id: str) -> Optional[dict]:
+        with self._pool.connection() as connection:
+            row = connection.execute(SELECT_PET, (pet_id,)).fetchone()
+        return _pet_from_row(row) if row is not None else None
+
+    def add(self, pet: dict) -> dict:
+        with self._pool.transaction() as connection:
+            connection.execute(INSERT_PET, {**pet, "name_key": pet["name"].casefold()})
+        return pet
+
+    def add_many(self, pets: List[dict]) -> List[dict]:
+        with self._pool.transaction() as connection:
+            connection.executemany(INSERT_PET, [{**pet, "name_key": pet["name"].casefold()} for pet in pets])
+        return pets
+
+    def remove(self, pet_id: str) -> dict:
+        with self._pool.transaction() as connection:
+            row = connection.execute(SELECT_PET, (pet_id,)).fetchone()
+            if row is None:
+                raise KeyError(pet_id)
+            connection.execute(DELETE_PET, (pet_id,))
+        return _pet_from_row(row)
+
+    def remove_many(self, pet_ids: List[str]) -> List[dict]:
+        removed = []
+        with self._pool.transaction() as connection:
+            for pet_id in pet_ids:
+                row = connection.execute(SELECT_PET, (pet_id,)).fetchone()
+                if row is None:
+                    raise KeyError(pet_id)
+                connection.execute(DELETE_PET, (pet_id,))
+                removed.append(_pet_from_row(row))
+        return removed
+
+    def update(self, pet: dict, **fields) -> dict:
+        return self.update_many([(pet, fields)])[0]
+
+    def update_many(self, updates: List[Tuple[dict, dict]]) -> List[dict]:
+        for _, fields in updates:
+            check_updatable(fields)
+        with self._pool.transaction() as connection:
+            for pet, fields in updates:
+                if not fields:
+                    continue
+                values = dict(fields)
+                if "name" in values:
+                    values["name_key"] = values["name"].casefold()
+                assignments = ", ".join(f"{column} = :{column}" for column in values)
+                cursor = connection.execute(
+                    f"UPDATE pets SET {assignments} WHERE pet_id = :pet_id",
+                    {**values, "pet_id": pet["pet_id"]}
+                )
+                if cursor.rowcount == 0:
+                    raise KeyError(pet["pet_id"])
+        for pet, fields in updates:
+            pet.update(fields)
+        return [pet for pet, _ in updates]
+
+    def for_user(self, user_id: str) -> List[dict]:
+        with self._pool.connection() as connection:
+            rows = connection.execute(SELECT_USER_PETS, (user_id,)).fetchall()
+        return [_pet_from_row(row) for row in rows]
+
+    def count_for_user(self, user_id: str) -> int:
+        with self._pool.connection() as connection:
+            return connection.execute(COUNT_USER_PETS, (user_id,)).fetchone()[0]
+
+    def has_name(self, user_id: str, name: str) -> bool:
+        with self._pool.connection() as connection:
+            return connection.execute(SELECT_NAME, (user_id, name.casefold())).fetchone() is not None
+
+    def page(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        return self.search(user_id, after, limit, animal_type, min_age, max_age, name_prefix)
+
+    def search(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None,
+            text: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if after is not None:
+            conditions.append("(created_at, pet_id) > (?, ?)")
+            params.extend(after)
+        if animal_type is not None:
+            conditions.append("animal_type = ?")
+            params.append(animal_type)
+        if min_age is not None:
+            conditions.append("age >= ?")
+            params.append(min_age)
+        if max_age is not None:
+            conditions.append("age <= ?")
+            params.append(max_age)
+        if name_prefix:
+            prefix = name_prefix.casefold()
+            conditions.append("name_key >= ?")
+            params.append(prefix)
+            upper = prefix_end(prefix)
+            if upper is not None:
+                conditions.append("name_key < ?")
+                params.append(upper)
+        if text is not None:
+            phrase = text.casefold().replace('"', '""')
+            conditions.append("rowid IN (SELECT rowid FROM pet_names WHERE pet_names MATCH ?)")
+            params.append(f'"{phrase}"')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT {PET_COLUMNS} FROM pets {where} ORDER BY created_at, pet_id LIMIT ?"
+        with self._pool.connection() as connection:
+            rows = connection.execute(query, (*params, limit + 1)).fetchall()
+        items = [_pet_from_row(row) for row in rows[:limit]]
+        next_key = (items[-1]["created_at"], items[-1]["pet_id"]) if len(rows) > limit else None
+        return items, next_key
+
+    def photo_path(self, pet_id: str) -> Optional[Path]:
+        with self._pool.connection() as connection:
+            row = connection.execute(SELECT_PHOTO_PATH, (pet_id,)).fetchone()
+        return Path(row[0]) if row is not None and row[0] is not None else None
+
+    def set_photo_path(self, pet_id: str, path: Path):
+        with self._pool.transaction() as connection:
+            connection.execute(UPDATE_PHOTO_PATH, (str(path), pet_id))
+
+    def photo_refcount(self, path: Path) -> int:
+        with self._pool.connection() as connection:
+            return connection.execute(COUNT_PHOTO_REFS, (str(path),)).fetchone()[0]
+
+    def clear(self):
+        with self._pool.transaction() as connection:
+            connection.execute("DELETE FROM pets")
+
+
+class SQLiteVersionCounter(VersionCounter):
+    """Versions kept in the database, so every worker process sees the same ones."""
+
+    def __init__(self, pool: ConnectionPool):
+        super().__init__()
+        self._pool = pool
+        with pool.transaction() as connection:
+            connection.execute(INSERT_EPOCH, (self.epoch,))
+            self.epoch = connection.execute(SELECT_EPOCH).fetchone()[0]
+
+    def bump(self, *owners: str):
+        with self._pool.transaction() as connection:
+            connection.execute(BUMP_GLOBAL_VERSION)
+            version = connection.execute(SELECT_VERSION, (GLOBAL_OWNER,)).fetchone()[0]
+            connection.executemany(SET_VERSION, [(owner, version) for owner in owners])
+
+    def get(self, owner: Optional[str] = None) -> int:
+        with self._pool.connection() as connection:
+            row = connection.execute(SELECT_VERSION, (GLOBAL_OWNER if owner is None else owner,)).fetchone()
+        return row[0] if row is not None else 0
+
+
+class SQLiteInvalidationBus(InvalidationBus):
+    """Forwards invalidations to the other processes using the database.
+
+    Published messages are delivered locally right away and stored in the
+    ``invalidations`` table, which a background thread of every process
+    polls each ``poll_interval`` seconds. Messages older than ``retention``
+    seconds are deleted as new ones are published.
+    """
+
+    def __init__(self, pool: ConnectionPool, poll_interval: float = 0.1, retention: float = 3600.0):
+        super().__init__()
+        self._pool = pool
+        self.retention = retention
+        self._origin = os.urandom(8).hex()
+        with pool.connection() as connection:
+            self._last_id = connection.execute(SELECT_LAST_INVALIDATION).fetchone()[0]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(poll_interval,), name="invalidation-poll", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, topic: str, key: str):
+        now = time.time()
+        with self._pool.transaction() as connection:
+            connection.execute(INSERT_INVALIDATION, (self._origin, topic, key, now))
+            connection.execute(DELETE_OLD_INVALIDATIONS, (now - self.retention,))
+        self.deliver(topic, key)
+
+    def poll(self):
+        with self._pool.connection() as connection:
+            rows = connection.execute(SELECT_INVALIDATIONS, (self._last_id,)).fetchall()
+        for message_id, origin, topic, key in rows:
+            self._last_id = message_id
+            if origin != self._origin:
+                self.deliver(topic, key)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self, poll_interval: float):
+        while not self._stop.wait(poll_interval):
+            self.poll()
+
+
+class SQLiteChangeFeed(ChangeFeed):
+    """Change feed kept in the ``changes`` table, shared by every worker process.
+
+    The table is trimmed to the newest ``capacity`` changes as changes are
+    recorded. A background thread looks for changes recorded by other
+    processes every ``poll_interval`` seconds and wakes the local waiters.
+    """
+
+    def __init__(self, pool: ConnectionPool, capacity: int = 10_000, poll_interval: float = 0.1):
+        super().__init__(capacity)
+        self._pool = pool
+        self._first = 0
+        self._last = self._read_last()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(poll_interval,), name="change-poll", daemon=True)
+        self._thread.start()
+
+    def record(self, kind: str, pets: List[dict]) -> int:
+        if not pets:
+            return self._last
+        changed_at = datetime.now().isoformat()
+        with self._pool.transaction() as connection:
+            for pet in pets:
+                item = change(0, kind, pet, changed_at)
+                pet_json = json.dumps(item["pet"]) if item["pet"] is not None else None
+                cursor = connection.execute(
+                    INSERT_CHANGE, (kind, item["pet_id"], item["user_id"], pet_json, changed_at)
+                )
+                last = cursor.lastrowid
+            connection.execute(DELETE_OLD_CHANGES, (last - self.capacity,))
+        self._advance(last)
+        return last
+
+    def since(self, seq: int, user_id: Optional[str] = None) -> Tuple[List[dict], int]:
+        with self._pool.connection() as connection:
+            rows = connection.execute(SELECT_CHANGES, (seq,)).fetchall()
+            last = rows[-1][0] if rows else connection.execute(SELECT_LAST_CHANGE).fetchone()[0]
+        if seq > last or (rows and rows[0][0] != seq + 1):
+            raise ChangesExpired(seq)
+        changes = [
+            {
+                "seq": number,
+                "type": kind,
+                "pet_id": pet_id,
+                "user_id": owner,
+                "pet": json.loads(pet) if pet is not None else None,
+                "changed_at": changed_at
+            }
+            for number, kind, pet_id, owner, pet, changed_at in rows
+            if user_id is None or owner == user_id
+        ]
+        return changes, last
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _read_last(self) -> int:
+        with self._pool.connection() as connection:
+            return connection.execute(SELECT_LAST_CHANGE).fetchone()[0]
+
+    def _advance(self, last: int):
+        with self._lock:
+            if last <= self._last:
+                return
+            self._last = last
+        self.notify()
+
+    def _run(self, poll_interval: float):
+        while not self._stop.wait(poll_interval):
+            self._advance(self._read_last())
+
+
+class SQLiteStorage(Storage):
+    """Users and pets in a SQLite database shared by every worker process on the host."""
+
+    def __init__(self, path: str, pool_size: int = 8):
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as connection:
+            indexed = connection.execute(HAS_NAME_INDEX).fetchone() is not None
+            connection.executescript(SCHEMA)
+            if not indexed:
+                with connection:
+                    connection.execute(REBUILD_NAME_INDEX)
+        super().__init__(
+            SQLiteUserStore(self.pool),
+            SQLitePetStore(self.pool),
+            SQLiteVersionCounter(self.pool),
+            SQLiteInvalidationBus(self.pool),
+            SQLiteChangeFeed(self.pool)
+        )
+
+    def close(self):
+        super().close()
+        self.pool.close()
@@ -0,0 +1,541 @@
+import sys
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache import InvalidationBus, VersionCounter
+from changes import ChangeFeed
+from search import PetIndex
+
+SortKey = Tuple[str, str]
+
+UPDATABLE_FIELDS = {"animal_type", "name", "age", "pet_photo", "updated_at"}
+INDEXED_FIELDS = {"animal_type", "name", "age"}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def sort_key(pet: dict) -> SortKey:
+    return pet["created_at"], pet["pet_id"]
+
+
+def check_updatable(fields: dict):
+    unknown = set(fields) - UPDATABLE_FIELDS
+    if unknown:
+        raise ValueError(f"Cannot update fields: {', '.join(sorted(unknown))}")
+
+
+class BaseUserStore(ABC):
+    """Users keyed by auth key, looked up by username on login."""
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    def key_for(self, username: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def add(self, key: str, username: str, password_hash: str) -> dict: ...
+
+    @abstractmethod
+    def remove(self, key: str) -> dict: ...
+
+
+class BasePetStore(ABC):
+    """Pet records as returned by the API plus the on-disk path of each photo.
+
+    ``update`` applies the changes to the passed record as well as to the
+    backend, so callers can keep using the dict they fetched.
+    """
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[dict]: ...
+
+    @abstractmethod
+    def __contains__(self, pet_id: str) -> bool: ...
+
+    @abstractmethod
+    def get(self, pet_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    def add(self, pet: dict) -> dict: ...
+
+    @abstractmethod
+    def remove(self, pet_id: str) -> dict: ...
+
+    @abstractmethod
+    def update(self, pet: dict, **fields) -> dict: ...
+
+    def add_many(self, pets: List[dict]) -> List[dict]:
+        return [self.add(pet) for pet in pets]
+
+    def remove_many(self, pet_ids: List[str]) -> List[dict]:
+        return [self.remove(pet_id) for pet_id in pet_ids]
+
+    def update_many(self, updates: List[Tuple[dict, dict]]) -> List[dict]:
+        """Apply every ``(pet, fields)`` pair like ``update``, all of them or none."""
+        return [self.update(pet, **fields) for pet, fields in updates]
+
+    @abstractmethod
+    def for_user(self, user_id: str) -> List[dict]: ...
+
+    @abstractmethod
+    def count_for_user(self, user_id: str) -> int: ...
+
+    @abstractmethod
+    def has_name(self, user_id: str, name: str) -> bool: ...
+
+    @abstractmethod
+    def page(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        """Return up to ``limit`` matching pets ordered after ``after`` and the cursor of the next page."""
+
+    @abstractmethod
+    def search(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None,
+            text: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        """Like ``page``, plus a case-insensitive ``text`` the name must contain, answered from indexes.
+
+        ``text`` must be at least ``search.MIN_TEXT_LENGTH`` characters long.
+        """
+
+    @abstractmethod
+    def photo_path(self, pet_id: str) -> Optional[Path]: ...
+
+    @abstractmethod
+    def set_photo_path(self, pet_id: str, path: Path): ...
+
+    @abstractmethod
+    def photo_refcount(self, path: Path) -> int:
+        """Number of pets whose photo is stored at ``path``."""
+
+    @abstractmethod
+    def clear(self): ...
+
+
+class UserStore(BaseUserStore):
+    """Users keyed by auth key with a username index for logins."""
+
+    def __init__(self):
+        self._users: Dict[str, dict] = {}
+        self._by_username: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._users
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._users.get(key)
+
+    def key_for(self, username: str) -> Optional[str]:
+        return self._by_username.get(username)
+
+    def add(self, key: str, username: str, password_hash: str) -> dict:
+        if username in self._by_username:
+            raise ValueError(f"User {username!r} already exists")
+        user = {"username": username, "password_hash": password_hash}
+        self._users[key] = user
+        self._by_username[username] = key
+        return user
+
+    def remove(self, key: str) -> dict:
+        user = self._users.pop(key)
+        del self._by_username[user["username"]]
+        return user
+
+    def dump_rows(self) -> List[tuple]:
+        return [(key, user["username"], user["password_hash"]) for key, user in self._users.items()]
+
+    def load_rows(self, rows: List[tuple]):
+        self._users.clear()
+        self._by_username.clear()
+        for key, username, password_hash in rows:
+            self._users[key] = {"username": username, "password_hash": password_hash}
+            self._by_username[username] = key
+
+
+class Pet:
+    """Compact in-memory form of a pet record.
+
+    ``key`` is the ``(created_at, pet_id)`` sort key with the timestamp in
+    microseconds since the epoch and the id as 16 raw UUID bytes; the same
+    tuple is stored in the ordering indexes. User ids and animal types are
+    interned so that pets share them. ``as_dict`` builds the record the
+    API returns.
+    """
+
+    __slots__ = ("key", "user_id", "animal_type", "name", "age", "pet_photo", "updated", "photo_path")
+
+    def __init__(self, record: dict):
+        self.key = (_pack_time(record["created_at"]), _pack_id(record["pet_id"]))
+        self.user_id = sys.intern(record["user_id"])
+        self.animal_type = sys.intern(record["animal_type"])
+        self.name = record["name"]
+        self.age = record["age"]
+        self.pet_photo = record["pet_photo"]
+        updated = _pack_time(record["updated_at"])
+        self.updated = self.key[0] if updated == self.key[0] else updated
+        self.photo_path: Optional[Path] = None
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Pet":
+        pet = cls.__new__(cls)
+        created, pet_id, user_id, animal_type, pet.name, pet.age, pet.pet_photo, pet.updated, photo_path = row
+        pet.key = (created, pet_id)
+        pet.user_id = sys.intern(user_id)
+        pet.animal_type = sys.intern(animal_type)
+        pet.photo_path = Path(photo_path) if photo_path is not None else None
+        return pet
+
+    def row(self) -> tuple:
+        photo_path = str(self.photo_path) if self.photo_path is not None else None
+        return (*self.key, self.user_id, self.animal_type, self.name, self.age, self.pet_photo, self.updated,
+                photo_path)
+
+    def __getitem__(self, field: str):
+        return getattr(self, field)
+
+    def set(self, field: str, value):
+        if field == "updated_at":
+            self.updated = _pack_time(value)
+        elif field == "animal_type":
+            self.animal_type = sys.intern(value)
+        else:
+            setattr(self, field, value)
+
+    def as_dict(self) -> dict:
+        created, pet_id = self.key
+        return {
+            "pet_id": _unpack_id(pet_id),
+            "user_id": self.user_id,
+            "animal_type": self.animal_type,
+            "name": self.name,
+            "age": self.age,
+            "pet_photo": self.pet_photo,
+            "created_at": _unpack_time(created),
+            "updated_at": _unpack_time(self.updated)
+        }
+
+
+class PetStore(BasePetStore):
+    """In-memory pet storage indexed by pet_id, user_id and per-user name.
+
+    Pets are kept as compact ``Pet`` objects ordered by ``(created_at,
+    pet_id)`` globally and per user, which is what keyset pagination in
+    ``page`` seeks on; ``search`` also uses the name, animal type and age
+    indexes of a ``PetIndex``. Records are turned back into dicts when they
+    leave the store. Pet ids must be UUID strings in canonical form.
+    Changes and the reads that walk the ordered lists and indexes hold one
+    lock, so a handler in the thread pool never sees a pet half added or
+    removed.
+    """
+
+    def __init__(self):
+        self._pets: Dict[bytes, Pet] = {}
+        self._order: List[tuple] = []
+        self._user_order: Dict[str, List[tuple]] = {}
+        self._names: Dict[str, Dict[str, int]] = {}
+        self._photo_refs: Counter = Counter()
+        self._index = PetIndex(self._pets)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._pets)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (pet.as_dict() for pet in list(self._pets.values()))
+
+    def __contains__(self, pet_id: str) -> bool:
+        return self._find(pet_id) is not None
+
+    def get(self, pet_id: str) -> Optional[dict]:
+        pet = self._find(pet_id)
+        return pet.as_dict() if pet is not None else None
+
+    def add(self, pet: dict) -> dict:
+        record = Pet(pet)
+        with self._lock:
+            self._pets[record.key[1]] = record
+            self._add_name(record.user_id, record.name)
+            insort(self._order, record.key)
+            insort(self._user_order.setdefault(record.user_id, []), record.key)
+            self._index.add(record)
+        return pet
+
+    def remove(self, pet_id: str) -> dict:
+        with self._lock:
+            record = self._pets.pop(_pack_id(pet_id))
+            user_id = record.user_id
+            self._remove_name(user_id, record.name)
+            self._index.remove(record)
+            _discard(self._order, record.key)
+            user_order = self._user_order[user_id]
+            _discard(user_order, record.key)
+            if not user_order:
+                del self._user_order[user_id]
+            self._release_photo(record.photo_path)
+        return record.as_dict()
+
+    def update(self, pet: dict, **fields) -> dict:
+        return PetStore.update_many(self, [(pet, fields)])[0]
+
+    def update_many(self, updates: List[Tuple[dict, dict]]) -> List[dict]:
+        for _, fields in updates:
+            check_updatable(fields)
+        with self._lock:
+            records = [self._pets[_pack_id(pet["pet_id"])] for pet, _ in updates]
+            for record, (_, fields) in zip(records, updates):
+                if "name" in fields and fields["name"] != record.name:
+                    self._remove_name(record.user_id, record.name)
+                    self._add_name(record.user_id, fields["name"])
+                reindex = any(fields[field] != record[field] for field in INDEXED_FIELDS & fields.keys())
+                if reindex:
+                    self._index.remove(record)
+                for field, value in fields.items():
+                    record.set(field, value)
+                if reindex:
+                    self._index.add(record)
+        for pet, fields in updates:
+            pet.update(fields)
+        return [pet for pet, _ in updates]
+
+    def for_user(self, user_id: str) -> List[dict]:
+        with self._lock:
+            return [self._pets[key[1]].as_dict() for key in self._user_order.get(user_id, ())]
+
+    def count_for_user(self, user_id: str) -> int:
+        return len(self._user_order.get(user_id, ()))
+
+    def has_name(self, user_id: str, name: str) -> bool:
+        return name.casefold() in self._names.get(user_id, ())
+
+    def page(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        match = pet_matcher(animal_type, min_age, max_age, name_prefix)
+        after = (_pack_time(after[0]), uuid.UUID(after[1]).bytes) if after is not None else None
+        items = []
+        with self._lock:
+            order = self._order if user_id is None else self._user_order.get(user_id, [])
+            index = bisect_right(order, after) if after is not None else 0
+            while index < len(order) and len(items) < limit:
+                pet = self._pets[order[index][1]]
+                index += 1
+                if match is None or match(pet):
+                    items.append(pet.as_dict())
+        next_key = sort_key(items[-1]) if items and index < len(order) else None
+        return items, next_key
+
+    def search(
+            self,
+            user_id: Optional[str] = None,
+            after: Optional[SortKey] = None,
+            limit: int = 100,
+            animal_type: Optional[str] = None,
+            min_age: Optional[int] = None,
+            max_age: Optional[int] = None,
+            name_prefix: Optional[str] = None,
+            text: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[SortKey]]:
+        after = (_pack_time(after[0]), uuid.UUID(after[1]).bytes) if after is not None else None
+        with self._lock:
+            keys = self._index.search(
+                self._order if user_id is None else self._user_order.get(user_id, []),
+                user_id=user_id,
+                after=after,
+                limit=limit + 1,
+                animal_type=animal_type,
+                min_age=min_age,
+                max_age=max_age,
+                name_prefix=name_prefix.casefold() if name_prefix else None,
+                text=text.casefold() if text is not None else None
+            )
+            items = [self._pets[key[1]].as_dict() for key in keys[:limit]]
+        next_key = sort_key(items[-1]) if len(keys) > limit else None
+        return items, next_key
+
+    def photo_path(self, pet_id: str) -> Optional[Path]:
+        pet = self._find(pet_id)
+        return pet.photo_path if pet is not None else None
+
+    def set_photo_path(self, pet_id: str, path: Path):
+        with self._lock:
+            pet = self._pets[_pack_id(pet_id)]
+            self._release_photo(pet.photo_path)
+            pet.photo_path = path
+            self._photo_refs[path] += 1
+
+    def photo_refcount(self, path: Path) -> int:
+        return self._photo_refs.get(path, 0)
+
+    def clear(self):
+        with self._lock:
+            self._pets.clear()
+            self._names.clear()
+            self._photo_refs.clear()
+            self._order.clear()
+            self._user_order.clear()
+            self._index.clear()
+
+    def dump_rows(self) -> List[tuple]:
+        """Every pet as a plain tuple in ``(created_at, pet_id)`` order, for snapshots."""
+        with self._lock:
+            return [self._pets[key[1]].row() for key in self._order]
+
+    def load_rows(self, rows: List[tuple]):
+        """Replace the contents with rows from ``dump_rows``, building the indexes in one pass."""
+        with self._lock:
+            PetStore.clear(self)
+            for row in rows:
+                pet = Pet.from_row(row)
+                self._pets[pet.key[1]] = pet
+                self._add_name(pet.user_id, pet.name)
+                self._order.append(pet.key)
+                self._user_order.setdefault(pet.user_id, []).append(pet.key)
+                if pet.photo_path is not None:
+                    self._photo_refs[pet.photo_path] += 1
+            self._order.sort()
+            for order in self._user_order.values():
+                order.sort()
+            self._index.build(self._pets.values())
+
+    def _find(self, pet_id: str) -> Optional[Pet]:
+        try:
+            return self._pets.get(_pack_id(pet_id))
+        except ValueError:
+            return None
+
+    def _release_photo(self, path: Optional[Path]):
+        if path is None:
+            return
+        self._photo_refs[path] -= 1
+        if self._photo_refs[path] <= 0:
+            del self._photo_refs[path]
+
+    def _add_name(self, user_id: str, name: str):
+        names = self._names.setdefault(user_id, {})
+        key = name.casefold()
+        names[key] = names.get(key, 0) + 1
+
+    def _remove_name(self, user_id: str, name: str):
+        names = self._names[user_id]
+        key = name.casefold()
+        if names[key] > 1:
+            names[key] -= 1
+        else:
+            del names[key]
+            if not names:
+                del self._names[user_id]
+
+
+class Storage:
+    """The user and pet stores of one backend.
+
+    ``versions``, ``invalidations`` and ``changes`` are shared by every
+    process using the backend, so caches and change feeds built on them
+    stay correct with several workers.
+    """
+
+    def __init__(self, users: BaseUserStore, pets: BasePetStore, versions: Optional[VersionCounter] = None,
+                 invalidations: Optional[InvalidationBus] = None, changes: Optional[ChangeFeed] = None):
+        self.users = users
+        self.pets = pets
+        self.versions = versions if versions is not None else VersionCounter()
+        self.invalidations = invalidations if invalidations is not None else InvalidationBus()
+        self.changes = changes if changes is not None else ChangeFeed()
+
+    def close(self):
+        self.invalidations.close()
+        self.changes.close()
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        super().__init__(UserStore(), PetStore())
+
+
+def pet_matcher(
+        animal_type: Optional[str] = None,
+        min_age: Optional[int] = None,
+        max_age: Optional[int] = None,
+        name_prefix: Optional[str] = None
+):
+    conditions = []
+    if animal_type is not None:
+        conditions.append(lambda pet: pet["animal_type"] == animal_type)
+    if min_age is not None:
+        conditions.append(lambda pet: pet["age"] >= min_age)
+    if max_age is not None:
+        conditions.append(lambda pet: pet["age"] <= max_age)
+    if name_prefix:
+        prefix = name_prefix.casefold()
+        conditions.append(lambda pet: pet["name"].casefold().startswith(prefix))
+    if not conditions:
+        return None
+    return lambda pet: all(condition(pet) for condition in conditions)
+
+
+def _pack_time(value: str) -> int:
+    return (datetime.fromisoformat(value) - _EPOCH) // _MICROSECOND
+
+
+def _unpack_time(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def _pack_id(pet_id: str) -> bytes:
+    packed = uuid.UUID(pet_id).bytes
+    if _unpack_id(packed) != pet_id:
+        raise ValueError(f"Pet id is not a canonical UUID: {pet_id}")
+    return packed
+
+
+def _unpack_id(packed: bytes) -> str:
+    value = packed.hex()
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+
+def _discard(order: list, key: tuple):
+    index = bisect_left(order, key)
+    if index < len(order) and order[index] == key:
+        del order[index]
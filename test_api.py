@@ -4,8 +4,15 @@ import base64
 from pathlib import Path
 from io import BytesIO
 from fastapi.testclient import TestClient
-from api import app
+import api
+from api import app, users
+from auth import hash_password
 import uuid
+import json
+import time
+import httpx
+import photos
+from ratelimit import RateLimit, TokenBuckets
 
 client = TestClient(app)
 
@@ -60,6 +67,18 @@ class TestAPIAuthentication:
         assert response.status_code == 401
 
 
+    def test_revoked_key_rejected(self):
+        """Тест 40: Отозванный ключ сразу перестает приниматься"""
+        key = "revoked_" + uuid.uuid4().hex
+        users.add(key, username=key, password_hash=hash_password("secret"))
+        assert client.get("/api/pets", headers={"auth-key": key}).status_code == 200
+        response = client.get("/api/key", params={"username": key, "password": "secret"})
+        assert response.json()["key"] == key
+        api.revoke_key(key)
+        assert client.get("/api/pets", headers={"auth-key": key}).status_code == 401
+        response = client.get("/api/key", params={"username": key, "password": "secret"})
+        assert response.status_code == 401
+
 
 class TestPetsAPI:
     """Тесты для работы с питомцами"""
@@ -278,6 +297,785 @@ class TestPetsAPI:
         assert response.status_code == 404
         data = response.json()
 
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+def create_pet(name, animal_type="dog", age=1, key=VALID_KEY):
+    response = client.post(
+        "/api/create_pet_simple",
+        headers={"auth-key": key},
+        params={"animal_type": animal_type, "name": name, "age": age}
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def upload_photo(pet_id, content=PNG_BYTES, key=VALID_KEY):
+    return client.post(
+        f"/api/pets/set_photo/{pet_id}",
+        headers={"auth-key": key},
+        files={"pet_photo": ("photo.png", BytesIO(content), "image/png")}
+    )
+
+
+class TestPetPhotos:
+    """Тесты загрузки и получения фотографий питомцев"""
+
+    def test_set_photo_returns_reference(self):
+        """Тест 21: Фото сохраняется как ссылка, а не data URL"""
+        pet = create_pet("Photogenic")
+        response = upload_photo(pet["pet_id"])
+        assert response.status_code == 200
+        photo = response.json()["pet_photo"]
+        assert photo == f"/api/pets/{pet['pet_id']}/photo"
+
+        response = client.get(
+            "/api/pets",
+            headers={"auth-key": VALID_KEY}
+        )
+        listed = [p for p in response.json() if p["pet_id"] == pet["pet_id"]]
+        assert listed[0]["pet_photo"] == photo
+
+    def test_get_photo(self):
+        """Тест 22: Получение файла фотографии с ETag и Last-Modified"""
+        pet = create_pet("Snapshot")
+        upload_photo(pet["pet_id"])
+        response = client.get(
+            f"/api/pets/{pet['pet_id']}/photo",
+            headers={"auth-key": VALID_KEY}
+        )
+        assert response.status_code == 200
+        assert response.content == PNG_BYTES
+        assert response.headers["content-type"] == "image/png"
+        assert "etag" in response.headers
+        assert "last-modified" in response.headers
+
+    def test_get_photo_not_modified(self):
+        """Тест 23: Повторный запрос с If-None-Match возвращает 304"""
+        pet = create_pet("Cached")
+        upload_photo(pet["pet_id"])
+        url = f"/api/pets/{pet['pet_id']}/photo"
+        etag = client.get(url, headers={"auth-key": VALID_KEY}).headers["etag"]
+        response = client.get(
+            url,
+            headers={"auth-key": VALID_KEY, "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_get_photo_range(self):
+        """Тест 24: Частичная загрузка фотографии по Range"""
+        pet = create_pet("Partial")
+        upload_photo(pet["pet_id"])
+        response = client.get(
+            f"/api/pets/{pet['pet_id']}/photo",
+            headers={"auth-key": VALID_KEY, "Range": "bytes=0-7"}
+        )
+        assert response.status_code == 206
+        assert response.content == PNG_BYTES[:8]
+
+    def test_get_photo_missing(self):
+        """Тест 25: Запрос фото у питомца без фотографии"""
+        pet = create_pet("NoPhoto")
+        response = client.get(
+            f"/api/pets/{pet['pet_id']}/photo",
+            headers={"auth-key": VALID_KEY}
+        )
+        assert response.status_code == 404
+
+    def test_set_photo_too_large(self):
+        """Тест 26: Слишком большой файл отклоняется и не остается на диске, тело больше лимита не дочитывается"""
+        pet = create_pet("Heavy")
+        before = set(Path("uploads").iterdir())
+        response = upload_photo(pet["pet_id"], content=b"x" * (10 * 1024 * 1024 + 1))
+        assert response.status_code == 400
+        assert response.json()["detail"] == "File too large. Maximum size is 10MB"
+        assert set(Path("uploads").iterdir()) == before
+
+        def body():
+            for _ in range(12):
+                yield b"x" * (1024 * 1024)
+
+        headers = {"auth-key": VALID_KEY, "content-type": "multipart/form-data; boundary=b"}
+        for extra in ({"content-length": str(12 * 1024 * 1024)}, {}):
+            response = client.post(
+                f"/api/pets/set_photo/{pet['pet_id']}", headers={**headers, **extra}, content=body()
+            )
+            assert response.status_code == 400
+            assert response.json()["detail"] == "File too large. Maximum size is 10MB"
+
+    def test_get_photo_variant_fallback(self):
+        """Тест 42: Без готового варианта отдается оригинал, размер можно запросить явно"""
+        pet = create_pet("Variant")
+        upload_photo(pet["pet_id"])
+        url = f"/api/pets/{pet['pet_id']}/photo"
+        for size in ("thumb", "original"):
+            response = client.get(url, headers={"auth-key": VALID_KEY}, params={"size": size})
+            assert response.status_code == 200
+            assert response.content == PNG_BYTES
+        assert response.headers["x-photo-variant"] == "original"
+
+        response = client.get(url, headers={"auth-key": VALID_KEY}, params={"size": "huge"})
+        assert response.status_code == 400
+
+    def test_upload_back_pressure(self, monkeypatch):
+        """Тест 44: При исчерпании слотов загрузки отклоняются с Retry-After"""
+        pet = create_pet("Crowded")
+        monkeypatch.setattr(api.upload_limiter, "max_per_user", 0)
+        response = upload_photo(pet["pet_id"])
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == api.UPLOAD_RETRY_AFTER
+
+        monkeypatch.setattr(api.upload_limiter, "max_per_user", 4)
+        monkeypatch.setattr(api.upload_limiter, "max_uploads", 0)
+        response = upload_photo(pet["pet_id"])
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == api.UPLOAD_RETRY_AFTER
+        assert api.pets.get(pet["pet_id"])["pet_photo"] is None
+
+    def test_small_requests_during_uploads(self, monkeypatch):
+        """Тест 45: Короткие GET-запросы не ждут медленной записи больших загрузок"""
+        write_chunk = photos._write_chunk
+
+        def slow_write_chunk(buffer, digest, chunk):
+            time.sleep(0.2)
+            write_chunk(buffer, digest, chunk)
+
+        monkeypatch.setattr(photos, "_write_chunk", slow_write_chunk)
+        pet_ids = [create_pet(f"Busy{i}")["pet_id"] for i in range(3)]
+        content = PNG_BYTES + bytes(photos.CHUNK_SIZE * 3)
+        headers = {"auth-key": VALID_KEY}
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+                started = time.perf_counter()
+                uploads = [
+                    asyncio.create_task(async_client.post(
+                        f"/api/pets/set_photo/{pet_id}",
+                        headers=headers,
+                        files={"pet_photo": ("photo.png", content, "image/png")}
+                    ))
+                    for pet_id in pet_ids
+                ]
+                await asyncio.sleep(0.05)
+                for _ in range(5):
+                    response = await async_client.get("/api/pets", headers=headers)
+                    assert response.status_code == 200
+                small_requests_done = time.perf_counter() - started
+                uploads_running = not all(upload.done() for upload in uploads)
+                uploaded = await asyncio.gather(*uploads)
+            return small_requests_done, uploads_running, uploaded
+
+        small_requests_done, uploads_running, uploaded = asyncio.run(run())
+        assert all(response.status_code == 200 for response in uploaded)
+        assert uploads_running
+        assert small_requests_done < 0.4
+
+    def test_list_photo_size(self):
+        """Тест 43: Ссылки на фото в списке указывают на нужный размер"""
+        pet = create_pet("Preview")
+        upload_photo(pet["pet_id"])
+        response = client.get(
+            "/api/pets",
+            headers={"auth-key": VALID_KEY},
+            params={"photo_size": "thumb"}
+        )
+        listed = [p for p in response.json() if p["pet_id"] == pet["pet_id"]]
+        assert listed[0]["pet_photo"] == f"/api/pets/{pet['pet_id']}/photo?size=thumb"
+        assert api.pets.get(pet["pet_id"])["pet_photo"] == f"/api/pets/{pet['pet_id']}/photo"
+
+
+
+PAGER_KEY = "pager_" + uuid.uuid4().hex
+users.add(PAGER_KEY, username="pager", password_hash=hash_password("pager"))
+
+
+@pytest.fixture(scope="module")
+def pager_pets():
+    return [
+        create_pet("Alpha", "dog", 1, key=PAGER_KEY),
+        create_pet("Albert", "cat", 4, key=PAGER_KEY),
+        create_pet("Bella", "dog", 7, key=PAGER_KEY),
+        create_pet("Bruno", "bird", 2, key=PAGER_KEY),
+        create_pet("Alma", "dog", 12, key=PAGER_KEY),
+    ]
+
+
+@pytest.mark.usefixtures("pager_pets")
+class TestPetsPagination:
+    """Тесты постраничного вывода и фильтрации списка питомцев"""
+
+    def test_pagination_with_cursor(self, pager_pets):
+        """Тест 27: Обход всех страниц по курсору без пропусков и повторов"""
+        seen = []
+        params = {"limit": 2}
+        while True:
+            response = client.get("/api/pets", headers={"auth-key": PAGER_KEY}, params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            seen.extend(pet["pet_id"] for pet in page)
+            if "x-next-cursor" not in response.headers:
+                break
+            assert 'rel="next"' in response.headers["link"]
+            params = {"limit": 2, "cursor": response.headers["x-next-cursor"]}
+        assert seen == [pet["pet_id"] for pet in pager_pets]
+
+    def test_fields_projection(self):
+        """Тест 28: Выбор полей через fields"""
+        response = client.get(
+            "/api/pets",
+            headers={"auth-key": PAGER_KEY},
+            params={"fields": "pet_id,name"}
+        )
+        assert response.status_code == 200
+        assert all(set(pet) == {"pet_id", "name"} for pet in response.json())
+
+    def test_filters(self):
+        """Тест 29: Фильтрация по виду, возрасту и префиксу имени"""
+        response = client.get(
+            "/api/pets",
+            headers={"auth-key": PAGER_KEY},
+            params={"animal_type": "dog", "min_age": 1, "max_age": 10, "name_prefix": "a"}
+        )
+        assert response.status_code == 200
+        assert [pet["name"] for pet in response.json()] == ["Alpha"]
+
+    def test_list_etag_not_modified(self):
+        """Тест 46: Неизменный список отдает 304, изменение питомца дает новый ETag"""
+        headers = {"auth-key": PAGER_KEY}
+        first = client.get("/api/pets", headers=headers)
+        etag = first.headers["etag"]
+        response = client.get("/api/pets", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        pet_id = first.json()[0]["pet_id"]
+        client.put(f"/api/pets/{pet_id}", headers=headers, params={"age": 3})
+        response = client.get("/api/pets", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert response.json()[0]["age"] == 3
+
+    def test_list_cache_keys(self):
+        """Тест 47: Кеш различает пользователей, фильтры и страницы"""
+        headers = {"auth-key": PAGER_KEY}
+        dogs = client.get("/api/pets", headers=headers, params={"animal_type": "dog"})
+        cats = client.get("/api/pets", headers=headers, params={"animal_type": "cat"})
+        assert dogs.headers["etag"] != cats.headers["etag"]
+        assert {pet["animal_type"] for pet in cats.json()} == {"cat"}
+
+        second_page = client.get("/api/pets", headers=headers, params={"limit": 2})
+        assert second_page.headers["etag"] != dogs.headers["etag"]
+        assert "x-next-cursor" in second_page.headers
+
+        other = client.get("/api/pets", headers={"auth-key": VALID_KEY})
+        mine = client.get("/api/pets", headers=headers)
+        assert other.headers["etag"] != mine.headers["etag"]
+        assert {pet["user_id"] for pet in mine.json()} == {PAGER_KEY}
+
+    def test_invalid_pagination_params(self):
+        """Тест 30: Некорректные курсор, лимит и поля"""
+        aware = base64.urlsafe_b64encode(json.dumps(["2026-01-01T00:00:00+00:00", str(uuid.uuid4())]).encode())
+        for params in ({"cursor": "not-a-cursor"}, {"cursor": aware.decode()}, {"limit": 0}, {"limit": 100000},
+                       {"fields": "password"}):
+            for path in ("/api/pets", "/api/pets/search"):
+                response = client.get(path, headers={"auth-key": PAGER_KEY}, params=params)
+                assert response.status_code == 400
+
+
+
+BATCH_KEY = "batch_" + uuid.uuid4().hex
+users.add(BATCH_KEY, username="batch", password_hash=hash_password("batch"))
+
+
+class TestPetsBatch:
+    """Тесты пакетного создания, обновления и удаления питомцев"""
+
+    def test_create_batch(self):
+        """Тест 31: Пакетное создание питомцев"""
+        response = client.post(
+            "/api/pets/batch",
+            headers={"auth-key": BATCH_KEY},
+            json=[{"animal_type": "Dog", "name": f" Batch{i} ", "age": i} for i in range(5)]
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["status_code"] for result in results] == [201] * 5
+        assert results[0]["pet"]["animal_type"] == "dog"
+        assert results[0]["pet"]["name"] == "Batch0"
+
+    def test_create_batch_atomic_rejects_all(self):
+        """Тест 32: Атомарный пакет с ошибкой не создает ни одного питомца"""
+        before = len(client.get("/api/pets", headers={"auth-key": BATCH_KEY}).json())
+        response = client.post(
+            "/api/pets/batch",
+            headers={"auth-key": BATCH_KEY},
+            json=[{"animal_type": "dog", "name": "Fine", "age": 1},
+                  {"animal_type": "dragon", "name": "Smaug", "age": 1},
+                  {"animal_type": "cat", "name": "Old", "age": 101}]
+        )
+        assert response.status_code == 400
+        errors = response.json()["detail"]
+        assert [error["index"] for error in errors] == [1, 2]
+        assert errors[1]["detail"] == "Age is unrealistic for a pet"
+        after = len(client.get("/api/pets", headers={"auth-key": BATCH_KEY}).json())
+        assert after == before
+
+    def test_create_batch_partial(self):
+        """Тест 33: Неатомарный пакет возвращает результат по каждому элементу"""
+        response = client.post(
+            "/api/pets/batch",
+            headers={"auth-key": BATCH_KEY},
+            params={"atomic": False},
+            json=[{"animal_type": "dog", "name": "Partial", "age": 1},
+                  {"animal_type": "dog", "name": "X", "age": 1}]
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["status_code"] == 201
+        assert results[1] == {
+            "index": 1,
+            "status_code": 400,
+            "detail": "Name must be at least 2 characters long"
+        }
+
+    def test_create_batch_limits(self):
+        """Тест 34: Пустой и слишком большой пакет, неверный ключ"""
+        response = client.post("/api/pets/batch", headers={"auth-key": BATCH_KEY}, json=[])
+        assert response.status_code == 400
+        item = {"animal_type": "dog", "name": "Many", "age": 1}
+        response = client.post("/api/pets/batch", headers={"auth-key": BATCH_KEY}, json=[item] * 1001)
+        assert response.status_code == 400
+        response = client.post("/api/pets/batch", headers={"auth-key": INVALID_KEY}, json=[item])
+        assert response.status_code == 401
+
+    def test_update_batch(self):
+        """Тест 35: Пакетное обновление и проверка прав"""
+        own = create_pet("Updatable", key=BATCH_KEY)
+        foreign = create_pet("Foreign")
+        response = client.patch(
+            "/api/pets/batch",
+            headers={"auth-key": BATCH_KEY},
+            params={"atomic": False},
+            json=[{"pet_id": own["pet_id"], "name": "Renamed", "age": 9},
+                  {"pet_id": foreign["pet_id"], "name": "Stolen"},
+                  {"pet_id": str(uuid.uuid4()), "age": 1}]
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["pet"]["name"] == "Renamed"
+        assert results[0]["pet"]["age"] == 9
+        assert results[1]["status_code"] == 403
+        assert results[2]["status_code"] == 404
+
+    def test_delete_batch(self):
+        """Тест 36: Пакетное удаление питомцев"""
+        first = create_pet("DeleteMe1", key=BATCH_KEY)
+        second = create_pet("DeleteMe2", key=BATCH_KEY)
+        response = client.request(
+            "DELETE",
+            "/api/pets/batch",
+            headers={"auth-key": BATCH_KEY},
+            json=[first["pet_id"], second["pet_id"]]
+        )
+        assert response.status_code == 200
+        remaining = {pet["pet_id"] for pet in client.get("/api/pets", headers={"auth-key": BATCH_KEY}).json()}
+        assert first["pet_id"] not in remaining
+        assert second["pet_id"] not in remaining
+
+
+
+@pytest.mark.usefixtures("pager_pets")
+class TestPetsExport:
+    """Тесты потоковой выгрузки питомцев в NDJSON"""
+
+    def test_export_ndjson(self, monkeypatch):
+        """Тест 37: Выгрузка совпадает со списком и читается построчно"""
+        monkeypatch.setattr(api, "EXPORT_CHUNK_SIZE", 2)
+        expected = client.get("/api/pets", headers={"auth-key": PAGER_KEY}).json()
+        response = client.get(
+            "/api/pets/export",
+            headers={"auth-key": PAGER_KEY, "Accept-Encoding": "identity"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert "content-encoding" not in response.headers
+        lines = response.content.decode().splitlines()
+        assert [json.loads(line) for line in lines] == expected
+
+    def test_export_gzip(self):
+        """Тест 38: Сжатая выгрузка с полями и фильтром, gzip только если клиент его принимает"""
+        response = client.get(
+            "/api/pets/export",
+            headers={"auth-key": PAGER_KEY, "Accept-Encoding": "gzip"},
+            params={"fields": "name", "animal_type": "dog"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        names = [json.loads(line)["name"] for line in response.text.splitlines()]
+        assert names == ["Alpha", "Bella", "Alma"]
+
+        for accept_encoding in ("gzip;q=0", "br, *;q=0", "x-gzip"):
+            response = client.get(
+                "/api/pets/export", headers={"auth-key": PAGER_KEY, "Accept-Encoding": accept_encoding}
+            )
+            assert "content-encoding" not in response.headers
+
+    def test_export_without_key(self):
+        """Тест 39: Выгрузка без ключа запрещена"""
+        response = client.get("/api/pets/export")
+        assert response.status_code == 401
+
+
+
+class TestMetricsEndpoint:
+    """Тесты эндпоинта метрик"""
+
+    def test_metrics(self):
+        """Тест 41: Метрики запросов и этапов доступны в формате Prometheus"""
+        client.get("/api/pets", headers={"auth-key": VALID_KEY})
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'http_requests_total{method="GET",route="/api/pets",status="200"}' in text
+        assert 'stage_duration_seconds_count{stage="auth"}' in text
+        assert 'stage_duration_seconds_count{stage="serialization"}' in text
+        assert "auth_key_cache_hits" in text
+
+
+class TestRateLimits:
+    """Тесты ограничения частоты и числа одновременных запросов"""
+
+    def test_rate_limit_per_key(self, monkeypatch):
+        """Тест 48: Превышение лимита ключа дает 429, загрузки отдельно, бюджет делится между процессами"""
+        monkeypatch.setitem(api.rate_limits, "request", RateLimit(
+            per_key=TokenBuckets(rate=0.01, burst=2),
+            per_client=TokenBuckets(rate=100, burst=100)
+        ))
+        monkeypatch.setitem(api.rate_limits, "upload", RateLimit(
+            per_key=TokenBuckets(rate=0.01, burst=1),
+            per_client=TokenBuckets(rate=100, burst=100)
+        ))
+        headers = {"auth-key": VALID_KEY}
+        assert client.get("/api/pets", headers=headers).status_code == 200
+        pet_id = client.post(
+            "/api/create_pet_simple", headers=headers, params={"animal_type": "cat", "name": "Limited", "age": 2}
+        ).json()["pet_id"]
+        response = client.get("/api/pets", headers=headers)
+        assert response.status_code == 429
+        assert response.json()["detail"] == "Rate limit exceeded"
+        assert int(response.headers["retry-after"]) >= 1
+        assert client.get("/api/pets", headers={"auth-key": PAGER_KEY}).status_code == 200
+        assert client.get("/metrics").status_code == 200
+
+        assert upload_photo(pet_id).status_code == 200
+        assert upload_photo(pet_id).status_code == 429
+        assert 'http_requests_rejected_total{budget="upload",reason="rate_limit"}' in client.get("/metrics").text
+
+        monkeypatch.setattr(api, "WORKERS", 4)
+        monkeypatch.setenv("PETS_KEY_RATE_LIMIT", "40/100")
+        buckets = api.token_buckets("PETS_KEY_RATE_LIMIT", "50/100")
+        assert (buckets.rate, buckets.burst) == (10, 25)
+        assert api.token_buckets("PETS_KEY_UPLOAD_LIMIT", "1/2").burst == 1
+
+    def test_overloaded(self, monkeypatch):
+        """Тест 49: Без свободных мест и очереди запросы отклоняются с 503 и Retry-After"""
+        monkeypatch.setattr(api.admission, "max_active", 0)
+        monkeypatch.setattr(api.admission, "max_queued", 0)
+        response = client.get("/api/pets", headers={"auth-key": VALID_KEY})
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Server is overloaded"
+        assert response.headers["retry-after"] == "1"
+        assert client.get("/metrics").status_code == 200
+
+
+ANIMAL_TYPE_ERROR = "Invalid animal type. Allowed types: dog, cat, bird, fish, rabbit, hamster, turtle, parrot, other"
+
+
+class TestPetValidation:
+    """Тесты единой проверки данных питомца во всех эндпоинтах записи"""
+
+    def test_same_errors_everywhere(self):
+        """Тест 54: Граничные случаи дают прежние сообщения при создании любым способом"""
+        headers = {"auth-key": VALID_KEY}
+        cases = [
+            ({"animal_type": "dog", "name": "Buddy", "age": -5}, "Age cannot be negative"),
+            ({"animal_type": "dog", "name": "Oldie", "age": 1000}, "Age is unrealistic for a pet"),
+            ({"animal_type": "rabbit", "name": "A" * 1000, "age": 1}, "Name cannot exceed 50 characters"),
+            ({"animal_type": "dragon", "name": "Rex", "age": 1}, ANIMAL_TYPE_ERROR),
+            ({"animal_type": "dog", "name": "R", "age": 1}, "Name must be at least 2 characters long"),
+        ]
+        for params, detail in cases:
+            simple = client.post("/api/create_pet_simple", headers=headers, params=params)
+            form = client.post("/api/pets", headers=headers, data=params)
+            batch = client.post("/api/pets/batch", headers=headers, json=[params])
+            assert (simple.status_code, simple.json()["detail"]) == (400, detail)
+            assert (form.status_code, form.json()["detail"]) == (400, detail)
+            assert batch.status_code == 400
+            assert batch.json()["detail"][0]["detail"] == detail
+
+        response = client.post(
+            "/api/create_pet_simple", headers=headers, params={"animal_type": "bird", "name": "", "age": 2}
+        )
+        assert response.json()["detail"] == "Missing required fields: animal_type and name are required"
+        response = client.post("/api/pets", headers=headers, data={"animal_type": "bird", "name": "  ", "age": 2})
+        assert response.json()["detail"] == "Name is required"
+
+    def test_update_validates(self):
+        """Тест 55: Обновление питомца проверяет и нормализует поля"""
+        headers = {"auth-key": VALID_KEY}
+        pet = create_pet("Validated")
+        for params, detail in (
+                ({"age": -1}, "Age cannot be negative"),
+                ({"name": "A" * 51}, "Name cannot exceed 50 characters"),
+                ({"animal_type": "dragon"}, ANIMAL_TYPE_ERROR)
+        ):
+            response = client.put(f"/api/pets/{pet['pet_id']}", headers=headers, params=params)
+            assert (response.status_code, response.json()["detail"]) == (400, detail)
+
+        response = client.put(
+            f"/api/pets/{pet['pet_id']}", headers=headers, params={"name": "  Valid  ", "animal_type": "CAT"}
+        )
+        assert response.status_code == 200
+        assert (response.json()["name"], response.json()["animal_type"]) == ("Valid", "cat")
+        assert api.pets.get(pet["pet_id"])["age"] == 1
+
+
+class TestPetChanges:
+    """Тесты ленты изменений питомцев"""
+
+    def test_changes_long_poll(self):
+        """Тест 50: Лента отдает только изменения после номера и только свои по умолчанию"""
+        headers = {"auth-key": VALID_KEY}
+        last_seq = client.get("/api/pets/changes", headers=headers).json()["last_seq"]
+        pet = create_pet("Changing")
+        client.put(f"/api/pets/{pet['pet_id']}", headers=headers, params={"age": 5})
+        create_pet("Foreign", key=PAGER_KEY)
+        client.delete(f"/api/pets/{pet['pet_id']}", headers=headers)
+
+        response = client.get("/api/pets/changes", headers=headers, params={"since": last_seq})
+        assert response.status_code == 200
+        body = response.json()
+        assert [(item["type"], item["pet_id"]) for item in body["changes"]] == [
+            ("created", pet["pet_id"]), ("updated", pet["pet_id"]), ("deleted", pet["pet_id"])
+        ]
+        assert body["changes"][1]["pet"]["age"] == 5
+        assert body["last_seq"] == body["changes"][-1]["seq"]
+
+        everyone = client.get(
+            "/api/pets/changes", headers=headers, params={"since": last_seq, "filter_type": "all"}
+        ).json()["changes"]
+        assert len(everyone) == 4
+
+        response = client.get("/api/pets/changes", headers=headers, params={"since": body["last_seq"], "timeout": 0})
+        assert response.json() == {"changes": [], "last_seq": body["last_seq"]}
+
+    def test_changes_wait_for_write(self):
+        """Тест 51: Долгий опрос возвращается сразу после изменения"""
+        headers = {"auth-key": VALID_KEY}
+        last_seq = client.get("/api/pets/changes", headers=headers).json()["last_seq"]
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+                started = time.perf_counter()
+                poll = asyncio.create_task(async_client.get(
+                    "/api/pets/changes", headers=headers, params={"since": last_seq, "timeout": 10}
+                ))
+                await asyncio.sleep(0.1)
+                assert not poll.done()
+                await async_client.post(
+                    "/api/create_pet_simple", headers=headers,
+                    params={"animal_type": "cat", "name": "Awaited", "age": 3}
+                )
+                response = await poll
+            return response, time.perf_counter() - started
+
+        response, elapsed = asyncio.run(run())
+        assert response.status_code == 200
+        assert [item["pet"]["name"] for item in response.json()["changes"]] == ["Awaited"]
+        assert elapsed < 5
+
+    def test_changes_invalid_since(self):
+        """Тест 52: Номер из другого запуска дает 410, некорректный таймаут 400"""
+        headers = {"auth-key": VALID_KEY}
+        unknown = api.pet_changes.last_seq + 1000
+        response = client.get("/api/pets/changes", headers=headers, params={"since": unknown})
+        assert response.status_code == 410
+        for timeout in (100, -1, "nan"):
+            response = client.get("/api/pets/changes", headers=headers, params={"since": 0, "timeout": timeout})
+            assert response.status_code == 400
+        assert client.get("/api/pets/changes", params={"since": 0}).status_code == 401
+
+    def test_change_events(self):
+        """Тест 53: Поток событий передает изменения только питомцев владельца ключа"""
+        last_seq = api.pet_changes.last_seq
+        create_pet("Foreign stream", key=PAGER_KEY)
+        pet = create_pet("Streamed")
+
+        async def run():
+            events = api.change_events(last_seq, VALID_KEY)
+            try:
+                return await events.__anext__()
+            finally:
+                await events.aclose()
+
+        event = asyncio.run(run()).decode()
+        lines = event.split("\n")
+        assert lines[:2] == [f"id: {api.pet_changes.last_seq}", "event: created"]
+        assert json.loads(lines[2].removeprefix("data: "))["pet_id"] == pet["pet_id"]
+        assert event.endswith("\n\n")
+
+
+SEARCH_KEY = "search_" + uuid.uuid4().hex
+users.add(SEARCH_KEY, username="searcher", password_hash=hash_password("searcher"))
+
+
+class TestPetSearch:
+    """Тесты поиска питомцев по индексам"""
+
+    def search(self, **params):
+        response = client.get("/api/pets/search", headers={"auth-key": SEARCH_KEY}, params=params)
+        assert response.status_code == 200
+        return [pet["name"] for pet in response.json()]
+
+    def test_search_filters(self):
+        """Тест 56: Поиск по подстроке, префиксу, типу и возрасту с обходом страниц по курсору"""
+        for name, animal_type, age in (("Snowball", "cat", 3), ("Ball", "dog", 5), ("Bobby", "dog", 9),
+                                       ("Eyeball", "fish", 1), ("Snowy", "cat", 12)):
+            create_pet(name, animal_type, age, key=SEARCH_KEY)
+        create_pet("Football", "dog", 5)
+
+        assert self.search(q="BALL") == ["Snowball", "Ball", "Eyeball"]
+        assert self.search(q="ball", filter_type="all")[-1] == "Football"
+        assert self.search(name_prefix="sNo") == ["Snowball", "Snowy"]
+        assert self.search(name_prefix="Snow" + chr(0x10FFFF)) == []
+        assert self.search(animal_type="Dog", min_age=6) == ["Bobby"]
+        assert self.search(q="all", min_age=2, max_age=5) == ["Snowball", "Ball"]
+        assert self.search(q="xyz") == []
+
+        seen, params = [], {"q": "ball", "limit": 2}
+        while True:
+            response = client.get("/api/pets/search", headers={"auth-key": SEARCH_KEY}, params=params)
+            seen.extend(pet["name"] for pet in response.json())
+            if "x-next-cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["x-next-cursor"]
+        assert seen == ["Snowball", "Ball", "Eyeball"]
+
+    def test_search_follows_writes(self):
+        """Тест 57: Индексы обновляются при изменении и удалении, короткий запрос дает 400"""
+        headers = {"auth-key": SEARCH_KEY}
+        pet = create_pet("Whiskers", "cat", 2, key=SEARCH_KEY)
+        assert self.search(q="hisk") == ["Whiskers"]
+        client.put(f"/api/pets/{pet['pet_id']}", headers=headers, params={"name": "Mittens", "age": 20})
+        assert self.search(q="hisk") == []
+        assert self.search(q="itten", min_age=20) == ["Mittens"]
+        client.delete(f"/api/pets/{pet['pet_id']}", headers=headers)
+        assert self.search(q="itten") == []
+
+        response = client.get("/api/pets/search", headers=headers, params={"q": " ab "})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Search text must be at least 3 characters long"
+        assert client.get("/api/pets/search", params={"q": "ball"}).status_code == 401
+
+
+IDEMPOTENT_KEY = "idempotent_" + uuid.uuid4().hex
+users.add(IDEMPOTENT_KEY, username="retrier", password_hash=hash_password("retrier"))
+
+
+class TestIdempotency:
+    """Тесты повторов создания питомцев с ключом идемпотентности"""
+
+    def test_simple_create_retry(self):
+        """Тест 58: Повтор с тем же Idempotency-Key возвращает того же питомца и не создает нового"""
+        headers = {"auth-key": IDEMPOTENT_KEY, "Idempotency-Key": uuid.uuid4().hex}
+        params = {"animal_type": "dog", "name": "Once", "age": 2}
+        first = client.post("/api/create_pet_simple", headers=headers, params=params)
+        retry = client.post("/api/create_pet_simple", headers=headers, params=params)
+        assert first.status_code == retry.status_code == 201
+        assert retry.json() == first.json()
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert api.pets.count_for_user(IDEMPOTENT_KEY) == 1
+
+        other = client.post("/api/pets", headers=headers, data=params)
+        assert other.status_code == 422
+        response = client.post("/api/create_pet_simple", headers={"auth-key": IDEMPOTENT_KEY}, params=params)
+        assert response.status_code == 201
+        assert api.pets.count_for_user(IDEMPOTENT_KEY) == 2
+
+    def test_upload_retry_writes_once(self, monkeypatch):
+        """Тест 59: Повтор загрузки с фото не записывает файл второй раз и не расходует лимит питомцев"""
+        headers = {"auth-key": IDEMPOTENT_KEY, "Idempotency-Key": uuid.uuid4().hex}
+        saved = []
+
+        async def counting_save_upload(*args, **kwargs):
+            saved.append(args)
+            return await photos.save_upload(*args, **kwargs)
+
+        monkeypatch.setattr(api, "save_upload", counting_save_upload)
+
+        def upload():
+            return client.post(
+                "/api/pets",
+                headers=headers,
+                data={"animal_type": "cat", "name": "Uploaded", "age": 3},
+                files={"pet_photo": ("photo.png", BytesIO(PNG_BYTES), "image/png")}
+            )
+
+        first = upload()
+        retry = upload()
+        assert first.status_code == retry.status_code == 201
+        assert retry.json()["pet_id"] == first.json()["pet_id"]
+        assert len(saved) == 1
+        assert [pet["name"] for pet in api.pets.for_user(IDEMPOTENT_KEY)].count("Uploaded") == 1
+
+
+class TestCompressionAndCaching:
+    """Тесты сжатия ответов и заголовков кэширования"""
+
+    def test_list_compressed_on_request(self):
+        """Тест 60: Список сжимается только по Accept-Encoding, 304 работает со слабым ETag"""
+        for index in range(10):
+            create_pet(f"Compressed{index}")
+        params = {"filter_type": "all"}
+        plain = client.get("/api/pets", headers={"auth-key": VALID_KEY, "Accept-Encoding": "identity"}, params=params)
+        packed = client.get("/api/pets", headers={"auth-key": VALID_KEY, "Accept-Encoding": "gzip"}, params=params)
+        assert "content-encoding" not in plain.headers
+        assert packed.headers["content-encoding"] == "gzip"
+        assert int(packed.headers["content-length"]) < len(plain.content) / 3
+        assert packed.json() == plain.json()
+        for response in (plain, packed):
+            assert response.headers["cache-control"] == "private, no-cache"
+            assert response.headers["vary"] == "auth-key, Accept-Encoding"
+            assert response.headers["etag"].startswith('W/"')
+
+        response = client.get(
+            "/api/pets",
+            headers={"auth-key": VALID_KEY, "Accept-Encoding": "gzip", "If-None-Match": packed.headers["etag"]},
+            params=params
+        )
+        assert response.status_code == 304
+
+    def test_photos_not_compressed(self):
+        """Тест 61: Фотография отдается без повторного сжатия и с Cache-Control"""
+        pet = create_pet("Pictured")
+        assert upload_photo(pet["pet_id"], content=PNG_BYTES * 4).status_code == 200
+        response = client.get(
+            f"/api/pets/{pet['pet_id']}/photo",
+            headers={"auth-key": VALID_KEY, "Accept-Encoding": "gzip, br"},
+            params={"size": "original"}
+        )
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert response.content == PNG_BYTES * 4
+        assert response.headers["cache-control"] == "private, no-cache"
+
+
 # Фикстуры для настройки и очистки
 @pytest.fixture(scope="session", autouse=True)
 def cleanup_after_tests():
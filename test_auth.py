@@ -0,0 +1,79 @@
+from auth import KeyResolver, LoginCache, hash_password, verify_password
+from storage import UserStore
+
+
+class TestPasswordHashing:
+    """Тесты хеширования паролей"""
+
+    def test_verify_correct_password(self):
+        """Тест 1: Верный пароль проходит проверку"""
+        assert verify_password("secret", hash_password("secret"))
+
+    def test_verify_wrong_password(self):
+        """Тест 2: Неверный пароль отклоняется"""
+        assert not verify_password("wrong", hash_password("secret"))
+
+    def test_hash_is_salted(self):
+        """Тест 3: Одинаковые пароли дают разные хеши"""
+        first, second = hash_password("secret"), hash_password("secret")
+        assert first != second
+        assert "secret" not in first
+
+    def test_verify_malformed_hash(self):
+        """Тест 4: Поврежденный хеш не проходит проверку"""
+        assert not verify_password("secret", "plaintext")
+
+
+class TestLoginCache:
+    """Тесты кеша успешных входов"""
+
+    def test_cached_login(self):
+        """Тест 5: Кеш возвращает ключ только для той же пары логин/пароль"""
+        cache = LoginCache()
+        cache.set("admin", "admin", "key")
+        assert cache.get("admin", "admin") == "key"
+        assert cache.get("admin", "other") is None
+
+
+class CountingUserStore(UserStore):
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def get(self, key):
+        self.lookups += 1
+        return super().get(key)
+
+
+class TestKeyResolver:
+    """Тесты кеша проверки ключей авторизации"""
+
+    def test_valid_key_cached(self):
+        """Тест 6: Повторная проверка ключа не обращается к хранилищу"""
+        users = CountingUserStore()
+        users.add("key1", username="alice", password_hash="hash")
+        resolver = KeyResolver(users)
+        assert resolver.resolve("key1") == {"auth_key": "key1", "username": "alice"}
+        assert resolver.resolve("key1") is not None
+        assert users.lookups == 1
+        assert resolver.stats()["hits"] == 1
+        assert resolver.stats()["misses"] == 1
+
+    def test_invalid_key_negative_cached(self):
+        """Тест 7: Неверный ключ запоминается и не проверяется повторно"""
+        users = CountingUserStore()
+        resolver = KeyResolver(users)
+        assert resolver.resolve("bad") is None
+        assert resolver.resolve("bad") is None
+        assert users.lookups == 1
+        assert resolver.stats()["negative_hits"] == 1
+
+    def test_invalidate_on_revoke(self):
+        """Тест 8: Отозванный ключ перестает действовать сразу"""
+        users = CountingUserStore()
+        users.add("key1", username="alice", password_hash="hash")
+        resolver = KeyResolver(users)
+        assert resolver.resolve("key1") is not None
+        users.remove("key1")
+        resolver.invalidate("key1")
+        assert resolver.resolve("key1") is None
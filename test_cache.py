@@ -0,0 +1,72 @@
+from cache import InvalidationBus, TTLCache, VersionCounter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    """Тесты ограниченного кеша с временем жизни записей"""
+
+    def test_entry_expires(self):
+        """Тест 1: Запись пропадает по истечении TTL"""
+        clock = FakeClock()
+        cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        clock.now = 5
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        """Тест 2: При переполнении вытесняется давно не используемая запись"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_pop(self):
+        """Тест 3: Явное удаление записи"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        assert cache.pop("a") == 1
+        assert cache.pop("a", "missing") == "missing"
+
+
+class TestVersionCounter:
+    """Тесты счетчика версий данных"""
+
+    def test_bump_global_and_owner(self):
+        """Тест 4: Изменение повышает общую версию и версию владельца"""
+        versions = VersionCounter()
+        assert versions.get() == 0
+        versions.bump("alice")
+        alice = versions.get("alice")
+        assert versions.get() == alice > 0
+        versions.bump("bob")
+        assert versions.get("alice") == alice
+        assert versions.get("bob") > alice
+        assert versions.get() == versions.get("bob")
+        assert versions.get("carol") == 0
+
+
+class TestInvalidationBus:
+    """Тесты локальной рассылки инвалидаций"""
+
+    def test_publish_delivers_by_topic(self):
+        """Тест 5: Сообщение получают только подписчики его темы"""
+        bus = InvalidationBus()
+        keys, other = [], []
+        bus.subscribe("auth_key", keys.append)
+        bus.subscribe("other", other.append)
+        bus.publish("auth_key", "key1")
+        assert keys == ["key1"]
+        assert other == []
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from changes import ChangeFeed, ChangesExpired
+
+
+def pet(pet_id, user_id="alice", name="Rex"):
+    return {"pet_id": pet_id, "user_id": user_id, "name": name}
+
+
+class TestChangeFeed:
+    """Тесты журнала изменений питомцев"""
+
+    def test_since_returns_deltas(self):
+        """Тест 1: Возвращаются только изменения после номера, с фильтром по владельцу"""
+        feed = ChangeFeed(capacity=10)
+        start = feed.last_seq
+        feed.record("created", [pet("1"), pet("2", user_id="bob")])
+        record = pet("1", name="Max")
+        feed.record("updated", [record])
+        record["name"] = "Changed later"
+        feed.record("deleted", [pet("2", user_id="bob")])
+
+        changes, last = feed.since(start)
+        assert last == start + 4
+        assert [(item["seq"], item["type"], item["pet_id"]) for item in changes] == [
+            (start + 1, "created", "1"), (start + 2, "created", "2"),
+            (start + 3, "updated", "1"), (start + 4, "deleted", "2")
+        ]
+        assert changes[2]["pet"]["name"] == "Max"
+        assert changes[3]["pet"] is None
+
+        mine, last = feed.since(start + 1, user_id="alice")
+        assert [item["seq"] for item in mine] == [start + 3]
+        assert last == start + 4
+        assert feed.since(last) == ([], last)
+
+    def test_ring_buffer_expires(self):
+        """Тест 2: Отставшие больше чем на размер буфера и чужие номера получают ошибку"""
+        feed = ChangeFeed(capacity=3)
+        start = feed.last_seq
+        feed.record("created", [pet(str(i)) for i in range(5)])
+        with pytest.raises(ChangesExpired):
+            feed.since(start + 1)
+        assert [item["pet_id"] for item in feed.since(start + 2)[0]] == ["2", "3", "4"]
+        with pytest.raises(ChangesExpired):
+            feed.since(start + 6)
+        with pytest.raises(ChangesExpired):
+            feed.since(0)
+        assert ChangeFeed().last_seq > start
+
+    def test_wait_wakes_on_record(self):
+        """Тест 3: Ожидание завершается, как только из другого потока записано изменение"""
+        feed = ChangeFeed()
+        start = feed.last_seq
+
+        async def run():
+            timer = threading.Timer(0.05, feed.record, args=("created", [pet("1")]))
+            timer.start()
+            began = time.perf_counter()
+            await feed.wait(start, timeout=5)
+            return time.perf_counter() - began
+
+        assert asyncio.run(run()) < 1
+        assert feed.since(start)[1] == start + 1
@@ -0,0 +1,86 @@
+import asyncio
+import gzip
+
+from cache import TTLCache
+from compression import CompressionMiddleware, gzip_compress, negotiate
+
+
+class StaticApp:
+    def __init__(self, body: bytes, content_type=b"application/json", headers=(), chunks=1):
+        self.body = body
+        self.headers = [(b"content-type", content_type), (b"content-length", str(len(body)).encode()), *headers]
+        self.chunks = chunks
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": self.headers})
+        size = len(self.body) // self.chunks
+        for index in range(self.chunks):
+            last = index == self.chunks - 1
+            await send({
+                "type": "http.response.body",
+                "body": self.body[index * size:] if last else self.body[index * size:(index + 1) * size],
+                "more_body": not last
+            })
+
+
+def respond(middleware, accept_encoding="gzip"):
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    start, *bodies = messages
+    return dict(start["headers"]), b"".join(message["body"] for message in bodies)
+
+
+class TestCompression:
+    """Тесты сжатия ответов"""
+
+    def test_negotiate(self):
+        """Тест 1: Выбирается кодировка с наибольшим весом, при равенстве - предпочтение сервера"""
+        encodings = {"br": None, "gzip": None}
+        assert negotiate("gzip, deflate, br", encodings) == "br"
+        assert negotiate("gzip;q=1.0, br;q=0.5", encodings) == "gzip"
+        assert negotiate("br;q=0, *", encodings) == "gzip"
+        assert negotiate("identity", encodings) is None
+        assert negotiate("", encodings) is None
+        assert negotiate("deflate, gzip", {"gzip": None}) == "gzip"
+
+    def test_compresses_large_text(self):
+        """Тест 2: Большой JSON сжимается, в том числе в потоке, ETag становится слабым и сжатие кэшируется"""
+        body = b'{"name": "Rex"}' * 10_000
+        cache = TTLCache(maxsize=4, ttl=60)
+        app = StaticApp(body, headers=[(b"etag", b'"abc"'), (b"vary", b"auth-key")])
+        middleware = CompressionMiddleware(app, thread_size=1024, cache=cache)
+        headers, compressed = respond(middleware)
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"content-length"] == str(len(compressed)).encode()
+        assert headers[b"etag"] == b'W/"abc"'
+        assert headers[b"vary"] == b"auth-key, Accept-Encoding"
+        assert gzip.decompress(compressed) == body
+        assert cache.get(('"abc"', "gzip")) == compressed
+
+        middleware = CompressionMiddleware(app, encodings={"gzip": lambda data: b"unused"}, cache=cache)
+        assert respond(middleware)[1] == compressed
+        assert gzip.decompress(gzip_compress(body, level=1)) == body
+
+    def test_skips_what_should_not_be_compressed(self):
+        """Тест 3: Маленькие, бинарные, уже сжатые и потоковые ответы и клиенты без gzip получают тело как есть"""
+        large = b"x" * 5000
+        cases = [
+            (StaticApp(b"{}"), "gzip", True),
+            (StaticApp(large, content_type=b"image/png"), "gzip", False),
+            (StaticApp(large, headers=[(b"content-encoding", b"gzip")]), "gzip", False),
+            (StaticApp(large, content_type=b"application/x-ndjson", chunks=3), "gzip", True),
+            (StaticApp(large), "identity", True),
+        ]
+        for app, accept_encoding, varies in cases:
+            headers, body = respond(CompressionMiddleware(app), accept_encoding)
+            assert body == app.body
+            assert b"content-encoding" not in headers or headers[b"content-encoding"] == b"gzip"
+            assert (headers.get(b"vary") == b"Accept-Encoding") == varies
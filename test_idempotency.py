@@ -0,0 +1,103 @@
+import asyncio
+
+from cache import TTLCache
+from idempotency import IdempotencyMiddleware
+
+
+class CountingApp:
+    """Answers with the number of calls so far, after ``release`` is set."""
+
+    def __init__(self, *statuses):
+        self.statuses = statuses or (201,)
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        body = str(self.calls).encode()
+        status = self.statuses[min(self.calls, len(self.statuses)) - 1]
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": status, "headers": [(b"x-call", body)]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def request(middleware, path="/api/create_pet_simple", key="retry-1", auth="alice"):
+    headers = [(b"auth-key", auth.encode())]
+    if key is not None:
+        headers.append((b"idempotency-key", key.encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await middleware(scope, receive, send)
+        start, body = messages
+        return start["status"], dict(start["headers"]), body["body"]
+
+    return run()
+
+
+def middleware_for(app):
+    return IdempotencyMiddleware(app, TTLCache(maxsize=10, ttl=60), applies=lambda scope: True)
+
+
+class TestIdempotencyMiddleware:
+    """Тесты повторов запросов с ключом идемпотентности"""
+
+    def test_retries_replay_first_response(self):
+        """Тест 1: Повтор с тем же ключом получает сохраненный ответ, другой ключ или владелец выполняются заново"""
+        app = CountingApp()
+        middleware = middleware_for(app)
+        app.release.set()
+
+        async def run():
+            first = await request(middleware)
+            retry = await request(middleware)
+            assert retry[0] == 201 and retry[2] == first[2] == b"1"
+            assert retry[1][b"idempotent-replayed"] == b"true"
+            assert b"idempotent-replayed" not in first[1]
+            assert (await request(middleware, key="retry-2"))[2] == b"2"
+            assert (await request(middleware, auth="bob"))[2] == b"3"
+            assert (await request(middleware, key=None))[2] == b"4"
+            assert (await request(middleware, path="/api/pets"))[0] == 422
+            assert (await request(middleware, key="k" * 256))[0] == 400
+
+        asyncio.run(run())
+        assert app.calls == 4
+
+    def test_concurrent_duplicates_coalesce(self):
+        """Тест 2: Одновременные повторы ждут первый запрос вместо повторной работы"""
+        app = CountingApp()
+        middleware = middleware_for(app)
+
+        async def run():
+            tasks = [asyncio.create_task(request(middleware)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            assert app.calls == 1
+            app.release.set()
+            return await asyncio.gather(*tasks)
+
+        responses = asyncio.run(run())
+        assert [body for _, _, body in responses] == [b"1", b"1", b"1"]
+        assert app.calls == 1
+
+    def test_errors_are_not_stored(self):
+        """Тест 3: Ответ с ошибкой не сохраняется, ожидавший повтор выполняется сам"""
+        app = CountingApp(500, 201)
+        middleware = middleware_for(app)
+
+        async def run():
+            tasks = [asyncio.create_task(request(middleware)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            app.release.set()
+            return await asyncio.gather(*tasks)
+
+        first, second = asyncio.run(run())
+        assert (first[0], first[2]) == (500, b"1")
+        assert (second[0], second[2]) == (201, b"2")
+        assert b"idempotent-replayed" not in second[1]
@@ -0,0 +1,91 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import MetricsMiddleware, Registry
+from profiling import ProfilingMiddleware
+
+
+def make_registry():
+    registry = Registry()
+    registry.counter("http_requests_total", "requests")
+    registry.counter("http_request_errors_total", "errors")
+    registry.histogram("http_request_duration_seconds", "latency")
+    registry.histogram("http_response_size_bytes", "size", (10, 100))
+    registry.gauge("http_requests_in_flight", "in flight")
+    registry.histogram("stage_duration_seconds", "stages")
+    return registry
+
+
+def make_app(registry):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with registry.span("lookup"):
+            return {"item_id": item_id}
+
+    @app.get("/slow")
+    def slow():
+        time.sleep(0.05)
+        return {}
+
+    return app
+
+
+class TestMetrics:
+    """Тесты сбора метрик"""
+
+    def test_histogram_render(self):
+        """Тест 1: Гистограмма выводится накопительно в формате Prometheus"""
+        registry = make_registry()
+        registry.observe("http_response_size_bytes", 5, route="/a")
+        registry.observe("http_response_size_bytes", 50, route="/a")
+        text = registry.render()
+        assert 'http_response_size_bytes_bucket{route="/a",le="10"} 1' in text
+        assert 'http_response_size_bytes_bucket{route="/a",le="100"} 2' in text
+        assert 'http_response_size_bytes_bucket{route="/a",le="+Inf"} 2' in text
+        assert 'http_response_size_bytes_count{route="/a"} 2' in text
+
+    def test_middleware_uses_route_template(self):
+        """Тест 2: Метрики запроса группируются по шаблону маршрута"""
+        registry = make_registry()
+        app = make_app(registry)
+        client = TestClient(MetricsMiddleware(app, registry))
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/items/oops")
+        text = registry.render()
+        assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in text
+        assert 'http_request_errors_total{method="GET",route="/items/{item_id}",status="422"} 1' in text
+        assert 'stage_duration_seconds_count{stage="lookup"} 2' in text
+        assert 'http_requests_in_flight 0' in text
+
+    def test_collector(self):
+        """Тест 3: Внешние показатели читаются в момент выгрузки"""
+        registry = make_registry()
+        registry.collector(lambda: {"cache_hits": 7})
+        assert "cache_hits 7" in registry.render()
+
+
+class TestProfiling:
+    """Тесты профилирования медленных запросов"""
+
+    def test_profile_written_for_slow_request(self, tmp_path):
+        """Тест 4: Для медленного запроса с заголовком сохраняется профиль"""
+        app = ProfilingMiddleware(make_app(make_registry()), tmp_path, enabled=True, slow_threshold=0.01)
+        response = TestClient(app).get("/slow", headers={"X-Profile": "1"})
+        profile = tmp_path / response.headers["x-profile-file"]
+        lines = profile.read_text().splitlines()
+        assert lines
+        assert any("slow (test_metrics.py" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_profile_skipped_without_header(self, tmp_path):
+        """Тест 5: Без заголовка или для быстрых запросов профиль не пишется"""
+        app = ProfilingMiddleware(make_app(make_registry()), tmp_path, enabled=True, slow_threshold=1)
+        client = TestClient(app)
+        client.get("/slow")
+        client.get("/items/1", headers={"X-Profile": "1"})
+        assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import os
+from io import BytesIO
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import photos
+from photos import PhotoCollector, UploadLimiter, UploadSizeLimit, UploadsSaturated, UploadTooLarge, save_upload
+
+
+class TestSaveUpload:
+    """Тесты потоковой записи загружаемых файлов"""
+
+    def test_save_upload_writes_file(self, tmp_path):
+        """Тест 1: Файл записывается целиком под хешем содержимого"""
+        content = b"x" * (photos.CHUNK_SIZE * 3 + 7)
+        upload = UploadFile(BytesIO(content), filename="photo.png")
+        path = asyncio.run(save_upload(upload, tmp_path, ".PNG", len(content)))
+        assert path == tmp_path / f"{hashlib.sha256(content).hexdigest()}.png"
+        assert path.read_bytes() == content
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_save_upload_too_large(self, tmp_path):
+        """Тест 2: Превышение лимита прерывает загрузку без остатков на диске"""
+        upload = UploadFile(BytesIO(b"x" * (photos.CHUNK_SIZE * 2)), filename="photo.png")
+        with pytest.raises(UploadTooLarge):
+            asyncio.run(save_upload(upload, tmp_path, ".png", photos.CHUNK_SIZE))
+        assert list(tmp_path.iterdir()) == []
+
+    def test_save_upload_stops_reading_after_limit(self, tmp_path):
+        """Тест 3: После превышения лимита файл дальше не читается"""
+        upload = UploadFile(BytesIO(b"x" * (photos.CHUNK_SIZE * 10)), filename="photo.png")
+        with pytest.raises(UploadTooLarge):
+            asyncio.run(save_upload(upload, tmp_path, ".png", photos.CHUNK_SIZE))
+        assert upload.file.tell() == photos.CHUNK_SIZE * 2
+
+    def test_save_upload_deduplicates(self, tmp_path):
+        """Тест 4: Одинаковое содержимое хранится в одном файле"""
+        first = asyncio.run(save_upload(UploadFile(BytesIO(b"same"), filename="a.jpeg"), tmp_path, ".jpeg", 100))
+        second = asyncio.run(save_upload(UploadFile(BytesIO(b"same"), filename="b.jpg"), tmp_path, ".jpg", 100))
+        assert first == second
+        assert list(tmp_path.iterdir()) == [first]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPhotoCollector:
+    """Тесты сборки мусора для файлов фотографий"""
+
+    def test_collect_after_grace_period(self, tmp_path):
+        """Тест 5: Файл без ссылок удаляется только после периода ожидания"""
+        refs = {}
+        clock = FakeClock()
+        collector = PhotoCollector(tmp_path, lambda path: refs.get(path, 0), grace_period=10, clock=clock)
+        orphan = tmp_path / "orphan.png"
+        used = tmp_path / "used.png"
+        orphan.write_bytes(b"o")
+        used.write_bytes(b"u")
+        refs[used] = 1
+        collector.track(orphan)
+        collector.track(used)
+        assert collector.collect() == []
+        clock.now += 10
+        assert collector.collect() == [orphan]
+        assert not orphan.exists()
+        assert used.exists()
+
+    def test_sweep_removes_untracked_orphans(self, tmp_path):
+        """Тест 6: Полный обход удаляет старые файлы без ссылок и брошенные загрузки"""
+        refs = {}
+        collector = PhotoCollector(tmp_path, lambda path: refs.get(path, 0), grace_period=10)
+        old, partial, used, fresh = (tmp_path / name for name in ("old.png", "x.part", "used.png", "fresh.png"))
+        for path in (old, partial, used, fresh):
+            path.write_bytes(b"x")
+        for path in (old, partial, used):
+            os.utime(path, (0, 0))
+        refs[used] = 1
+        assert sorted(collector.sweep()) == sorted([old, partial])
+        assert used.exists()
+        assert fresh.exists()
+
+    def test_on_remove_callback(self, tmp_path):
+        """Тест 7: Для каждого удаленного файла вызывается on_remove"""
+        removed = []
+        clock = FakeClock()
+        collector = PhotoCollector(tmp_path, lambda path: 0, grace_period=0, clock=clock,
+                                   on_remove=removed.append)
+        orphan = tmp_path / "orphan.png"
+        orphan.write_bytes(b"o")
+        collector.track(orphan)
+        collector.track(tmp_path / "missing.png")
+        assert collector.collect() == [orphan]
+        assert removed == [orphan]
+
+    def test_pinned_upload_survives_collect(self, tmp_path):
+        """Тест 10: Повторная загрузка того же файла защищает его от сборки, пока питомец не сослался на него"""
+        refs = {}
+        clock = FakeClock()
+        collector = PhotoCollector(tmp_path, lambda path: refs.get(path, 0), grace_period=10, clock=clock)
+
+        def upload():
+            return asyncio.run(save_upload(UploadFile(BytesIO(b"same"), filename="a.png"), tmp_path, ".png", 100,
+                                           collector=collector))
+
+        path = upload()
+        collector.unpin(path)
+        clock.now += 10
+        assert upload() == path
+        assert collector.collect() == []
+        os.utime(path, (0, 0))
+        assert collector.sweep() == []
+        assert path.exists()
+
+        refs[path] = 1
+        collector.unpin(path)
+        clock.now += 10
+        assert collector.collect() == []
+        refs[path] = 0
+        collector.track(path)
+        clock.now += 10
+        assert collector.collect() == [path]
+
+
+class TestUploadLimiter:
+    """Тесты ограничения одновременных загрузок"""
+
+    def test_slots_per_user_and_global(self):
+        """Тест 8: Лимиты на пользователя и общий, слоты освобождаются после загрузки"""
+        limiter = UploadLimiter(max_uploads=2, max_per_user=1)
+        with limiter.slot("alice"):
+            with pytest.raises(UploadsSaturated) as error:
+                with limiter.slot("alice"):
+                    pass
+            assert error.value.per_user
+            with limiter.slot("bob"):
+                with pytest.raises(UploadsSaturated) as error:
+                    with limiter.slot("carol"):
+                        pass
+                assert not error.value.per_user
+        assert limiter.active == 0
+        with limiter.slot("alice"):
+            assert limiter.active == 1
+
+
+class ReadingApp:
+    """Reads the whole request body and answers 200."""
+
+    def __init__(self):
+        self.received = 0
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            self.received += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def upload_request(middleware, chunks, content_length=None):
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": "/upload", "headers": headers}
+    pending = list(chunks)
+    messages = []
+
+    async def receive():
+        body = pending.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(pending)}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+class TestUploadSizeLimit:
+    """Тесты отказа в слишком больших загрузках до разбора формы"""
+
+    def test_rejects_before_reading_body(self):
+        """Тест 9: Большой Content-Length отклоняется сразу, тело без длины обрывается на лимите"""
+        chunk = b"x" * photos.FORM_OVERHEAD
+        app = ReadingApp()
+        middleware = UploadSizeLimit(app, limit=lambda scope: 1024 * 1024)
+        status, body = upload_request(middleware, [chunk] * 100, content_length=len(chunk) * 100)
+        assert status == 400
+        assert b"Maximum size is 1MB" in body
+        assert app.received == 0
+
+        with pytest.raises(HTTPException) as error:
+            upload_request(middleware, [chunk] * 100)
+        assert error.value.status_code == 400
+        assert app.received == 1024 * 1024 + photos.FORM_OVERHEAD
+
+        assert upload_request(middleware, [chunk] * 4, content_length=len(chunk) * 4)[0] == 200
+        assert upload_request(UploadSizeLimit(app, limit=lambda scope: None), [chunk] * 100)[0] == 200
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdmissionControl, Overloaded, RateLimit, TokenBuckets
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBuckets:
+    """Тесты ограничения частоты запросов корзинами токенов"""
+
+    def test_burst_then_refill(self):
+        """Тест 1: После исчерпания запаса запросы ждут пополнения корзины"""
+        clock = FakeClock()
+        buckets = TokenBuckets(rate=2, burst=3, clock=clock)
+        assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+        assert buckets.take("a") == pytest.approx(0.5)
+        assert buckets.take("b") == 0
+        clock.now = 0.5
+        assert buckets.take("a") == 0
+        assert buckets.take("a") == pytest.approx(0.5)
+
+    def test_idle_buckets_evicted(self):
+        """Тест 2: Полные и лишние корзины удаляются, память ограничена"""
+        clock = FakeClock()
+        buckets = TokenBuckets(rate=1, burst=2, maxsize=3, clock=clock)
+        for key in "abcde":
+            buckets.take(key)
+        assert len(buckets) == 3
+        clock.now = 1
+        buckets.take("c")
+        clock.now = 2.5
+        buckets.take("f")
+        assert len(buckets) == 2
+
+    def test_rate_limit_per_client(self):
+        """Тест 3: Лимит по адресу действует и на запросы с разными ключами"""
+        clock = FakeClock()
+        limit = RateLimit(
+            per_key=TokenBuckets(rate=1, burst=5, clock=clock),
+            per_client=TokenBuckets(rate=1, burst=2, clock=clock)
+        )
+        assert limit.check("key1", "10.0.0.1") == 0
+        assert limit.check("key2", "10.0.0.1") == 0
+        assert limit.check("key3", "10.0.0.1") > 0
+        assert limit.check(None, "10.0.0.2") == 0
+
+
+class TestAdmissionControl:
+    """Тесты ограничения числа одновременно обслуживаемых запросов"""
+
+    def test_queue_and_shed(self):
+        """Тест 4: Лишние запросы ждут в очереди, при ее переполнении отклоняются"""
+        admission = AdmissionControl(max_active=1, max_queued=1, queue_timeout=5)
+
+        async def run():
+            order = []
+            release = asyncio.Event()
+
+            async def request(name):
+                async with admission.admit():
+                    order.append(name)
+                    await release.wait()
+
+            first = asyncio.create_task(request("first"))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(request("second"))
+            await asyncio.sleep(0)
+            assert (admission.active, admission.queued) == (1, 1)
+            with pytest.raises(Overloaded):
+                await request("third")
+            release.set()
+            await asyncio.gather(first, second)
+            return order
+
+        assert asyncio.run(run()) == ["first", "second"]
+        assert (admission.active, admission.queued) == (0, 0)
+
+    def test_queue_timeout(self):
+        """Тест 5: Запрос, не дождавшийся места, отклоняется и покидает очередь"""
+        admission = AdmissionControl(max_active=1, max_queued=4, queue_timeout=0.05)
+
+        async def run():
+            async with admission.admit():
+                with pytest.raises(Overloaded):
+                    async with admission.admit():
+                        pass
+                assert admission.queued == 0
+
+        asyncio.run(run())
+        assert admission.active == 0
@@ -0,0 +1,31 @@
+import json
+
+import responses
+from responses import FastJSONResponse, dumps
+
+PET = {
+    "pet_id": "7c9e6679-7425-40de-944b-e07fc1f90ae7",
+    "user_id": "key",
+    "animal_type": "cat",
+    "name": "Мурка",
+    "age": 3,
+    "pet_photo": None,
+    "created_at": "2024-01-01T00:00:00.123456",
+    "updated_at": "2024-01-01T00:00:00.123456"
+}
+
+
+class TestFastJSONResponse:
+    """Тесты быстрой сериализации JSON"""
+
+    def test_matches_stdlib(self):
+        """Тест 1: Результат совпадает с json и не экранирует юникод"""
+        body = FastJSONResponse([PET, {"results": [PET]}]).body
+        assert json.loads(body) == [PET, {"results": [PET]}]
+        assert "Мурка".encode() in body
+
+    def test_fallback_without_orjson(self, monkeypatch):
+        """Тест 2: Без orjson используется стандартный json с тем же результатом"""
+        fast = dumps([PET])
+        monkeypatch.setattr(responses, "orjson", None)
+        assert dumps([PET]) == fast
@@ -0,0 +1,381 @@
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+import pytest
+
+from changes import ChangesExpired
+from sqlite_storage import SQLiteStorage
+from storage import MemoryStorage
+from wal_storage import WALStorage
+
+
+def make_pet(user_id, name, animal_type="dog", age=1, created_at="2024-01-01T00:00:00"):
+    return {
+        "pet_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "animal_type": animal_type,
+        "name": name,
+        "age": age,
+        "pet_photo": None,
+        "created_at": created_at,
+        "updated_at": created_at
+    }
+
+
+@pytest.fixture(params=["memory", "sqlite", "wal"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteStorage(str(tmp_path / "pets.db"), pool_size=2)
+    elif request.param == "wal":
+        backend = WALStorage(tmp_path / "data")
+    else:
+        backend = MemoryStorage()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def store(storage):
+    return storage.pets
+
+
+class TestPetStore:
+    """Тесты хранилища питомцев (в памяти, SQLite и с журналом)"""
+
+    def test_add_and_get(self, store):
+        """Тест 1: Питомец доступен по pet_id и в списке владельца"""
+        pet = store.add(make_pet("u1", "Rex"))
+        assert store.get(pet["pet_id"]) == pet
+        assert store.for_user("u1") == [pet]
+        assert store.for_user("u2") == []
+        assert len(store) == 1
+
+    def test_remove_updates_indexes(self, store):
+        """Тест 2: Удаление очищает все индексы"""
+        pet = store.add(make_pet("u1", "Rex"))
+        store.remove(pet["pet_id"])
+        assert store.get(pet["pet_id"]) is None
+        assert store.count_for_user("u1") == 0
+        assert not store.has_name("u1", "rex")
+
+    def test_has_name_is_case_insensitive(self, store):
+        """Тест 3: Проверка дубликата имени без учета регистра"""
+        store.add(make_pet("u1", "Rex"))
+        assert store.has_name("u1", "REX")
+        assert not store.has_name("u2", "Rex")
+
+    def test_duplicate_names_counted(self, store):
+        """Тест 4: Удаление одного из одноименных питомцев не снимает имя"""
+        first = store.add(make_pet("u1", "Rex"))
+        store.add(make_pet("u1", "rex"))
+        store.remove(first["pet_id"])
+        assert store.has_name("u1", "Rex")
+        assert store.count_for_user("u1") == 1
+
+    def test_update_renames_in_index(self, store):
+        """Тест 5: Переименование обновляет индекс имен"""
+        pet = store.add(make_pet("u1", "Rex"))
+        store.update(pet, name="Max", age=4)
+        assert pet["name"] == "Max"
+        assert pet["age"] == 4
+        assert store.has_name("u1", "max")
+        assert not store.has_name("u1", "rex")
+
+    def test_page_ordered_by_created_at(self, store):
+        """Тест 6: Страницы упорядочены по created_at и продолжаются по курсору"""
+        late = store.add(make_pet("u1", "Late", created_at="2024-01-03T00:00:00"))
+        early = store.add(make_pet("u1", "Early", created_at="2024-01-01T00:00:00"))
+        other = store.add(make_pet("u2", "Other", created_at="2024-01-02T00:00:00"))
+        items, next_key = store.page(limit=2)
+        assert items == [early, other]
+        items, next_key = store.page(after=next_key, limit=2)
+        assert items == [late]
+        assert next_key is None
+        assert store.page(user_id="u1")[0] == [early, late]
+
+    def test_page_with_match(self, store):
+        """Тест 7: Фильтры применяются до ограничения размера страницы"""
+        for age in range(5):
+            store.add(make_pet("u1", f"Pet{age}", age=age, created_at=f"2024-01-0{age + 1}T00:00:00"))
+        items, _ = store.page(limit=2, min_age=2, name_prefix="pet")
+        assert [pet["age"] for pet in items] == [2, 3]
+
+    def test_photo_path(self, store):
+        """Тест 8: Путь к фото хранится отдельно от записи и удаляется вместе с ней"""
+        pet = store.add(make_pet("u1", "Rex"))
+        assert store.photo_path(pet["pet_id"]) is None
+        store.set_photo_path(pet["pet_id"], Path("uploads/rex.png"))
+        assert store.photo_path(pet["pet_id"]) == Path("uploads/rex.png")
+        assert "photo_path" not in store.get(pet["pet_id"])
+        store.remove(pet["pet_id"])
+        assert store.photo_path(pet["pet_id"]) is None
+
+    def test_photo_refcount(self, store):
+        """Тест 12: Счетчик ссылок на общий файл фотографии"""
+        path = Path("uploads/shared.png")
+        first = store.add(make_pet("u1", "Rex"))
+        second = store.add(make_pet("u1", "Max"))
+        store.set_photo_path(first["pet_id"], path)
+        store.set_photo_path(second["pet_id"], path)
+        assert store.photo_refcount(path) == 2
+        store.set_photo_path(first["pet_id"], Path("uploads/other.png"))
+        assert store.photo_refcount(path) == 1
+        store.remove(second["pet_id"])
+        assert store.photo_refcount(path) == 0
+
+    def test_records_round_trip(self, store):
+        """Тест 13: Запись возвращается в исходном виде, изменения видны при повторном чтении"""
+        pet = store.add(make_pet("u1", "Rex", created_at="2024-05-06T07:08:09.123456"))
+        pet["updated_at"] = "2024-05-07T00:00:00"
+        store.update(pet, updated_at=pet["updated_at"], animal_type="cat", pet_photo="/photo")
+        assert store.get(pet["pet_id"]) == pet
+        assert list(store.get(pet["pet_id"])) == list(make_pet("u1", "Rex"))
+        assert list(store) == [pet]
+
+    def test_unknown_ids_and_fields(self, store):
+        """Тест 14: Неизвестный pet_id не найден, неизвестное поле не обновляется"""
+        pet = store.add(make_pet("u1", "Rex"))
+        assert store.get("not-a-uuid") is None
+        assert store.get(str(uuid.uuid4())) is None
+        assert "not-a-uuid" not in store
+        with pytest.raises(ValueError):
+            store.update(pet, user_id="u2")
+
+    def test_search_indexes(self, store):
+        """Тест 21: Поиск по подстроке, префиксу, типу и возрасту следует за изменениями"""
+        names = ["Snowball", "Ball", "Bobby", "Eyeball", "Snowy", "Balloon"]
+        pets = [
+            store.add(make_pet("u1" if i < 5 else "u2", name, "cat" if i % 2 else "dog", age=i,
+                               created_at=f"2024-01-0{i + 1}T00:00:00"))
+            for i, name in enumerate(names)
+        ]
+
+        def found(**filters):
+            return [pet["name"] for pet in store.search(**filters)[0]]
+
+        assert found(text="BALL") == ["Snowball", "Ball", "Eyeball", "Balloon"]
+        assert found(user_id="u1", text="ball") == ["Snowball", "Ball", "Eyeball"]
+        assert found(name_prefix="bal") == ["Ball", "Balloon"]
+        assert found(animal_type="cat", min_age=2) == ["Eyeball", "Balloon"]
+        assert found(text="all", max_age=1) == ["Snowball", "Ball"]
+        assert found(text="qqq") == []
+
+        items, next_key = store.search(text="ball", limit=2)
+        assert [pet["name"] for pet in items] == ["Snowball", "Ball"]
+        assert found(text="ball", after=next_key) == ["Eyeball", "Balloon"]
+        assert store.search(text="ball", after=next_key)[1] is None
+
+        store.update(pets[1], name="Rex", age=40, animal_type="bird")
+        store.remove(pets[3]["pet_id"])
+        assert found(text="ball") == ["Snowball", "Balloon"]
+        assert found(animal_type="bird", min_age=40) == ["Rex"]
+        assert found(animal_type="cat") == ["Balloon"]
+
+        top = chr(0x10FFFF)
+        store.add(make_pet("u3", f"Ab{top}c"))
+        assert found(name_prefix=f"ab{top}") == [f"Ab{top}c"]
+        assert found(name_prefix=top) == []
+        assert found(name_prefix="\ud7ff") == []
+
+    def test_search_during_writes(self, store):
+        """Тест 22: Поиск и страницы при одновременных добавлениях и удалениях не падают"""
+        pets = [store.add(make_pet("u1", f"Ball{i}", age=i % 9)) for i in range(300)]
+        errors = []
+
+        def write(part):
+            try:
+                for pet in part:
+                    store.remove(pet["pet_id"])
+                    store.add(make_pet("u1", pet["name"], age=pet["age"]))
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(30):
+                    store.search(text="all", limit=20)
+                    store.search(user_id="u1", min_age=3, name_prefix="ball", limit=20)
+                    store.page(user_id="u1", limit=20)
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=write, args=(pets[i::4],)) for i in range(4)]
+            threads += [threading.Thread(target=read) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert errors == []
+        assert len(store.search(text="ball", limit=1000)[0]) == 300
+
+    def test_update_many_is_all_or_nothing(self, store):
+        """Тест 23: Пакетное обновление применяется целиком или не применяется вовсе"""
+        first, second = store.add(make_pet("u1", "Rex")), store.add(make_pet("u1", "Max"))
+        ghost = make_pet("u1", "Ghost")
+        for update, error in (((ghost, {"age": 7}), KeyError), ((dict(second), {"user_id": "u2"}), ValueError)):
+            with pytest.raises(error):
+                store.update_many([(dict(first), {"age": 7}), update])
+            assert store.get(first["pet_id"])["age"] == 1
+
+        updated = store.update_many([(first, {"age": 7}), (second, {"name": "Buddy"})])
+        assert updated == [first, second]
+        assert [store.get(pet["pet_id"]) for pet in updated] == updated
+        assert store.has_name("u1", "buddy") and not store.has_name("u1", "max")
+
+
+class TestUserStore:
+    """Тесты хранилища пользователей (в памяти, SQLite и с журналом)"""
+
+    def test_add_and_lookup(self, storage):
+        """Тест 9: Пользователь находится по ключу и по имени"""
+        storage.users.add("key1", username="alice", password_hash="hash")
+        assert "key1" in storage.users
+        assert storage.users.key_for("alice") == "key1"
+        assert storage.users.get("key1")["password_hash"] == "hash"
+        assert storage.users.key_for("bob") is None
+
+    def test_duplicate_username(self, storage):
+        """Тест 10: Повторная регистрация имени отклоняется"""
+        storage.users.add("key1", username="alice", password_hash="hash")
+        with pytest.raises(ValueError):
+            storage.users.add("key2", username="alice", password_hash="hash")
+
+
+def test_sqlite_persists_between_connections(tmp_path):
+    """Тест 11: Данные SQLite переживают переоткрытие базы"""
+    path = str(tmp_path / "pets.db")
+    first = SQLiteStorage(path, pool_size=1)
+    pet = first.pets.add(make_pet("u1", "Rex"))
+    first.close()
+    second = SQLiteStorage(path, pool_size=1)
+    assert second.pets.get(pet["pet_id"]) == pet
+    assert second.pets.has_name("u1", "REX")
+    second.close()
+
+
+def test_sqlite_versions_shared(tmp_path):
+    """Тест 18: Версии данных общие для процессов с одной базой SQLite"""
+    path = str(tmp_path / "pets.db")
+    first, second = SQLiteStorage(path, pool_size=2), SQLiteStorage(path, pool_size=2)
+    assert first.versions.epoch == second.versions.epoch
+    first.versions.bump("u1")
+    assert second.versions.get("u1") == second.versions.get() == 1
+    second.versions.bump("u2")
+    assert first.versions.get("u1") == 1
+    assert first.versions.get("u2") == first.versions.get() == 2
+    first.close()
+    second.close()
+
+
+def test_sqlite_invalidations_broadcast(tmp_path):
+    """Тест 19: Инвалидация доставляется другим процессам с той же базой"""
+    path = str(tmp_path / "pets.db")
+    first, second = SQLiteStorage(path, pool_size=2), SQLiteStorage(path, pool_size=2)
+    received_first, received_second = [], []
+    first.invalidations.subscribe("auth_key", received_first.append)
+    second.invalidations.subscribe("auth_key", received_second.append)
+    first.invalidations.publish("auth_key", "key1")
+    assert received_first == ["key1"]
+    second.invalidations.poll()
+    first.invalidations.poll()
+    assert received_second == ["key1"]
+    assert received_first == ["key1"]
+    first.close()
+    second.close()
+
+
+def test_sqlite_changes_shared(tmp_path):
+    """Тест 20: Журнал изменений в SQLite общий для процессов и ограничен по размеру"""
+    path = str(tmp_path / "pets.db")
+    first, second = SQLiteStorage(path, pool_size=2), SQLiteStorage(path, pool_size=2)
+    first.changes.capacity = 3
+    rex = make_pet("u1", "Rex")
+    first.changes.record("created", [rex, make_pet("u2", "Max")])
+    changes, last = second.changes.since(0)
+    assert last == 2
+    assert [(item["type"], item["pet"]["name"]) for item in changes] == [("created", "Rex"), ("created", "Max")]
+    assert [item["seq"] for item in second.changes.since(0, user_id="u2")[0]] == [2]
+
+    first.changes.record("deleted", [rex, rex])
+    with pytest.raises(ChangesExpired):
+        second.changes.since(0)
+    assert [item["pet"] for item in second.changes.since(2)[0]] == [None, None]
+    with pytest.raises(ChangesExpired):
+        second.changes.since(5)
+    first.close()
+    second.close()
+
+
+class TestWALStorage:
+    """Тесты восстановления хранилища из журнала и снимков"""
+
+    def test_replays_log(self, tmp_path):
+        """Тест 15: После перезапуска изменения восстанавливаются из журнала"""
+        first = WALStorage(tmp_path)
+        first.users.add("key1", username="alice", password_hash="hash")
+        rex, max_ = first.pets.add_many([make_pet("key1", "Rex"), make_pet("key1", "Max")])
+        first.pets.update(rex, name="Rexy", age=5)
+        first.pets.set_photo_path(rex["pet_id"], Path("uploads/rex.png"))
+        first.pets.remove(max_["pet_id"])
+        first.close()
+
+        second = WALStorage(tmp_path)
+        assert second.users.key_for("alice") == "key1"
+        assert list(second.pets) == [rex]
+        assert second.pets.has_name("key1", "rexy")
+        assert second.pets.photo_refcount(Path("uploads/rex.png")) == 1
+        second.close()
+
+    def test_batch_update_is_one_record(self, tmp_path):
+        """Тест 24: Пакетное обновление пишется в журнал одной записью и восстанавливается"""
+        first = WALStorage(tmp_path)
+        pets = first.pets.add_many([make_pet("u1", f"Pet{i}") for i in range(50)])
+        commits = first.log.commits
+        first.pets.update_many([(pet, {"age": 7, "name": pet["name"] + "!"}) for pet in pets])
+        assert first.log.commits == commits + 1
+        first.close()
+
+        second = WALStorage(tmp_path)
+        assert list(second.pets) == pets
+        assert second.pets.has_name("u1", "pet0!")
+        second.close()
+
+    def test_snapshot_and_tail(self, tmp_path):
+        """Тест 16: Снимок заменяет старый журнал, хвост журнала применяется поверх"""
+        first = WALStorage(tmp_path)
+        pets = [first.pets.add(make_pet("u1", f"Pet{i}", created_at=f"2024-01-0{i + 1}T00:00:00"))
+                for i in range(3)]
+        first.snapshot()
+        first.pets.remove(pets[0]["pet_id"])
+        first.pets.add(make_pet("u2", "Late", created_at="2024-02-01T00:00:00"))
+        first.close()
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["snapshot.1.pickle", "wal.1.log"]
+
+        second = WALStorage(tmp_path)
+        assert [pet["name"] for pet in second.pets] == ["Pet1", "Pet2", "Late"]
+        assert [pet["name"] for pet in second.pets.page()[0]] == ["Pet1", "Pet2", "Late"]
+        assert second.pets.count_for_user("u1") == 2
+        second.close()
+
+    def test_torn_tail_is_dropped(self, tmp_path):
+        """Тест 17: Недописанная последняя запись отбрасывается при восстановлении"""
+        first = WALStorage(tmp_path)
+        pet = first.pets.add(make_pet("u1", "Rex"))
+        first.close()
+        with open(tmp_path / "wal.0.log", "ab") as log:
+            log.write(b'0badc0de {"op":"add_pets","pe')
+
+        second = WALStorage(tmp_path)
+        assert list(second.pets) == [pet]
+        second.pets.add(make_pet("u1", "Max"))
+        second.close()
+        third = WALStorage(tmp_path)
+        assert len(third.pets) == 2
+        third.close()
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import thumbnails
+from thumbnails import ThumbnailPipeline, find_variant, remove_variants, variant_dir
+
+
+class TestVariantFiles:
+    """Тесты поиска и удаления уменьшенных копий фотографий"""
+
+    def test_find_variant_prefers_webp(self, tmp_path):
+        """Тест 1: Поиск варианта по размеру, WebP в приоритете"""
+        original = tmp_path / "abc.png"
+        original.write_bytes(b"o")
+        assert find_variant(original, "thumb") is None
+        variant_dir(original).mkdir()
+        png = variant_dir(original) / "abc_thumb.png"
+        png.write_bytes(b"p")
+        assert find_variant(original, "thumb") == png
+        webp = variant_dir(original) / "abc_thumb.webp"
+        webp.write_bytes(b"w")
+        assert find_variant(original, "thumb") == webp
+
+    def test_remove_variants(self, tmp_path):
+        """Тест 2: Удаление всех вариантов вместе с оригиналом"""
+        original = tmp_path / "abc.png"
+        variant_dir(original).mkdir()
+        for name in ("abc_thumb.png", "abc_medium.webp", "other_thumb.png"):
+            (variant_dir(original) / name).write_bytes(b"x")
+        remove_variants(original)
+        assert [path.name for path in variant_dir(original).iterdir()] == ["other_thumb.png"]
+
+    def test_pipeline_disabled_without_pillow(self, tmp_path, monkeypatch):
+        """Тест 3: Без Pillow конвейер ничего не запускает"""
+        monkeypatch.setattr(thumbnails, "Image", None)
+        pipeline = ThumbnailPipeline()
+        assert not pipeline.available
+        assert pipeline.submit(tmp_path / "abc.png") is None
+
+
+class TestGenerateVariants:
+    """Тесты генерации уменьшенных копий в пуле процессов"""
+
+    def test_generate_variants(self, tmp_path):
+        """Тест 4: Варианты создаются в фоне и не превышают заданный размер"""
+        image_module = pytest.importorskip("PIL.Image")
+        original = tmp_path / "abc.png"
+        image_module.new("RGB", (1024, 768), "red").save(original)
+
+        async def run():
+            pipeline = ThumbnailPipeline(max_workers=1)
+            try:
+                return await pipeline.submit(original)
+            finally:
+                pipeline.shutdown()
+
+        written = asyncio.run(run())
+        assert len(written) == len(thumbnails.VARIANT_SIZES)
+        for size, edge in thumbnails.VARIANT_SIZES.items():
+            with image_module.open(find_variant(original, size)) as variant:
+                assert max(variant.size) == edge
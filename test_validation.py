@@ -0,0 +1,49 @@
+import pytest
+from fastapi import HTTPException
+
+from validation import PetValidator
+
+validator = PetValidator()
+
+ANIMAL_TYPE_ERROR = "Invalid animal type. Allowed types: dog, cat, bird, fish, rabbit, hamster, turtle, parrot, other"
+
+
+def error(call, *args) -> str:
+    with pytest.raises(HTTPException) as raised:
+        call(*args)
+    assert raised.value.status_code == 400
+    return raised.value.detail
+
+
+class TestPetValidator:
+    """Тесты общей проверки полей питомца"""
+
+    def test_normalizes_once(self):
+        """Тест 1: Поля очищаются от пробелов, тип животного приводится к нижнему регистру"""
+        assert validator.simple(" Dog ", "  Rex ", 0) == {"animal_type": "dog", "name": "Rex", "age": 0}
+        assert validator.form("CAT", "Tom", 100) == {"animal_type": "cat", "name": "Tom", "age": 100}
+        assert validator.changes(name=" Max ", animal_type="Bird") == {"name": "Max", "animal_type": "bird"}
+        assert validator.changes() == {}
+
+    def test_error_messages(self):
+        """Тест 2: Сообщения об ошибках и их порядок совпадают с прежними проверками"""
+        cases = [
+            (validator.simple, ("dog", "Buddy", -5), "Age cannot be negative"),
+            (validator.simple, ("dog", "Oldie", 1000), "Age is unrealistic for a pet"),
+            (validator.simple, ("bird", "", 2), "Missing required fields: animal_type and name are required"),
+            (validator.simple, ("", "Rex", 2), "Missing required fields: animal_type and name are required"),
+            (validator.simple, ("rabbit", "A" * 1000, 1), "Name cannot exceed 50 characters"),
+            (validator.simple, ("dragon", "Rex", 1), ANIMAL_TYPE_ERROR),
+            (validator.simple, ("dog", "  ", 1), "Name must be at least 2 characters long"),
+            (validator.simple, ("dragon", "R", -1), "Age cannot be negative"),
+            (validator.simple, ("dragon", "R", 1), ANIMAL_TYPE_ERROR),
+            (validator.form, ("  ", "Rex", 1), "Animal type is required"),
+            (validator.form, ("dog", "  ", 1), "Name is required"),
+            (validator.form, ("dog", "R", 1), "Name must be at least 2 characters long"),
+            (validator.form, ("dog", "A" * 51, 101), "Age is unrealistic for a pet"),
+            (validator.changes, ("R", -1, "dragon"), "Name must be at least 2 characters long"),
+            (validator.changes, (None, -1, "dragon"), "Age cannot be negative"),
+            (validator.changes, (None, None, "dragon"), ANIMAL_TYPE_ERROR),
+        ]
+        for call, args, detail in cases:
+            assert error(call, *args) == detail, args
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {"thumb": 128, "medium": 512}
+VARIANT_DIR_NAME = "variants"
+
+
+def variant_dir(original: Path) -> Path:
+    return original.parent / VARIANT_DIR_NAME
+
+
+def variant_candidates(original: Path, size: str) -> List[Path]:
+    directory = variant_dir(original)
+    return [
+        directory / f"{original.stem}_{size}.webp",
+        directory / f"{original.stem}_{size}{original.suffix}",
+    ]
+
+
+def find_variant(original: Path, size: str) -> Optional[Path]:
+    for candidate in variant_candidates(original, size):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def remove_variants(original: Path):
+    for size in VARIANT_SIZES:
+        for candidate in variant_candidates(original, size):
+            try:
+                candidate.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def generate_variants(original: str, webp: bool = False) -> List[str]:
+    """Write every size in ``VARIANT_SIZES`` next to ``original``. Runs in a worker process."""
+    source = Path(original)
+    directory = variant_dir(source)
+    directory.mkdir(exist_ok=True)
+    written = []
+    with Image.open(source) as image:
+        image.load()
+        image_format = "WEBP" if webp else image.format
+        suffix = ".webp" if webp else source.suffix
+        for size, edge in VARIANT_SIZES.items():
+            variant = image.copy()
+            variant.thumbnail((edge, edge))
+            if image_format == "JPEG" and variant.mode not in ("RGB", "L"):
+                variant = variant.convert("RGB")
+            target = directory / f"{source.stem}_{size}{suffix}"
+            partial = target.with_name(target.name + ".part")
+            variant.save(partial, format=image_format)
+            os.replace(partial, target)
+            written.append(str(target))
+    return written
+
+
+class ThumbnailPipeline:
+    """Generates resized photo variants in a process pool after uploads.
+
+    Without Pillow installed the pipeline is disabled and photo requests
+    fall back to the original file.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, webp: bool = False):
+        self.max_workers = max_workers
+        self.webp = webp
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[Path, asyncio.Future] = {}
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def submit(self, original: Path) -> Optional[asyncio.Future]:
+        if not self.available:
+            return None
+        if original in self._pending:
+            return self._pending[original]
+        if all(find_variant(original, size) for size in VARIANT_SIZES):
+            return None
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, generate_variants, str(original), self.webp
+        )
+        self._pending[original] = future
+        future.add_done_callback(lambda done: self._finished(original, done))
+        return future
+
+    def _finished(self, original: Path, future: asyncio.Future):
+        self._pending.pop(original, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Could not create variants of %s: %s", original, future.exception())
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
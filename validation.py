@@ -0,0 +1,89 @@
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, status
+
+ANIMAL_TYPES = ("dog", "cat", "bird", "fish", "rabbit", "hamster", "turtle", "parrot", "other")
+
+
+class PetValidator:
+    """Checks and normalizes the pet fields of every write endpoint.
+
+    The allowed values and error messages are built once. Every field is
+    stripped once, animal types are lowercased, and the normalized values
+    are what gets stored. ``simple`` and ``form`` only differ in how they
+    report missing fields, as the endpoints they serve always have.
+    """
+
+    def __init__(self, animal_types: Iterable[str] = ANIMAL_TYPES, min_name_length: int = 2,
+                 max_name_length: int = 50, max_age: int = 100):
+        self.animal_types = tuple(animal_types)
+        self.min_name_length = min_name_length
+        self.max_name_length = max_name_length
+        self.max_age = max_age
+        self._allowed = frozenset(self.animal_types)
+        self._invalid_animal_type = f"Invalid animal type. Allowed types: {', '.join(self.animal_types)}"
+        self._name_too_short = f"Name must be at least {min_name_length} characters long"
+        self._name_too_long = f"Name cannot exceed {max_name_length} characters"
+
+    def age(self, age: int) -> int:
+        if age < 0:
+            raise _invalid("Age cannot be negative")
+        if age > self.max_age:
+            raise _invalid("Age is unrealistic for a pet")
+        return age
+
+    def animal_type(self, animal_type: str) -> str:
+        return self._animal_type(animal_type.strip())
+
+    def name(self, name: str) -> str:
+        return self._name(name.strip())
+
+    def simple(self, animal_type: str, name: str, age: int) -> dict:
+        if not animal_type or not name:
+            raise _invalid("Missing required fields: animal_type and name are required")
+        return self._pet(animal_type.strip(), name.strip(), age)
+
+    def form(self, animal_type: str, name: str, age: int) -> dict:
+        animal_type = animal_type.strip()
+        if not animal_type:
+            raise _invalid("Animal type is required")
+        name = name.strip()
+        if not name:
+            raise _invalid("Name is required")
+        return self._pet(animal_type, name, age)
+
+    def changes(self, name: Optional[str] = None, age: Optional[int] = None,
+                animal_type: Optional[str] = None) -> dict:
+        changes = {}
+        if name is not None:
+            changes["name"] = self.name(name)
+        if age is not None:
+            changes["age"] = self.age(age)
+        if animal_type is not None:
+            changes["animal_type"] = self.animal_type(animal_type)
+        return changes
+
+    def _pet(self, animal_type: str, name: str, age: int) -> dict:
+        age = self.age(age)
+        animal_type = self._animal_type(animal_type)
+        return {"animal_type": animal_type, "name": self._name(name), "age": age}
+
+    def _animal_type(self, stripped: str) -> str:
+        animal_type = stripped.lower()
+        if animal_type not in self._allowed:
+            raise _invalid(self._invalid_animal_type)
+        return animal_type
+
+    def _name(self, stripped: str) -> str:
+        if len(stripped) < self.min_name_length:
+            raise _invalid(self._name_too_short)
+        if len(stripped) > self.max_name_length:
+            raise _invalid(self._name_too_long)
+        return stripped
+
+
+def _invalid(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=detail
+    )
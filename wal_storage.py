@@ -0,0 +1,329 @@
+import gc
+import json
+import os
+import pickle
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from storage import PetStore, Storage, UserStore
+
+LOG_PATTERN = re.compile(r"wal\.(\d+)\.log")
+SNAPSHOT_PATTERN = re.compile(r"snapshot\.(\d+)\.pickle")
+SNAPSHOT_VERSION = 1
+
+
+def encode_record(record: dict) -> bytes:
+    payload = json.dumps(record, separators=(",", ":")).encode()
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+
+def read_log(path: Path) -> Tuple[List[dict], int]:
+    """Return the records of a log file and the length of its intact prefix.
+
+    Reading stops at the first line that is incomplete or fails its checksum,
+    which is where a crash interrupted the last write.
+    """
+    records = []
+    valid = 0
+    with open(path, "rb") as log:
+        for line in log:
+            if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" ":
+                break
+            payload = line[9:-1]
+            try:
+                if int(line[:8], 16) != zlib.crc32(payload):
+                    break
+                records.append(json.loads(payload))
+            except ValueError:
+                break
+            valid += len(line)
+    return records, valid
+
+
+class WriteAheadLog:
+    """Append-only log file with group commit.
+
+    ``append`` queues a record and returns its sequence number and ``wait``
+    blocks until that record has been fsynced. A background thread writes
+    everything queued since its previous round with one write and one
+    fsync, so concurrent writers share the cost of a sync instead of
+    queueing behind each other's.
+    """
+
+    def __init__(self, path: Path, commit_delay: float = 0.0):
+        self.path = path
+        self.commit_delay = commit_delay
+        self.commits = 0
+        self._file = open(path, "ab")
+        self._buffer: List[bytes] = []
+        self._appended = 0
+        self._durable = 0
+        self._error: Optional[OSError] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="wal-commit", daemon=True)
+        self._thread.start()
+
+    def append(self, record: dict) -> int:
+        line = encode_record(record)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Write-ahead log is closed")
+            self._buffer.append(line)
+            self._appended += 1
+            self._condition.notify_all()
+            return self._appended
+
+    def wait(self, sequence: int):
+        with self._condition:
+            while self._durable < sequence:
+                if self._error is not None:
+                    raise self._error
+                self._condition.wait()
+
+    def rotate(self, path: Path):
+        """Make everything appended so far durable and continue in ``path``.
+
+        The caller must keep other threads from appending meanwhile.
+        """
+        with self._condition:
+            sequence = self._appended
+        self.wait(sequence)
+        with self._condition:
+            self._file.close()
+            self._file = open(path, "ab")
+            self.path = path
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._buffer and not self._closed:
+                    self._condition.wait()
+                if not self._buffer:
+                    return
+                if self.commit_delay and not self._closed:
+                    self._condition.wait(self.commit_delay)
+                lines, self._buffer = self._buffer, []
+                sequence = self._appended
+                log = self._file
+            try:
+                log.write(b"".join(lines))
+                log.flush()
+                os.fsync(log.fileno())
+            except OSError as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._durable = sequence
+                self.commits += 1
+                self._condition.notify_all()
+
+
+class WALUserStore(UserStore):
+    def __init__(self, storage: "WALStorage"):
+        super().__init__()
+        self._storage = storage
+
+    def add(self, key: str, username: str, password_hash: str) -> dict:
+        record = {"op": "add_user", "key": key, "username": username, "password_hash": password_hash}
+        with self._storage.logged(record):
+            return super().add(key, username, password_hash)
+
+    def remove(self, key: str) -> dict:
+        with self._storage.logged({"op": "remove_user", "key": key}):
+            return super().remove(key)
+
+
+class WALPetStore(PetStore):
+    def __init__(self, storage: "WALStorage"):
+        super().__init__()
+        self._storage = storage
+
+    def add(self, pet: dict) -> dict:
+        with self._storage.logged({"op": "add_pets", "pets": [pet]}):
+            return super().add(pet)
+
+    def add_many(self, pets: List[dict]) -> List[dict]:
+        with self._storage.logged({"op": "add_pets", "pets": pets}):
+            return [PetStore.add(self, pet) for pet in pets]
+
+    def remove(self, pet_id: str) -> dict:
+        with self._storage.logged({"op": "remove_pets", "pet_ids": [pet_id]}):
+            return super().remove(pet_id)
+
+    def remove_many(self, pet_ids: List[str]) -> List[dict]:
+        with self._storage.logged({"op": "remove_pets", "pet_ids": pet_ids}):
+            return [PetStore.remove(self, pet_id) for pet_id in pet_ids]
+
+    def update(self, pet: dict, **fields) -> dict:
+        with self._storage.logged({"op": "update_pet", "pet_id": pet["pet_id"], "fields": fields}):
+            return super().update(pet, **fields)
+
+    def update_many(self, updates: List[Tuple[dict, dict]]) -> List[dict]:
+        record = {"op": "update_pets", "updates": [[pet["pet_id"], fields] for pet, fields in updates]}
+        with self._storage.logged(record):
+            return PetStore.update_many(self, updates)
+
+    def set_photo_path(self, pet_id: str, path: Path):
+        with self._storage.logged({"op": "set_photo_path", "pet_id": pet_id, "path": str(path)}):
+            super().set_photo_path(pet_id, path)
+
+    def clear(self):
+        with self._storage.logged({"op": "clear_pets"}):
+            super().clear()
+
+
+class WALStorage(Storage):
+    """In-memory stores made durable by a write-ahead log and snapshots.
+
+    Every change is applied in memory and appended to ``wal.N.log`` under one
+    lock, so the log has the order the changes were made in; the writer then
+    waits for the group commit outside the lock. ``snapshot.N.pickle`` holds
+    the complete state as of the start of ``wal.N.log``. On startup the
+    newest snapshot is loaded and the logs from N on are replayed. Once
+    ``snapshot_every`` changes have been logged a background thread writes
+    a new snapshot and removes the files it supersedes. The cyclic garbage
+    collector is paused during recovery, which only allocates long-lived
+    objects and would otherwise spend most of its time scanning them.
+    """
+
+    def __init__(self, directory, snapshot_every: int = 100_000, check_interval: float = 10.0,
+                 commit_delay: float = 0.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        super().__init__(WALUserStore(self), WALPetStore(self))
+        gc.disable()
+        try:
+            self.segment, self._since_snapshot = self._recover()
+        finally:
+            gc.enable()
+        self.log = WriteAheadLog(self._log_path(self.segment), commit_delay)
+        self._stop = threading.Event()
+        self._snapshotter = threading.Thread(
+            target=self._run_snapshots, args=(check_interval,), name="wal-snapshot", daemon=True
+        )
+        self._snapshotter.start()
+
+    @contextmanager
+    def logged(self, record: dict) -> Iterator[None]:
+        with self._lock:
+            yield
+            sequence = self.log.append(record)
+            self._since_snapshot += 1
+        self.log.wait(sequence)
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            with self._lock:
+                self.segment += 1
+                self.log.rotate(self._log_path(self.segment))
+                state = {
+                    "version": SNAPSHOT_VERSION,
+                    "users": self.users.dump_rows(),
+                    "pets": self.pets.dump_rows()
+                }
+                self._since_snapshot = 0
+            path = self._snapshot_path(self.segment)
+            partial = path.with_name(path.name + ".part")
+            with open(partial, "wb") as snapshot:
+                pickle.dump(state, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(partial, path)
+            self._sync_directory()
+            for pattern in (LOG_PATTERN, SNAPSHOT_PATTERN):
+                for number, old in self._files(pattern):
+                    if number < self.segment:
+                        old.unlink()
+
+    def close(self):
+        self._stop.set()
+        self._snapshotter.join()
+        self.log.close()
+        super().close()
+
+    def _recover(self) -> Tuple[int, int]:
+        snapshots = self._files(SNAPSHOT_PATTERN)
+        base = snapshots[-1][0] if snapshots else 0
+        if snapshots:
+            with open(snapshots[-1][1], "rb") as snapshot:
+                state = pickle.load(snapshot)
+            UserStore.load_rows(self.users, state["users"])
+            PetStore.load_rows(self.pets, state["pets"])
+
+        logs = [(number, path) for number, path in self._files(LOG_PATTERN) if number >= base]
+        replayed = 0
+        for number, path in logs:
+            records, valid = read_log(path)
+            for record in records:
+                self._apply(record)
+            replayed += len(records)
+            if valid < path.stat().st_size:
+                os.truncate(path, valid)
+        return (logs[-1][0] if logs else base), replayed
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        if op == "add_user":
+            UserStore.add(self.users, record["key"], record["username"], record["password_hash"])
+        elif op == "remove_user":
+            UserStore.remove(self.users, record["key"])
+        elif op == "add_pets":
+            for pet in record["pets"]:
+                PetStore.add(self.pets, pet)
+        elif op == "remove_pets":
+            for pet_id in record["pet_ids"]:
+                PetStore.remove(self.pets, pet_id)
+        elif op == "update_pet":
+            PetStore.update(self.pets, {"pet_id": record["pet_id"]}, **record["fields"])
+        elif op == "update_pets":
+            PetStore.update_many(self.pets, [({"pet_id": pet_id}, fields) for pet_id, fields in record["updates"]])
+        elif op == "set_photo_path":
+            PetStore.set_photo_path(self.pets, record["pet_id"], Path(record["path"]))
+        elif op == "clear_pets":
+            PetStore.clear(self.pets)
+        else:
+            raise ValueError(f"Unknown log record: {op}")
+
+    def _run_snapshots(self, check_interval: float):
+        while not self._stop.wait(check_interval):
+            if self._since_snapshot >= self.snapshot_every:
+                self.snapshot()
+
+    def _files(self, pattern: re.Pattern) -> List[Tuple[int, Path]]:
+        found = []
+        for path in self.directory.iterdir():
+            match = pattern.fullmatch(path.name)
+            if match:
+                found.append((int(match.group(1)), path))
+        return sorted(found)
+
+    def _log_path(self, number: int) -> Path:
+        return self.directory / f"wal.{number}.log"
+
+    def _snapshot_path(self, number: int) -> Path:
+        return self.directory / f"snapshot.{number}.pickle"
+
+    def _sync_directory(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)